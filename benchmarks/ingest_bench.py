@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Compare adding orders and couriers with INSERT and with COPY.
+
+The benchmark migrates the database from DB_DSN, so all data
+there is lost. Run from the project root: `python -m benchmarks.ingest_bench`.
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Callable, List
+
+from src.db_api import Database
+from src.model import CourierModel, OrderModel
+from tests.random_data import random_courier_item, random_order
+
+
+SIZES = [1_000, 10_000, 50_000]
+
+
+def random_orders(size: int,
+                  rnd: random.Random) -> List[OrderModel]:
+    return [
+        OrderModel.construct(**random_order(order_id, rnd))
+        for order_id in range(1, size + 1)
+    ]
+
+
+def random_couriers(size: int,
+                    rnd: random.Random) -> List[CourierModel]:
+    return [
+        CourierModel.construct(**random_courier_item(courier_id, rnd))
+        for courier_id in range(1, size + 1)
+    ]
+
+
+async def measure(make_data: Callable,
+                  add: str,
+                  size: int,
+                  copy_threshold: int) -> float:
+    db = Database(copy_threshold=copy_threshold)
+    await db.connect()
+    await db.migrate()
+
+    data = make_data(size, random.Random(size))
+    try:
+        start = time.perf_counter()
+        await getattr(db, add)(data)
+        return size / (time.perf_counter() - start)
+    finally:
+        await db.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('sizes', type=int, nargs='*', default=SIZES)
+    args = parser.parse_args()
+
+    print(f"{'entity':>10} {'size':>8} {'INSERT, rows/s':>15} "
+          f"{'COPY, rows/s':>15}")
+
+    for entity, make_data, add in (('orders', random_orders, 'add_orders'),
+                                   ('couriers', random_couriers, 'add_couriers')):
+        for size in args.sizes:
+            insert = await measure(make_data, add, size, size + 1)
+            copy = await measure(make_data, add, size, 1)
+
+            print(f"{entity:>10} {size:>8} {insert:>15.0f} {copy:>15.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
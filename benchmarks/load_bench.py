@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Load the service over HTTP with realistic scenarios: ingesting couriers
+and orders in batches, concurrent assigns, completions, courier patches
+during assigns and courier reads.
+RPS and p50/p95/p99 latency of every endpoint are printed and written
+to a JSON file to compare them between commits with `--compare`.
+
+The service is started from `src/server.py` with `migrate=True`, so all
+data in DB_DSN is lost; pass `--url` to load a running one instead.
+Run from the project root: `python -m benchmarks.load_bench`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.packing_bench import percentile
+from src.db_api import format_date
+from tests.random_data import random_courier, random_order
+
+
+class Recorder:
+    """ Latencies and errors of requests by endpoint """
+    def __init__(self,
+                 client: httpx.AsyncClient) -> None:
+        self._client = client
+        self.times: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.wall_times: Dict[str, float] = defaultdict(float)
+
+    async def request(self,
+                      endpoint: str,
+                      method: str,
+                      url: str,
+                      payload: dict = None) -> Optional[dict]:
+        start = time.perf_counter()
+        try:
+            resp = await self._client.request(method, url, json=payload)
+        except httpx.HTTPError:
+            self.errors[endpoint] += 1
+            return None
+        self.times[endpoint] += [time.perf_counter() - start]
+
+        if resp.status_code >= 400:
+            self.errors[endpoint] += 1
+            return None
+        return resp.json()
+
+    async def run(self,
+                  endpoint: str,
+                  calls: List[Callable[[], Awaitable]],
+                  concurrency: int) -> list:
+        """ Make the calls at most `concurrency` at a time """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(func: Callable[[], Awaitable]):
+            async with semaphore:
+                return await func()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(call(func) for func in calls))
+        self.wall_times[endpoint] += time.perf_counter() - start
+
+        return results
+
+    def results(self) -> Dict[str, dict]:
+        return {
+            endpoint: {
+                "requests": len(times),
+                "errors": self.errors[endpoint],
+                "rps": round(len(times) / self.wall_times[endpoint], 1),
+                "p50_ms": round(percentile(times, 0.5) * 1000, 2),
+                "p95_ms": round(percentile(times, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(times, 0.99) * 1000, 2),
+                "max_ms": round(max(times) * 1000, 2)
+            }
+            for endpoint, times in self.times.items()
+        }
+
+
+def courier_json(courier_id: int,
+                 rnd: random.Random) -> dict:
+    courier = random_courier(courier_id, rnd)
+    return {
+        "courier_id": courier_id,
+        "courier_type": rnd.choice(['foot', 'bike', 'car']),
+        "regions": courier['regions'] or [1],
+        "working_hours": courier['working_hours'] or ['00:00-23:59']
+    }
+
+
+def chunks(items: list,
+           size: int) -> List[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def load(url: str,
+               args: argparse.Namespace) -> Dict[str, dict]:
+    rnd = random.Random(42)
+    couriers = [courier_json(courier_id, rnd) for courier_id in range(1, args.couriers + 1)]
+    orders = [random_order(order_id, rnd) for order_id in range(1, args.orders + 1)]
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        recorder = Recorder(client)
+
+        await recorder.run('POST /couriers', [
+            lambda chunk=chunk: recorder.request(
+                'POST /couriers', 'POST', '/couriers', {"data": chunk})
+            for chunk in chunks(couriers, args.batch_size)
+        ], args.concurrency)
+        await recorder.run('POST /orders', [
+            lambda chunk=chunk: recorder.request(
+                'POST /orders', 'POST', '/orders', {"data": chunk})
+            for chunk in chunks(orders, args.batch_size)
+        ], args.concurrency)
+
+        assigned = []
+        for _ in range(args.assign_rounds):
+            results = await recorder.run('POST /orders/assign', [
+                lambda courier_id=courier_id: recorder.request(
+                    'POST /orders/assign', 'POST', '/orders/assign',
+                    {"courier_id": courier_id})
+                for courier_id in range(1, args.couriers + 1)
+            ], args.concurrency)
+            assigned += [
+                (courier_id, order['id'])
+                for courier_id, result in enumerate(results, start=1)
+                for order in (result or {}).get('orders', [])
+            ]
+
+        complete_time = format_date(datetime.now(timezone.utc))
+        await recorder.run('POST /orders/complete', [
+            lambda courier_id=courier_id, order_id=order_id: recorder.request(
+                'POST /orders/complete', 'POST', '/orders/complete',
+                {"courier_id": courier_id, "order_id": order_id,
+                 "complete_time": complete_time})
+            for courier_id, order_id in assigned
+        ], args.concurrency)
+
+        # couriers change their types and regions while others ask for orders
+        await asyncio.gather(
+            recorder.run('PATCH /couriers/{id}', [
+                lambda courier_id=rnd.randint(1, args.couriers): recorder.request(
+                    'PATCH /couriers/{id}', 'PATCH', f"/couriers/{courier_id}", {
+                        "courier_type": rnd.choice(['foot', 'bike', 'car']),
+                        "regions": courier_json(courier_id, rnd)['regions']
+                    })
+                for _ in range(args.patches)
+            ], args.concurrency // 2 or 1),
+            recorder.run('POST /orders/assign', [
+                lambda courier_id=courier_id: recorder.request(
+                    'POST /orders/assign', 'POST', '/orders/assign',
+                    {"courier_id": courier_id})
+                for courier_id in range(1, args.couriers + 1)
+            ], args.concurrency // 2 or 1)
+        )
+
+        await recorder.run('GET /couriers/{id}', [
+            lambda: recorder.request(
+                'GET /couriers/{id}', 'GET',
+                f"/couriers/{rnd.randint(1, args.couriers)}")
+            for _ in range(args.reads)
+        ], args.concurrency)
+
+    return recorder.results()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "HOST": '127.0.0.1',
+        "PORT": str(port),
+        "DEBUG": 'False',
+        "migrate": 'True',
+        "LOG_FOLDER": os.environ.get(
+            'LOG_FOLDER', os.path.join(tempfile.gettempdir(), 'candy_shop_bench'))
+    }
+    # the reloader starts the server in a child process,
+    # so they're stopped together as a process group
+    return subprocess.Popen(
+        [sys.executable, 'src/server.py'], env=env, start_new_session=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(url: str,
+                     timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get('/executor/stats')).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"The service at {url} isn't ready in {timeout}s")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, dict],
+                  previous: Dict[str, dict] = None) -> None:
+    previous = previous or {}
+
+    def change(endpoint: str, field: str) -> str:
+        if endpoint not in previous or not previous[endpoint][field]:
+            return ''
+        return f"{results[endpoint][field] / previous[endpoint][field] - 1:+.0%}"
+
+    print(f"{'endpoint':<24} {'requests':>8} {'errors':>6} {'rps':>14} "
+          f"{'p50, ms':>9} {'p95, ms':>9} {'p99, ms':>16}")
+    for endpoint, result in results.items():
+        print(f"{endpoint:<24} {result['requests']:>8} {result['errors']:>6} "
+              f"{result['rps']:>8} {change(endpoint, 'rps'):>5} "
+              f"{result['p50_ms']:>9} {result['p95_ms']:>9} "
+              f"{result['p99_ms']:>10} {change(endpoint, 'p99_ms'):>5}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="load a running service instead of starting one")
+    parser.add_argument('--couriers', type=int, default=200)
+    parser.add_argument('--orders', type=int, default=20_000)
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="couriers or orders in one POST")
+    parser.add_argument('--assign-rounds', type=int, default=3,
+                        help="how many times every courier asks for orders")
+    parser.add_argument('--patches', type=int, default=1000,
+                        help="count of PATCH /couriers/{id} sent during an assign round")
+    parser.add_argument('--reads', type=int, default=5000,
+                        help="count of GET /couriers/{id}")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--output', default='load_bench.json',
+                        help="file the results are written to")
+    parser.add_argument('--compare', help="results of a previous run to compare with")
+    args = parser.parse_args()
+
+    server, url = None, args.url
+    if url is None:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = start_server(port)
+
+    try:
+        asyncio.run(wait_ready(url))
+        results = asyncio.run(load(url, args))
+    finally:
+        if server is not None:
+            os.killpg(server.pid, signal.SIGINT)
+            server.wait(timeout=30)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    print_results(results, previous)
+
+    report = {
+        "commit": git_commit(),
+        "date": format_date(datetime.now(timezone.utc)),
+        "params": {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ('url', 'output', 'compare')
+        },
+        "results": results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Results are written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Compare matching free orders with a courier one by one
+(`_Order` + `_Courier.is_order_valid`) and with `OrdersBatch`.
+
+Run from the project root: `python -m benchmarks.matching_bench`.
+"""
+import argparse
+import random
+import time
+from typing import Callable, List
+
+from src.db_api import _Courier, _Order
+from src.matching import OrdersBatch
+from tests.random_data import random_courier, random_order
+
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+
+def per_object(orders: List[dict],
+               courier: _Courier) -> List[int]:
+    return [
+        order.order_id
+        for order in map(_Order, orders)
+        if courier.is_order_valid(order)
+    ]
+
+
+def vectorized(orders: List[dict],
+               courier: _Courier) -> List[int]:
+    return [
+        orders[index]['order_id']
+        for index in OrdersBatch(orders).match(courier)
+    ]
+
+
+def measure(func: Callable,
+            *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('sizes', type=int, nargs='*', default=SIZES)
+    parser.add_argument('--couriers', type=int, default=5,
+                        help="how many couriers to match with the same orders")
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    print(f"{'orders':>10} {'per object, s':>15} {'batch, s':>10} "
+          f"{'match only, ms':>15} {'speedup':>8}")
+
+    for size in args.sizes:
+        orders = [
+            random_order(order_id, rnd)
+            for order_id in range(1, size + 1)
+        ]
+        couriers = []
+        while len(couriers) < args.couriers:
+            courier = _Courier(random_courier(len(couriers) + 1, rnd))
+            # couriers with no regions or working hours match nothing
+            if courier.regions and courier.working_hours:
+                couriers += [courier]
+
+        for courier in couriers:
+            assert per_object(orders, courier) == vectorized(orders, courier)
+
+        per_object_time = min(measure(per_object, orders, c) for c in couriers)
+        batch_time = min(measure(vectorized, orders, c) for c in couriers)
+
+        batch = OrdersBatch(orders)
+        match_time = min(measure(batch.match, c) for c in couriers)
+
+        print(f"{size:>10} {per_object_time:>15.4f} {batch_time:>10.4f} "
+              f"{match_time * 1000:>15.3f} {per_object_time / batch_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Measure latency of choosing orders to fill the remaining capacity
+of a courier with every packing strategy at large backlogs.
+
+Run from the project root: `python -m benchmarks.packing_bench`.
+"""
+import argparse
+import random
+import time
+from typing import List
+
+from src.assignment import pack
+from tests.random_data import random_weights
+
+
+SIZES = [1_000, 10_000, 100_000]
+PAYLOADS = [10, 15, 50]
+
+
+def percentile(values: List[float],
+               share: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('sizes', type=int, nargs='*', default=SIZES)
+    parser.add_argument('--calls', type=int, default=50,
+                        help="how many couriers to pack for every size")
+    parser.add_argument('--max-items', type=int, default=200,
+                        help="count of orders the knapsack is solved for")
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    print(f"{'orders':>10} {'strategy':>10} {'p50, ms':>10} "
+          f"{'p99, ms':>10} {'max, ms':>10} {'load':>8}")
+
+    for size in args.sizes:
+        weights = random_weights(size, rnd)
+        # payloads minus random loads of orders being delivered
+        capacities = [
+            rnd.choice(PAYLOADS) * rnd.random()
+            for _ in range(args.calls)
+        ]
+
+        for strategy in ('greedy', 'knapsack'):
+            times, loads = [], []
+            for capacity in capacities:
+                start = time.perf_counter()
+                packed = pack(weights, capacity, strategy, args.max_items)
+                times += [time.perf_counter() - start]
+                loads += [sum(weights[index] for index in packed) / capacity]
+
+            print(f"{size:>10} {strategy:>10} {percentile(times, 0.5) * 1000:>10.3f} "
+                  f"{percentile(times, 0.99) * 1000:>10.3f} {max(times) * 1000:>10.3f} "
+                  f"{sum(loads) / len(loads):>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
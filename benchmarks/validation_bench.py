@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Compare validating payloads with pydantic models item
+by item and with the batch validators.
+
+Run from the project root: `python -m benchmarks.validation_bench`.
+"""
+import argparse
+import logging
+import random
+import time
+from typing import Callable, List
+
+from pydantic import ValidationError
+
+from src.model import CourierModel, OrderModel, \
+    COURIERS_VALIDATOR, ORDERS_VALIDATOR
+from tests.random_data import random_courier_item, random_order
+
+
+SIZES = [100_000]
+
+
+def random_couriers(size: int,
+                    rnd: random.Random) -> List[dict]:
+    return [
+        random_courier_item(courier_id, rnd)
+        for courier_id in range(1, size + 1)
+    ]
+
+
+def random_orders(size: int,
+                  rnd: random.Random) -> List[dict]:
+    return [
+        random_order(order_id, rnd)
+        for order_id in range(1, size + 1)
+    ]
+
+
+def align_spans(items: List[dict],
+                field: str,
+                step: int,
+                rnd: random.Random) -> None:
+    """ Replace spans with ones starting and stopping every `step`
+    minutes, real schedules repeat much more than random ones """
+    stops = range(step, 24 * 60, step)
+    for item in items:
+        spans = []
+        for _ in item[field]:
+            start, stop = sorted(rnd.sample([0, *stops], 2))
+            spans += [f"{start // 60:02}:{start % 60:02}-{stop // 60:02}:{stop % 60:02}"]
+        item[field] = spans
+
+
+def with_pydantic(model, id_field: str, items: List[dict]):
+    valid, invalid_ids = [], []
+    for item in items:
+        try:
+            valid += [model(**item)]
+        except ValidationError:
+            invalid_ids += [item.get(id_field, -1)]
+    return valid, invalid_ids
+
+
+def measure(func: Callable,
+            *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('sizes', type=int, nargs='*', default=SIZES)
+    parser.add_argument('--invalid', type=float, default=0.01,
+                        help="share of invalid items")
+    parser.add_argument('--step', type=int, default=None,
+                        help="align spans to this number of minutes, "
+                             "spans are random by default")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    rnd = random.Random(42)
+
+    print(f"{'entity':>10} {'size':>8} {'pydantic, s':>12} "
+          f"{'batch, s':>10} {'speedup':>8}")
+
+    for entity, make_items, model, id_field, spans_field, validator in (
+            ('couriers', random_couriers, CourierModel, 'courier_id',
+             'working_hours', COURIERS_VALIDATOR),
+            ('orders', random_orders, OrderModel, 'order_id',
+             'delivery_hours', ORDERS_VALIDATOR)):
+        for size in args.sizes:
+            items = make_items(size, rnd)
+            if args.step:
+                align_spans(items, spans_field, args.step, rnd)
+            for item in rnd.sample(items, int(size * args.invalid)):
+                item[id_field] = -item[id_field]
+
+            expected = with_pydantic(model, id_field, items)
+            assert validator.validate_batch(items)[1] == expected[1]
+
+            pydantic_time = measure(with_pydantic, model, id_field, items)
+            batch_time = measure(validator.validate_batch, items)
+
+            print(f"{entity:>10} {size:>8} {pydantic_time:>12.3f} "
+                  f"{batch_time:>10.3f} {pydantic_time / batch_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
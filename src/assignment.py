@@ -0,0 +1,145 @@
+from typing import List, Mapping, Sequence
+
+import numpy as np
+
+from src.matching import OrdersBatch
+
+
+__all__ = 'pack', 'dispatch', 'PACKING_STRATEGIES'
+
+# 'all' – every matching order, the load isn't checked,
+# 'greedy' – the oldest orders fitting the remaining capacity,
+# 'knapsack' – the heaviest load of the oldest orders, then 'greedy'
+PACKING_STRATEGIES = [
+    'all', 'greedy', 'knapsack'
+]
+# weights are REAL with two decimal places, they are
+# packed as integers to avoid rounding errors
+WEIGHT_SCALE = 100
+
+
+def _to_units(weights: Sequence[float]) -> np.ndarray:
+    return np.rint(np.asarray(weights, dtype=np.float64) * WEIGHT_SCALE).astype(np.int64)
+
+
+def _capacity_units(capacity: float) -> int:
+    return max(int(np.floor(capacity * WEIGHT_SCALE + 1e-6)), 0)
+
+
+def _pack_greedy(units: np.ndarray,
+                 capacity: int,
+                 indexes: np.ndarray) -> List[int]:
+    """ Take the orders in the order of `indexes` while they fit """
+    indexes = indexes[units[indexes] <= capacity]
+    if not indexes.size:
+        return []
+
+    # if the rest is lighter than the lightest order left, it's over
+    lightest_left = np.minimum.accumulate(units[indexes][::-1])[::-1].tolist()
+
+    packed = []
+    for index, weight, lightest in zip(indexes.tolist(), units[indexes].tolist(),
+                                       lightest_left):
+        if capacity < lightest:
+            break
+        if weight <= capacity:
+            packed += [index]
+            capacity -= weight
+    return packed
+
+
+def _pack_knapsack(units: np.ndarray,
+                   capacity: int,
+                   max_items: int) -> List[int]:
+    """
+    0/1 knapsack maximizing the load over the first `max_items`
+    orders fitting the capacity, the rest fill it greedily.
+    """
+    fitting = np.flatnonzero(units <= capacity)
+    candidates, rest = fitting[:max_items], fitting[max_items:]
+    if not candidates.size:
+        return []
+
+    # best[c] – the heaviest load not heavier than c,
+    # taken[i, c] – whether the i-th candidate is in it
+    best = np.zeros(capacity + 1, dtype=np.int64)
+    taken = np.zeros((candidates.size, capacity + 1), dtype=bool)
+    for i, weight in enumerate(units[candidates].tolist()):
+        with_item = best[:capacity + 1 - weight] + weight
+        is_better = with_item > best[weight:]
+        taken[i, weight:] = is_better
+        best[weight:] = np.where(is_better, with_item, best[weight:])
+
+    packed, left = [], capacity
+    for i in range(candidates.size - 1, -1, -1):
+        if taken[i, left]:
+            packed += [int(candidates[i])]
+            left -= int(units[candidates[i]])
+    packed.reverse()
+
+    return packed + _pack_greedy(units, left, rest)
+
+
+def pack(weights: Sequence[float],
+         capacity: float,
+         strategy: str = 'greedy',
+         max_items: int = 200) -> List[int]:
+    """
+    Choose orders to fill the remaining capacity of a courier.
+
+    Orders are expected to be sorted from the oldest one.
+
+    :param weights: weights of the orders.
+    :param capacity: payload of the courier minus his current load.
+    :param max_items: count of orders the knapsack is solved for,
+    it takes O(max_items * capacity * 100) time and memory.
+    :return: sorted indexes of the chosen orders.
+    """
+    if strategy not in PACKING_STRATEGIES:
+        raise ValueError(f"Strategy must be one of {PACKING_STRATEGIES}, "
+                         f"but '{strategy}' found")
+
+    if strategy == 'all':
+        return list(range(len(weights)))
+    if not len(weights):
+        return []
+
+    units, capacity = _to_units(weights), _capacity_units(capacity)
+
+    if strategy == 'greedy':
+        return _pack_greedy(units, capacity, np.arange(units.size))
+    return sorted(_pack_knapsack(units, capacity, max_items))
+
+
+def dispatch(couriers: Sequence,
+             capacities: Sequence[float],
+             orders: Sequence[Mapping],
+             strategy: str = 'greedy',
+             max_items: int = 200) -> List[List[int]]:
+    """
+    Assign free orders to many couriers at once, every order to one
+    courier at most. Couriers with fewer matching orders choose first,
+    so ones able to deliver many orders don't take all of them.
+
+    :param couriers: couriers as `_Courier`.
+    :param capacities: payloads the couriers have left.
+    :param orders: free orders sorted from the oldest one.
+    :return: indexes of the orders for every courier.
+    """
+    batch = OrdersBatch(orders)
+    is_free = np.ones(len(batch), dtype=bool)
+
+    matched = [
+        np.asarray(batch.match(courier), dtype=np.int64)
+        for courier in couriers
+    ]
+
+    assigned = [[] for _ in couriers]
+    for i in sorted(range(len(couriers)), key=lambda i: matched[i].size):
+        indexes = matched[i][is_free[matched[i]]]
+        indexes = indexes[pack(batch.weights[indexes], capacities[i], strategy, max_items)]
+
+        is_free[indexes] = False
+        assigned[i] = indexes.tolist()
+
+    return assigned
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional
+
+
+__all__ = 'LRUCache',
+
+
+class LRUCache:
+    """ Bounded mapping dropping the least recently used items.
+
+    `generation` changes with every write, so a value loaded from
+    the database is put only if nothing was written while it was
+    being loaded, see `put_loaded`.
+    """
+    def __init__(self,
+                 max_size: int) -> None:
+        self._max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self,
+            key: Hashable) -> Optional[Any]:
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self,
+            key: Hashable,
+            value: Any) -> None:
+        self.generation += 1
+        if self._max_size <= 0:
+            return
+
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def put_loaded(self,
+                   key: Hashable,
+                   value: Any,
+                   generation: int) -> None:
+        """ Put the value loaded since `generation` if it's still actual """
+        if generation == self.generation:
+            self.put(key, value)
+
+    def invalidate(self,
+                   keys: Iterable[Hashable]) -> None:
+        self.generation += 1
+        for key in keys:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._items),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Check the courier region stats, which ratings are read from,
+against ones computed from all completed orders in `status`.
+
+Run from the project root: `python -m src.check_region_stats [--fix]`.
+Exit code is 1 if some stats differ and they aren't fixed.
+"""
+import argparse
+import asyncio
+import sys
+
+from src.db_api import Database
+
+
+async def check(fix: bool) -> int:
+    db = Database()
+    await db.connect()
+
+    try:
+        mismatches = await db.check_courier_region_stats()
+        for mismatch in mismatches:
+            print("Courier id={courier_id}, region={region}: stored "
+                  "{stored}, computed {computed}".format(**mismatch))
+
+        if not mismatches:
+            print("Courier region stats are consistent")
+            return 0
+        if not fix:
+            return 1
+
+        await db.rebuild_courier_region_stats()
+        print(f"{len(mismatches)} courier region stats fixed")
+        return 0
+    finally:
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fix', action='store_true',
+                        help="rebuild the stats if they differ")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(check(args.fix)))
+
+
+if __name__ == "__main__":
+    main()
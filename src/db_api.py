@@ -1,16 +1,29 @@
+import asyncio
+import itertools
+import json
+import time
+from contextlib import asynccontextmanager, AsyncExitStack
 from dataclasses import dataclass
-from datetime import time, datetime
-from typing import List, Iterable, Dict, Optional, Tuple
+from datetime import datetime, timezone
+from typing import List, Iterable, Dict, Optional, Tuple, AsyncIterator, \
+    Callable, Awaitable, Mapping, Sequence
 
 import asyncpg
 from environs import Env
 from sanic.log import logger, error_logger
 
-from src.db_commands import COMMANDS, TABLES
+from src.assignment import pack, dispatch, PACKING_STRATEGIES
+from src.cache import LRUCache
+from src.db_commands import COMMANDS, TABLES, QUERIES, STATUS_FIELDS, CHANGES_CHANNEL
+from src.executor import Executor
+from src.matching import OrdersBatch
+from src.metrics import timed, BATCH_SIZE, DB_METHOD_DURATION, POOL_ACQUIRE_DURATION
+from src.schedule import TimeSpan, DaySchedule
 
 
 DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
-TIME_FORMAT = "%H:%M"
+# DATE_FORMAT for `%` formatting, it's faster than `strftime`
+_DATE_TEMPLATE = "%04d-%02d-%02dT%02d:%02d:%02d.%06dZ"
 PATCHABLE_FIELDS = [
     'courier_type', 'regions', 'working_hours'
 ]
@@ -19,6 +32,12 @@ DEFAULT_COURIER_TYPES = [
     {"type": 'bike', 'c': 5, 'payload': 15},
     {"type": 'car', 'c': 9, 'payload': 50},
 ]
+MATCHING_MODES = [
+    'db', 'python', 'vector'
+]
+# the average delivery time which makes the rating zero, seconds
+MAX_DELIVERY_TIME = 60 * 60
+MAX_RATING = 5
 
 
 def is_json_patching_courier_valid(json_dict: dict) -> List[str]:
@@ -37,46 +56,14 @@ def is_json_patching_courier_valid(json_dict: dict) -> List[str]:
 env = Env()
 env.read_env()
 
+DEBUG = env.bool('DEBUG', False)
+# with DEBUG=False one of QUERY_LOG_SAMPLE queries is logged
+# in one line cut to QUERY_LOG_MAX_LENGTH chars, so logging
+# doesn't depend on the size of queries
+QUERY_LOG_SAMPLE = env.int('QUERY_LOG_SAMPLE', 100)
+QUERY_LOG_MAX_LENGTH = env.int('QUERY_LOG_MAX_LENGTH', 200)
 
-class TimeSpan:
-    def __init__(self,
-                 value: str) -> None:
-        start, stop = value.split('-')
-
-        self.__start = TimeSpan.parse_time(start)
-        self.__stop = TimeSpan.parse_time(stop)
-
-        if start >= stop:
-            raise ValueError("Start must me be less than stop")
-
-    @property
-    def start(self) -> time:
-        return self.__start
-
-    @property
-    def stop(self) -> time:
-        return self.__stop
-
-    @classmethod
-    def parse_time(cls,
-                   time_string: str) -> time:
-        return datetime.strptime(time_string, TIME_FORMAT).time()
-
-    def is_intercept(self, other) -> bool:
-        return self | other
-
-    def __or__(self, other) -> bool:
-        if self.start <= other.start:
-            return not(self.stop <= other.start)
-        return not(other.stop <= self.start)
-
-    def __repr__(self) -> str:
-        return f"{self.start.strftime(TIME_FORMAT)}-" \
-               f"{self.stop.strftime(TIME_FORMAT)}"
-
-    def __eq__(self, other) -> bool:
-        return self.start == other.start and \
-               self.stop == other.stop
+_queries_count = itertools.count()
 
 
 @dataclass
@@ -87,11 +74,16 @@ class _Courier:
     working_hours: List[TimeSpan]
     coeff: int
     payload: int
+    schedule: DaySchedule
 
     def __init__(self,
-                 courier: asyncpg.Record) -> None:
+                 courier: asyncpg.Record,
+                 courier_type: Mapping = None) -> None:
+        """ `type`, `c` and `payload` are taken from
+        the courier_types row if it's passed """
+        courier_type = courier_type or courier
         self.courier_id = int(courier.get('courier_id'))
-        self.courier_type = courier.get('type')
+        self.courier_type = courier_type.get('type')
         self.regions = [
             int(region)
             for region in courier.get('regions')
@@ -100,8 +92,9 @@ class _Courier:
             TimeSpan(time_)
             for time_ in courier.get('working_hours')
         ]
-        self.coeff = int(courier.get('c'))
-        self.payload = int(courier.get('payload'))
+        self.coeff = int(courier_type.get('c'))
+        self.payload = int(courier_type.get('payload'))
+        self.schedule = DaySchedule(self.working_hours)
 
     def dict(self) -> dict:
         return self.__dict__
@@ -121,33 +114,69 @@ class _Courier:
         }
 
     def external(self) -> dict:
-        json_dict = self.json_dict()
-        json_dict.pop('c')
-        json_dict.pop('payload')
-
-        return json_dict
+        """ Fields sent to clients, it's used to serialize the courier """
+        return {
+            "courier_id": self.courier_id,
+            "courier_type": self.courier_type,
+            "regions": self.regions,
+            "working_hours": [
+                str(span)
+                for span in self.working_hours
+            ]
+        }
 
     def is_order_valid(self, order) -> bool:
-        is_time_intercept = False
-        for w_time in self.working_hours:
-            for d_time in order.delivery_hours:
-                if w_time | d_time:
-                    is_time_intercept = True
-                    break
-
         return (
             order.weight <= self.payload and
             order.region in self.regions and
-            is_time_intercept
+            self.schedule & order.schedule
         )
 
 
+class _CourierTypes:
+    """ Rows of courier_types by id and by type.
+
+    The table is filled once by `migrate`, so it's loaded at connect
+    and couriers are read and written without joining it.
+    """
+    def __init__(self) -> None:
+        self._by_id: Dict[int, Mapping] = {}
+        self._ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def load(self,
+             records: Iterable[Mapping]) -> None:
+        self._by_id = {
+            record['id']: {
+                "type": record['type'],
+                "c": record['c'],
+                "payload": record['payload']
+            }
+            for record in records
+        }
+        self._ids = {
+            courier_type['type']: id_
+            for id_, courier_type in self._by_id.items()
+        }
+
+    def __getitem__(self,
+                    id_: int) -> Mapping:
+        return self._by_id[id_]
+
+    def id(self,
+           courier_type: Optional[str]) -> Optional[int]:
+        return self._ids.get(courier_type)
+
+
 @dataclass
 class _Order:
     order_id: int
     weight: float
     region: int
     delivery_hours: List[TimeSpan]
+    schedule: DaySchedule
 
     def __init__(self,
                  order: asyncpg.Record) -> None:
@@ -158,6 +187,18 @@ class _Order:
             TimeSpan(time_)
             for time_ in order.get('delivery_hours')
         ]
+        self.schedule = DaySchedule(self.delivery_hours)
+
+    def external(self) -> dict:
+        return {
+            "order_id": self.order_id,
+            "weight": self.weight,
+            "region": self.region,
+            "delivery_hours": [
+                str(span)
+                for span in self.delivery_hours
+            ]
+        }
 
 
 @dataclass
@@ -165,6 +206,7 @@ class _Status:
     id: int
     courier_id: int
     order_id: int
+    delivery_id: Optional[int] = None
     assigned_time: Optional[datetime] = None
     completed_time: Optional[datetime] = None
 
@@ -174,28 +216,33 @@ class _Status:
         self.courier_id = int(status.get('courier_id'))
         self.order_id = int(status.get('order_id'))
 
-        if assigned_time := status.get('assigned_time', None):
-            self.assigned_time = parse_date(assigned_time)
-        if completed_time := status.get('completed_time', None):
-            self.completed_time = parse_date(completed_time)
+        if (delivery_id := status.get('delivery_id', None)) is not None:
+            self.delivery_id = int(delivery_id)
+
+        # TIMESTAMPTZ are decoded by asyncpg
+        self.assigned_time = status.get('assigned_time', None)
+        self.completed_time = status.get('completed_time', None)
 
     def dict(self) -> dict:
         return self.__dict__
 
     def json_dict(self) -> dict:
         if assigned_time := self.assigned_time:
-            assigned_time = assigned_time.strftime(DATE_FORMAT)
+            assigned_time = format_date(assigned_time)
         if completed_time := self.completed_time:
-            completed_time = completed_time.strftime(DATE_FORMAT)
+            completed_time = format_date(completed_time)
 
         return {
             "id": self.id,
             "courier_id": self.courier_id,
             "order_id": self.order_id,
+            "delivery_id": self.delivery_id,
             "assigned_time": assigned_time,
             "completed_time": completed_time
         }
 
+    external = json_dict
+
 
 @dataclass
 class CourierStatus:
@@ -204,7 +251,7 @@ class CourierStatus:
     courier: _Courier
 
     def __init__(self,
-                 data: List[asyncpg.Record],
+                 data: List[Mapping],
                  courier: _Courier) -> None:
         self.orders = [
             _Order(order)
@@ -217,36 +264,308 @@ class CourierStatus:
         self.courier = courier
 
 
-def now() -> str:
-    return datetime.now().strftime(DATE_FORMAT)
+def _match_one_by_one(courier: _Courier,
+                      orders: Sequence[Mapping]) -> List[int]:
+    """ Get indexes of the orders the courier is able to deliver """
+    return [
+        index
+        for index, order in enumerate(orders)
+        if courier.is_order_valid(_Order(order))
+    ]
+
+
+def _match_vectorized(courier: _Courier,
+                      orders: Sequence[Mapping]) -> List[int]:
+    """ The same as `_match_one_by_one` with NumPy """
+    return OrdersBatch(orders).match(courier)
+
+
+def rating(min_average_duration: float) -> float:
+    """
+    Get rating of a courier by the minimal average delivery
+    duration over regions, where he completed orders.
+    """
+    duration = min(min_average_duration, MAX_DELIVERY_TIME)
+    return round((MAX_DELIVERY_TIME - duration) / MAX_DELIVERY_TIME * MAX_RATING, 2)
+
+
+def compare_region_stats(stored: Iterable[Mapping],
+                         computed: Iterable[Mapping],
+                         tolerance: float = 1e-3) -> List[dict]:
+    """
+    Compare stored courier region stats with ones computed from history.
+
+    :return: stats which differ, `stored` and `computed` are
+    pairs of duration sum and deliveries count or None if missing.
+    """
+    def by_key(stats: Iterable[Mapping]) -> Dict[Tuple[int, int], Tuple[float, int]]:
+        return {
+            (row['courier_id'], row['region']): (row['duration_sum'], row['deliveries_count'])
+            for row in stats
+        }
+
+    stored, computed = by_key(stored), by_key(computed)
+
+    mismatches = []
+    for courier_id, region in sorted(stored.keys() | computed.keys()):
+        stored_ = stored.get((courier_id, region))
+        computed_ = computed.get((courier_id, region))
+
+        if stored_ and computed_ and stored_[1] == computed_[1] and \
+                abs(stored_[0] - computed_[0]) <= tolerance:
+            continue
+
+        mismatches += [{
+            "courier_id": courier_id,
+            "region": region,
+            "stored": stored_,
+            "computed": computed_
+        }]
+    return mismatches
+
+
+def shorten_query(query: str,
+                  max_length: int = QUERY_LOG_MAX_LENGTH) -> str:
+    """ The query in one line cut to `max_length` chars """
+    short_query = " ".join(query[:max_length].split())
+    if len(query) > max_length:
+        short_query += f"... ({len(query)} chars)"
+    return short_query
+
+
+def _log_query(query: str) -> None:
+    if DEBUG:
+        logger.debug("Requested to the database:\n %s", query)
+    elif next(_queries_count) % QUERY_LOG_SAMPLE == 0:
+        logger.info("Requested to the database: %s", shorten_query(query))
+
+
+def array_literal(values: Iterable) -> str:
+    """ Get PostgreSQL array literal of the values, like '{"1","2"}' """
+    values = ','.join(
+        '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for value in values
+    )
+    return f"{{{values}}}"
+
+
+def now() -> datetime:
+    return datetime.now(timezone.utc)
 
 
 def parse_date(date_str: str) -> datetime:
-    return datetime.strptime(date_str, DATE_FORMAT)
+    """ Parse the date in DATE_FORMAT, it's in UTC """
+    return datetime.strptime(date_str, DATE_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def format_date(date: datetime) -> str:
+    """
+    Format the date to DATE_FORMAT in UTC, naive dates are in UTC.
+
+    It's the same as `strftime(DATE_FORMAT)` for years 1000-9999,
+    but about twice faster, it matters for long courier histories.
+    """
+    if (tz := date.tzinfo) is not None and tz is not timezone.utc:
+        date = date.astimezone(timezone.utc)
+    return _DATE_TEMPLATE % (date.year, date.month, date.day, date.hour,
+                             date.minute, date.second, date.microsecond)
 
 
 class Database:
-    def __init__(self) -> None:
+    def __init__(self,
+                 matching: str = None,
+                 copy_threshold: int = None,
+                 executor: Executor = None,
+                 dsn: str = None,
+                 packing: str = None,
+                 dispatch_executor: Executor = None) -> None:
         self._pool = None
+        self._dsn = dsn
+        # to match free orders out of the event loop
+        self._executor = executor or Executor(kind='none')
+        # to match the free pool with many couriers at once
+        self._dispatch_executor = dispatch_executor or self._executor
+        # batches with at least this count of couriers or
+        # orders are added with COPY instead of INSERT
+        self._copy_threshold = copy_threshold or env.int('COPY_THRESHOLD', 1000)
+        # where to match free orders with the courier:
+        # 'db' – filter them in Postgres, 'python' – load all
+        # free orders and filter them with `_Courier.is_order_valid`,
+        # 'vector' – load all free orders and filter them with `OrdersBatch`
+        self._matching = matching or env('MATCHING', 'db')
+
+        if self._matching not in MATCHING_MODES:
+            raise ValueError(f"Matching must be one of {MATCHING_MODES}, "
+                             f"but '{self._matching}' found")
+
+        # how to choose matched orders to fill the remaining
+        # capacity of the courier, see `src.assignment.pack`
+        self._packing = packing or env('PACKING', 'greedy')
+        self._knapsack_max_items = env.int('KNAPSACK_MAX_ITEMS', 200)
+
+        if self._packing not in PACKING_STRATEGIES:
+            raise ValueError(f"Packing must be one of {PACKING_STRATEGIES}, "
+                             f"but '{self._packing}' found")
+
+        # couriers read by id, `update_courier` removes the updated one,
+        # changes made by other workers come from CHANGES_CHANNEL,
+        # 0 disables it
+        self._couriers = LRUCache(env.int('COURIER_CACHE_SIZE', 10000))
+
+        # changes of the tables are received by a dedicated connection,
+        # local state is cached only while it's listening
+        self._listener: Optional[asyncpg.Connection] = None
+        self._relisten_delay = env.float('RELISTEN_DELAY', 5)
+        self._change_handlers: Dict[str, List[Callable[[str, Optional[List[int]]], None]]] = {}
+        self.on_change('couriers', self._invalidate_couriers)
+
+        # responses replayed to retries of requests with the same key
+        self._responses_ttl = env.float('IDEMPOTENCY_TTL', 24 * 60 * 60)
+        # requests of dead workers don't block retries for long
+        self._responses_lock_timeout = env.float('IDEMPOTENCY_LOCK_TIMEOUT', 60)
+        self._responses_max_count = env.int('IDEMPOTENCY_MAX_KEYS', 100000)
+
+        self._courier_types = _CourierTypes()
+        # reloaded if another worker migrates the tables
+        self.on_change('courier_types', lambda op, ids: asyncio.ensure_future(
+            self._load_courier_types()))
 
     async def connect(self) -> None:
         if self._pool:
             return
         logger.info("Connecting to the database")
+        # every query is a constant from QUERIES with parameters,
+        # so asyncpg prepares it once per connection and then
+        # takes it from the connection's statement cache
         self._pool: asyncpg.Pool = await asyncpg.create_pool(
-            dsn=env('DB_DSN'),
+            dsn=self._dsn or env('DB_DSN'),
             command_timeout=60,
-            max_size=20
+            max_size=20,
+            statement_cache_size=env.int('STATEMENT_CACHE_SIZE', 100)
         )
         logger.info("Connection pool created")
+        await self._listen()
+        try:
+            await self._load_courier_types()
+        except asyncpg.UndefinedTableError:
+            logger.info("courier_types are loaded after migration")
+
+    async def _load_courier_types(self,
+                                  conn: asyncpg.Connection = None) -> None:
+        if conn is None:
+            async with self._acquire() as conn:
+                return await self._load_courier_types(conn)
+
+        self._courier_types.load(await self._get(QUERIES['get_courier_types'], conn))
+        logger.info("%s courier types loaded", len(self._courier_types))
+
+    def _courier(self,
+                 record: asyncpg.Record) -> _Courier:
+        return _Courier(record, self._courier_types[record.get('courier_type')])
+
+    def on_change(self,
+                  table: str,
+                  handler: Callable[[str, Optional[List[int]]], None]) -> None:
+        """
+        Call the handler with the operation and ids of rows on every
+        committed change of 'couriers' or 'courier_types' by any
+        worker. Ids are None if there were too many of them and
+        the operation is 'INVALIDATE' if changes might be missed
+        while the listening connection is lost.
+        """
+        self._change_handlers.setdefault(table, []).append(handler)
+
+    @property
+    def is_listening(self) -> bool:
+        return self._listener is not None and not self._listener.is_closed()
+
+    async def _listen(self) -> None:
+        if self._pool is None:
+            return
+        try:
+            listener = await asyncpg.connect(dsn=self._dsn or env('DB_DSN'))
+            await listener.add_listener(CHANGES_CHANNEL, self._receive_change)
+        except (OSError, asyncpg.PostgresError):
+            error_logger.exception("Listening to changes failed, retry in %ss",
+                                   self._relisten_delay)
+            self._relisten()
+            return
+
+        if self._pool is None:
+            # closed while connecting
+            await listener.close()
+            return
+        listener.add_termination_listener(self._lose_listener)
+        self._listener = listener
+        logger.info("Listening to changes")
+
+    def _relisten(self) -> None:
+        asyncio.get_event_loop().call_later(
+            self._relisten_delay, lambda: asyncio.ensure_future(self._listen()))
+
+    def _lose_listener(self,
+                       listener: asyncpg.Connection) -> None:
+        """ Changes might be missed, so the cached state is dropped """
+        if listener is not self._listener:
+            # closed by `close`
+            return
+
+        self._listener = None
+        self._invalidate_all()
+        error_logger.warning("Connection listening to changes lost, "
+                             "retry in %ss", self._relisten_delay)
+        self._relisten()
+
+    def _receive_change(self,
+                        listener: asyncpg.Connection,
+                        pid: int,
+                        channel: str,
+                        payload: str) -> None:
+        change = json.loads(payload)
+        for handler in self._change_handlers.get(change['table'], []):
+            handler(change['op'], change['ids'])
+
+    def _invalidate_all(self) -> None:
+        for table, handlers in self._change_handlers.items():
+            for handler in handlers:
+                handler('INVALIDATE', None)
+
+    def _invalidate_couriers(self,
+                             op: str,
+                             ids: Optional[List[int]]) -> None:
+        if ids is None:
+            self._couriers.clear()
+        else:
+            self._couriers.invalidate(ids)
+
+    @asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        start = time.perf_counter()
+        async with self._pool.acquire() as conn:
+            POOL_ACQUIRE_DURATION.observe(time.perf_counter() - start)
+            yield conn
+
+    def pool_stats(self) -> Tuple[int, int]:
+        """ Count of open connections and ones not in use """
+        if not self._pool:
+            return 0, 0
+        # asyncpg 0.22 has no `get_size` and `get_idle_size`
+        holders = [holder for holder in self._pool._holders if holder._con is not None]
+        idle = [holder for holder in holders if holder._in_use is None]
+
+        return len(holders), len(idle)
 
     async def close(self) -> None:
         logger.info("Closing connection to the database")
+        if (listener := self._listener) is not None:
+            self._listener = None
+            await listener.close()
         try:
             await self._pool.close()
         except AttributeError:
             logger.info("Connection was not created")
             pass
+        self._pool = None
         logger.info("Connection pool closed")
 
     async def migrate(self) -> None:
@@ -254,12 +573,26 @@ class Database:
         Make migration: drop all databases with the same names,
         create new ones according to the schemas.
         """
-        async with self._pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.transaction():
                 logger.info("Migration started")
+                self._couriers.clear()
                 await Database._drop_tables(TABLES, conn)
                 await Database._create_tables(COMMANDS['create'], conn)
                 await Database._fill_tables(conn)
+                await self._load_courier_types(conn)
+
+    async def upgrade(self) -> None:
+        """ Upgrade the tables created by previous
+        versions to the current schemas keeping data """
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                logger.info("Upgrade started")
+                self._couriers.clear()
+                for name, command in COMMANDS['upgrade'].items():
+                    await conn.execute(command)
+                    logger.info("'%s' upgraded", name)
+                await self._load_courier_types(conn)
 
     @staticmethod
     async def _drop_tables(tables: Iterable[str],
@@ -285,96 +618,118 @@ class Database:
     async def _fill_tables(conn: asyncpg.Connection) -> None:
         logger.info("Filling courier_types table")
 
-        values = ', '.join(
-            f"('{t['type']}', {t['c']}, {t['payload']})"
-            for t in DEFAULT_COURIER_TYPES
+        await conn.execute(
+            QUERIES['fill_courier_types'],
+            [t['type'] for t in DEFAULT_COURIER_TYPES],
+            [t['c'] for t in DEFAULT_COURIER_TYPES],
+            [t['payload'] for t in DEFAULT_COURIER_TYPES]
         )
-
-        query = f"""
-        INSERT INTO
-            courier_types (type, c, payload)
-        VALUES
-            {values}
-        ;
-        """
-
-        await conn.execute(query)
         logger.info("courier_types filled")
 
     async def _get(self,
                    query: str,
-                   conn: asyncpg.Connection) -> List[asyncpg.Record]:
+                   conn: asyncpg.Connection,
+                   *args) -> List[asyncpg.Record]:
         try:
-            logger.info("Requested to the database:\n %s", query)
-            result = await conn.fetch(query)
+            _log_query(query)
+            result = await conn.fetch(query, *args)
         except Exception:
-            error_logger.exception('')
+            error_logger.exception("Request failed: %s", shorten_query(query))
             raise
-        logger.info("Request successfully completed")
+        logger.debug("Request successfully completed")
         return result
 
     async def get(self,
-                  query: str) -> List[asyncpg.Record]:
+                  query: str,
+                  *args) -> List[asyncpg.Record]:
         """ Fetch query without transaction """
-        async with self._pool.acquire() as conn:
-            return await self._get(query, conn)
+        async with self._acquire() as conn:
+            return await self._get(query, conn, *args)
 
     async def get_t(self,
-                    query: str) -> List[asyncpg.Record]:
+                    query: str,
+                    *args) -> List[asyncpg.Record]:
         """ Fetch query with transaction """
-        async with self._pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.transaction():
-                return await self._get(query, conn)
+                return await self._get(query, conn, *args)
 
     async def _execute(self,
                        query: str,
-                       conn: asyncpg.Connection) -> str:
+                       conn: asyncpg.Connection,
+                       *args) -> str:
         try:
-            logger.info("Requested to the database:\n %s", query)
-            result = await conn.execute(query)
+            _log_query(query)
+            result = await conn.execute(query, *args)
         except Exception:
-            error_logger.exception('')
+            error_logger.exception("Request failed: %s", shorten_query(query))
             raise
-        logger.info("Request successfully completed")
+        logger.debug("Request successfully completed")
         return result
 
     async def execute(self,
-                      query: str) -> str:
+                      query: str,
+                      *args) -> str:
         """ Execute the query without transaction """
-        async with self._pool.acquire() as conn:
-            return await self._execute(query, conn)
+        async with self._acquire() as conn:
+            return await self._execute(query, conn, *args)
 
     async def execute_t(self,
-                        query: str) -> str:
+                        query: str,
+                        *args) -> str:
         """ Execute the query with transaction """
-        async with self._pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.transaction():
-                return await self._execute(query, conn)
+                return await self._execute(query, conn, *args)
+
+    async def _copy(self,
+                    table: str,
+                    columns: List[str],
+                    records: List[tuple],
+                    conn: asyncpg.Connection) -> str:
+        try:
+            logger.info("Copying %s records to '%s'", len(records), table)
+            result = await conn.copy_records_to_table(
+                table, records=records, columns=columns)
+        except Exception:
+            error_logger.exception("Copying to '%s' failed", table)
+            raise
+        logger.debug("Request successfully completed")
+        return result
+
+    async def _insert_couriers(self,
+                               couriers: list,
+                               conn: asyncpg.Connection) -> None:
+        BATCH_SIZE.observe(len(couriers), operation='add_couriers')
+        self._couriers.invalidate(courier.courier_id for courier in couriers)
+        if len(couriers) < self._copy_threshold:
+            await self._execute(
+                QUERIES['add_couriers'], conn,
+                [courier.courier_id for courier in couriers],
+                [self._courier_types.id(courier.courier_type) for courier in couriers],
+                [array_literal(courier.regions) for courier in couriers],
+                [array_literal(courier.working_hours) for courier in couriers]
+            )
+            return
+
+        records = [
+            (courier.courier_id, self._courier_types.id(courier.courier_type),
+             courier.regions, courier.working_hours)
+            for courier in couriers
+        ]
+        columns = ['courier_id', 'courier_type', 'regions', 'working_hours']
+        await self._copy('couriers', columns, records, conn)
 
+    @timed(DB_METHOD_DURATION, method='add_couriers')
     async def add_couriers(self,
                            couriers: list) -> dict:
         if not couriers:
             return {"couriers": []}
 
-        values = ', '.join(
-            f"""(
-            {courier.courier_id}::INTEGER,
-            (SELECT t.id FROM courier_types t WHERE t.type = '{courier.courier_type}'),
-            ARRAY{courier.regions}::INTEGER[],
-            ARRAY{courier.working_hours}::VARCHAR[])
-            """
-            for courier in couriers
-        )
-
-        query = f"""
-        INSERT INTO
-            couriers
-        VALUES
-            {values}
-        ;
-        """
         logger.info("Adding %s couriers", len(couriers))
-        await self.execute_t(query)
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await self._insert_couriers(couriers, conn)
         logger.info("Couriers added")
 
         return {
@@ -384,167 +739,132 @@ class Database:
             ]
         }
 
+    @timed(DB_METHOD_DURATION, method='get_courier')
     async def get_courier(self,
                           courier_id: int) -> Optional[_Courier]:
-        query = f"""
-        SELECT 
-            c.courier_id, t.type, c.regions, 
-            c.working_hours, t.c, t.payload
-        FROM 
-            couriers c
-        INNER JOIN 
-            courier_types t ON c.courier_type = t.id
-        WHERE 
-            c.courier_id = {courier_id}::INTEGER
-        ;
-        """
+        if self.is_listening and (courier := self._couriers.get(courier_id)) is not None:
+            return courier
+
         logger.info("Getting courier id=%s", courier_id)
-        result = await self.get(query)
+        generation = self._couriers.generation
+        result = await self.get(QUERIES['get_courier'], courier_id)
         try:
-            return _Courier(result[0])
+            courier = self._courier(result[0])
         except IndexError:
             logger.info("Courier not found")
             return
 
-    async def _get_uncompleted_orders(self,
-                                      courier_id: int) -> [_Order]:
-        """ Get all assigned but uncompleted orders """
-        get_uncompleted_orders_ids = f"""
-        SELECT 
-            order_id 
-        FROM 
-            status 
-        WHERE 
-            courier_id = {courier_id} AND 
-            completed_time IS NULL AND 
-            assigned_time IS NOT NULL
-        ;
-        """
-        logger.info("Getting uncompleted orders")
-        uncompleted_orders_ids = await self.get(get_uncompleted_orders_ids)
+        if self.is_listening:
+            self._couriers.put_loaded(courier_id, courier, generation)
+        return courier
 
-        if not uncompleted_orders_ids:
-            logger.debug("Uncompleted orders not found")
-            return []
+    def cache_stats(self) -> dict:
+        return self._couriers.stats()
 
-        logger.info("Found %s uncompleted orders", len(uncompleted_orders_ids))
+    async def _get_free_orders_records(self) -> List[asyncpg.Record]:
+        logger.info("Getting free orders")
+        free_orders = await self.get(QUERIES['get_free_orders'])
+        logger.info("%s free orders found", len(free_orders))
 
-        uncompleted_orders_ids = ', '.join(
-            str(record.get('order_id'))
-            for record in uncompleted_orders_ids
-        )
+        return free_orders
 
-        uncompleted_orders_condition = f"order_id IN ({uncompleted_orders_ids})"
-        return await self.get_orders(uncompleted_orders_condition)
-
-    async def _get_free_orders(self) -> List[_Order]:
-        query = f"""
-        SELECT
-            o.*
-        FROM 
-            status s
-        RIGHT JOIN
-            orders o
-        ON
-            s.order_id = o.order_id
-        WHERE
-            s.order_id IS NULL
-        ;
+    async def _get_matching_orders(self,
+                                   courier: _Courier) -> List[_Order]:
+        """ Get free orders the courier is able to deliver,
+        filtering them by region, weight and delivery hours in the database.
         """
-        logger.info("Getting free orders")
-        free_orders = await self.get(query)
-        logger.info("%s free orders found", len(free_orders))
+        logger.info("Getting free orders matching Courier id=%s",
+                    courier.courier_id)
+        matching_orders = await self.get(
+            QUERIES['get_matching_orders'],
+            courier.regions,
+            courier.payload,
+            [span.start for span in courier.working_hours],
+            [span.stop for span in courier.working_hours]
+        )
+        logger.info("%s matching orders found", len(matching_orders))
 
         return [
             _Order(order)
-            for order in free_orders
+            for order in matching_orders
         ]
 
-    async def cancel_orders(self,
-                            orders_to_cancel: List[_Order]) -> None:
-        if not orders_to_cancel:
-            return
-        logger.info("Cancelling %s orders", len(orders_to_cancel))
+    async def _pack_orders(self,
+                           courier: _Courier,
+                           orders: List[_Order],
+                           conn: asyncpg.Connection) -> List[_Order]:
+        """ Choose orders to fill the payload of the courier
+        left after orders he is delivering now.
 
-        orders_ids = ', '.join(
-            f"{order.order_id}"
-            for order in orders_to_cancel
-        )
-        query = f"""
-        DELETE FROM 
-            status
-        WHERE 
-            order_id IN ({orders_ids})
-        ;
+        The courier is locked in the transaction of `conn`,
+        so his orders must be claimed in it.
+        """
+        if not orders:
+            return []
+
+        await self._get(QUERIES['lock_couriers'], conn, [courier.courier_id])
+        result = await self._get(QUERIES['get_courier_load'], conn, courier.courier_id)
+        capacity = courier.payload - float(result[0].get('load'))
+        logger.info("Courier id=%s has %.2f of %s capacity left",
+                    courier.courier_id, capacity, courier.payload)
+
+        indexes = await self._executor.run(
+            len(orders), pack, [order.weight for order in orders],
+            capacity, self._packing, self._knapsack_max_items)
+        logger.info("%s of %s matching orders packed", len(indexes), len(orders))
+
+        return [orders[index] for index in indexes]
+
+    async def _match_free_orders(self,
+                                 courier: _Courier) -> List[_Order]:
+        """ Load all free orders and match them with the courier
+        in the service, in the executor if there are many of them.
         """
-        await self.execute_t(query)
-        logger.debug("Orders cancelled")
+        free_orders = await self._get_free_orders_records()
+
+        match = _match_one_by_one
+        if self._matching == 'vector':
+            match = _match_vectorized
 
+        orders = free_orders
+        if self._executor.is_remote and self._executor.should_offload(len(orders)):
+            # asyncpg records can't be pickled
+            orders = [dict(order) for order in orders]
+
+        indexes = await self._executor.run(len(orders), match, courier, orders)
+        return [
+            _Order(free_orders[index])
+            for index in indexes
+        ]
+
+    @timed(DB_METHOD_DURATION, method='update_courier')
     async def update_courier(self,
                              **data) -> _Courier:
         courier_id = data.pop('courier_id')
 
-        values, is_first = "", True
-        for field, value in data.items():
-            if not is_first:
-                values += ', '
-
-            if field in ['regions', 'working_hours']:
-                type_ = 'INTEGER' if field == 'regions' else 'VARCHAR'
-                values += f"{field} = ARRAY{value}::{type_}[]"
-            elif field == 'courier_type':
-                values += f"""
-                courier_type = 
-                    (SELECT t.id FROM courier_types t WHERE t.type = '{value}')
-                """
-
-            is_first = False
-
-        update_query = f"""
-        UPDATE 
-            couriers 
-        SET 
-            {values}
-        WHERE 
-            courier_id = {courier_id}::INTEGER
-        RETURNING
-            courier_id, 
-            (SELECT t.type FROM courier_types t WHERE t.id = courier_type),
-            regions,
-            working_hours,
-            (SELECT t.c FROM courier_types t WHERE t.id = courier_type),
-            (SELECT t.payload FROM courier_types t WHERE t.id = courier_type)
-        ;
-        """
         logger.info("Updating courier id=%s", courier_id)
-        updated_courier = await self.get_t(update_query)
+        # fields missing in the data are passed as NULLs and the
+        # statement keeps their current values, uncompleted orders
+        # the courier isn't able to deliver anymore are released by it
+        updated_courier = await self.get(
+            QUERIES['update_courier'],
+            courier_id,
+            self._courier_types.id(data.get('courier_type')),
+            data.get('regions'),
+            data.get('working_hours')
+        )
         logger.info("Courier updated")
 
-        courier = _Courier(updated_courier[0])
-        uncompleted_orders = await self._get_uncompleted_orders(courier_id)
-
-        orders_to_cancel = [
-            order
-            for order in uncompleted_orders
-            if not courier.is_order_valid(order)
-        ]
-        await self.cancel_orders(orders_to_cancel)
-
-        return courier
+        # the updated courier isn't cached, it could overwrite a later
+        # update of another worker whose notification is handled already
+        self._couriers.invalidate([courier_id])
+        return self._courier(updated_courier[0])
 
+    @timed(DB_METHOD_DURATION, method='get_orders')
     async def get_orders(self,
-                         condition: str) -> List[_Order]:
-        query = f"""
-        SELECT 
-            *
-        FROM
-            orders
-        WHERE
-            {condition}
-        ;
-        """
-        logger.info("Getting orders by %s", condition)
-        orders = await self.get(query)
+                         orders_ids: List[int]) -> List[_Order]:
+        logger.info("Getting %s orders by ids", len(orders_ids))
+        orders = await self.get(QUERIES['get_orders'], orders_ids)
         logger.info("Found %s orders", len(orders))
 
         return [
@@ -552,30 +872,37 @@ class Database:
             for order in orders
         ]
 
+    async def _insert_orders(self,
+                             orders: list,
+                             conn: asyncpg.Connection) -> None:
+        BATCH_SIZE.observe(len(orders), operation='add_orders')
+        if len(orders) < self._copy_threshold:
+            await self._execute(
+                QUERIES['add_orders'], conn,
+                [order.order_id for order in orders],
+                [order.weight for order in orders],
+                [order.region for order in orders],
+                [array_literal(order.delivery_hours) for order in orders]
+            )
+            return
+
+        records = [
+            (order.order_id, order.weight, order.region, order.delivery_hours)
+            for order in orders
+        ]
+        columns = ['order_id', 'weight', 'region', 'delivery_hours']
+        await self._copy('orders', columns, records, conn)
+
+    @timed(DB_METHOD_DURATION, method='add_orders')
     async def add_orders(self,
                          orders: list) -> dict:
         if not orders:
             return {"orders": []}
 
-        values = ', '.join(
-            f"""(
-            {order.order_id}::INTEGER,
-            {order.weight}::REAL,
-            {order.region}::INTEGER,
-            ARRAY{order.delivery_hours}::VARCHAR[]
-            )"""
-            for order in orders
-        )
-
-        query = f"""
-        INSERT INTO
-            orders
-        VALUES
-            {values}
-        ;
-        """
         logger.info("Adding %s orders", len(orders))
-        await self.execute_t(query)
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await self._insert_orders(orders, conn)
         logger.info("Orders added")
 
         return {
@@ -585,121 +912,316 @@ class Database:
             ]
         }
 
+    @asynccontextmanager
+    async def ingestion(self,
+                        table: str) -> AsyncIterator[Callable[[list], Awaitable]]:
+        """
+        Add couriers or orders in chunks in one transaction.
+
+        Yield function to add a chunk. The connection is acquired and
+        the transaction is started with the first chunk, so a client
+        sending invalid items or the first chunk slowly doesn't hold
+        them. The transaction is committed when the block exits
+        and rolled back if it raises.
+        """
+        inserts = {
+            "couriers": self._insert_couriers,
+            "orders": self._insert_orders
+        }
+        insert = inserts[table]
+        conn = None
+
+        async with AsyncExitStack() as stack:
+            async def add(chunk: list) -> None:
+                nonlocal conn
+                if conn is None:
+                    conn = await stack.enter_async_context(self._acquire())
+                    await stack.enter_async_context(conn.transaction())
+                    logger.info("Starting ingestion of %s", table)
+                await insert(chunk, conn=conn)
+
+            yield add
+        if conn is not None:
+            logger.info("Ingestion of %s completed", table)
+
+    @timed(DB_METHOD_DURATION, method='assign_orders')
     async def assign_orders(self,
                             courier_id: int) -> Tuple[List[_Order], str]:
-        # TODO: add delivery_id to the status table
-        #  and to _Status, make it autoincrement
-        courier = await self.get_courier(courier_id)
-        free_orders = await self._get_free_orders()
+        """
+        Assign orders the courier is able to deliver to him.
 
-        if not (free_orders and courier):
+        :return: the orders and the assign time in DATE_FORMAT,
+        an empty string if there are no orders.
+        """
+        if (courier := await self.get_courier(courier_id)) is None:
             return [], ''
 
-        valid_orders = [
-            order
-            for order in free_orders
-            if courier.is_order_valid(order)
-        ]
-
-        if not valid_orders:
+        if not (courier.regions and courier.working_hours):
             return [], ''
 
         now_ = now()
 
-        values = ', '.join(
-            f"""(
-            {courier_id}::INTEGER,
-            {order.order_id}::INTEGER,
-            '{now_}'::VARCHAR)
-            """
-            for order in valid_orders
-        )
+        valid_orders = None
+        if not (self._matching == 'db' and self._packing == 'all'):
+            if self._matching == 'db':
+                valid_orders = await self._get_matching_orders(courier)
+            else:
+                valid_orders = await self._match_free_orders(courier)
+            if not valid_orders:
+                return [], ''
 
-        query = f"""
-        INSERT INTO
-            status (courier_id, order_id, assigned_time)
-        VALUES
-            {values}
-        ;
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                if valid_orders is None:
+                    # matched and claimed in the database at once
+                    query, args = QUERIES['assign_matching_orders'], (now_,)
+                else:
+                    if self._packing != 'all':
+                        valid_orders = await self._pack_orders(
+                            courier, valid_orders, conn)
+                    query, args = QUERIES['assign_orders'], (
+                        [order.order_id for order in valid_orders], now_)
+
+                # the orders become a new delivery, ones
+                # claimed by other couriers meanwhile are skipped
+                logger.info("Assigning orders to Courier id=%s", courier_id)
+                assigned_orders = await self._get(query, conn, courier_id, *args)
+        logger.info("%s orders assigned", len(assigned_orders))
+        BATCH_SIZE.observe(len(assigned_orders), operation='assign_orders')
+
+        if not assigned_orders:
+            return [], ''
+
+        return [_Order(order) for order in assigned_orders], format_date(now_)
+
+    @timed(DB_METHOD_DURATION, method='dispatch')
+    async def dispatch(self,
+                       couriers_ids: List[int]) -> Dict[int, Tuple[List[_Order], str]]:
         """
+        Assign free orders to many couriers at once.
 
-        logger.info("Assigning %s orders to Courier id=%s",
-                    len(valid_orders), courier_id)
-        await self.execute_t(query)
-        logger.info("Orders assigned")
+        The free orders are loaded once. The couriers are locked
+        and loaded with their loads in one transaction, the orders
+        are matched and packed jointly in the dispatch executor, and
+        then every courier claims his orders in the same transaction.
 
-        return valid_orders, now_
+        :return: orders and assign time of every found courier,
+        like `assign_orders` returns. Nothing is assigned if
+        some couriers are not found.
+        """
+        logger.info("Dispatching orders to %s couriers", len(couriers_ids))
+        free_orders = await self._get_free_orders_records()
 
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                # loads are read after the couriers are locked, so
+                # orders being claimed for them are taken into account
+                await self._get(QUERIES['lock_couriers'], conn, couriers_ids)
+                records = await self._get(
+                    QUERIES['get_couriers_with_load'], conn, couriers_ids)
+
+                couriers = [self._courier(record) for record in records]
+                capacities = [
+                    courier.payload - float(record.get('load'))
+                    for courier, record in zip(couriers, records)
+                ]
+                dispatched = {
+                    courier.courier_id: ([], '')
+                    for courier in couriers
+                }
+
+                if len(couriers) < len(set(couriers_ids)):
+                    logger.info("%s couriers not found",
+                                len(set(couriers_ids)) - len(couriers))
+                    return dispatched
+
+                if not (couriers and free_orders):
+                    return dispatched
+
+                orders = free_orders
+                if self._dispatch_executor.is_remote and \
+                        self._dispatch_executor.should_offload(len(orders)):
+                    # asyncpg records can't be pickled
+                    orders = [dict(order) for order in orders]
+
+                assigned_indexes = await self._dispatch_executor.run(
+                    len(orders), dispatch, couriers, capacities, orders,
+                    self._packing, self._knapsack_max_items)
+
+                now_ = now()
+                for courier, indexes in zip(couriers, assigned_indexes):
+                    if not indexes:
+                        continue
+                    # orders claimed by other couriers meanwhile are skipped
+                    assigned_orders = await self._get(
+                        QUERIES['assign_orders'], conn, courier.courier_id,
+                        [free_orders[index].get('order_id') for index in indexes],
+                        now_
+                    )
+                    BATCH_SIZE.observe(len(assigned_orders), operation='dispatch')
+                    if assigned_orders:
+                        dispatched[courier.courier_id] = (
+                            [_Order(order) for order in assigned_orders],
+                            format_date(now_)
+                        )
+        logger.info("%s orders dispatched", sum(
+            len(orders) for orders, _ in dispatched.values()))
+
+        return dispatched
+
+    @timed(DB_METHOD_DURATION, method='courier_status')
     async def courier_status(self,
-                             courier_id: int) -> Optional[CourierStatus]:
-        orders_and_statuses = await self._status(courier_id=courier_id)
-        if not orders_and_statuses:
-            return
-
-        courier = await self.get_courier(courier_id)
+                             courier_id: int,
+                             order_id: int = None) -> Optional[CourierStatus]:
+        """
+        Get the courier with all his orders or
+        only with the order if it's given.
 
-        return CourierStatus(orders_and_statuses, courier)
+        :return: None if there is no such courier.
+        """
+        return await self._status(courier_id=courier_id, order_id=order_id)
 
+    @timed(DB_METHOD_DURATION, method='order_status')
     async def order_status(self,
                            order_id: int) -> Optional[CourierStatus]:
-        orders_and_statuses = await self._status(order_id=order_id)
-        if not orders_and_statuses:
-            return
-
-        courier_id = int(orders_and_statuses[0].get('courier_id'))
-        courier = await self.get_courier(courier_id)
+        """
+        Get the order with the courier it's assigned to.
 
-        return CourierStatus(orders_and_statuses, courier)
+        :return: None if the order isn't assigned.
+        """
+        return await self._status(order_id=order_id)
 
     async def _status(self,
                       *,
                       order_id: int = None,
-                      courier_id: int = None) -> Optional[List[asyncpg.Record]]:
+                      courier_id: int = None) -> Optional[CourierStatus]:
         if not (order_id or courier_id):
             return
 
-        if courier_id:
-            courier_id = f"s.courier_id = {courier_id}::INTEGER"
-        if order_id:
-            order_id = f"s.order_id = {order_id}::INTEGER"
-
         if courier_id and order_id:
-            condition = f"{courier_id} AND {order_id}"
+            query, args = QUERIES['courier_order_status'], (courier_id, order_id)
+        elif courier_id:
+            query, args = QUERIES['courier_status'], (courier_id, )
         else:
-            condition = courier_id or order_id
-
-        query = f"""
-        SELECT
-            o.order_id, o.weight, 
-            o.region, o.delivery_hours,
-            s.id, s.courier_id, s.order_id,
-            s.assigned_time, s.completed_time
-        FROM
-            status s
-        INNER JOIN
-            orders o
-        ON
-            s.order_id = o.order_id
-        WHERE
-            {condition}
-        ;
-        """
+            query, args = QUERIES['order_status'], (order_id, )
+
+        # the courier and his statuses come in one row
         logger.info("Getting Courier info with his orders")
-        return await self.get(query)
+        if not (result := await self.get(query, *args)):
+            logger.info("Courier not found")
+            return
 
+        statuses = [
+            dict(zip(STATUS_FIELDS, status))
+            for status in result[0].get('statuses')
+        ]
+        return CourierStatus(statuses, self._courier(result[0]))
+
+    @timed(DB_METHOD_DURATION, method='complete_order')
     async def complete_order(self,
                              order_id: int,
-                             completed_time: str) -> None:
+                             completed_time: datetime) -> None:
+        """ Complete the order if it isn't completed yet, add its
+        delivery time to the courier region stats. If it's the last
+        order of its delivery, add the payment to the earnings. """
         logger.info("Completing order id=%s, time=%s",
                     order_id, completed_time)
-        query = f"""
-        UPDATE 
-            status
-        SET
-            completed_time = '{completed_time}'::VARCHAR
-        WHERE
-            order_id = {order_id}::INTEGER
-        ;
-        """
-        await self.execute_t(query)
+        await self.execute_t(
+            QUERIES['complete_order'], order_id, completed_time)
         logger.info("Order completed")
+
+    @timed(DB_METHOD_DURATION, method='courier_with_stats')
+    async def courier_with_stats(self,
+                                 courier_id: int) -> Optional[Tuple[_Courier, Optional[float], int]]:
+        """
+        Get the courier with his rating and earnings from the region
+        stats and the earnings ledger, both are updated on completing.
+
+        :return: the courier, the rating or None if there are no
+        completed orders and the earnings; None if there is no such courier.
+        """
+        logger.info("Getting Courier id=%s with rating and earnings", courier_id)
+        if not (result := await self.get(QUERIES['get_courier_with_stats'], courier_id)):
+            logger.info("Courier not found")
+            return
+
+        rating_ = None
+        if (min_average := result[0].get('min_average')) is not None:
+            rating_ = rating(min_average)
+
+        return self._courier(result[0]), rating_, int(result[0].get('earnings') or 0)
+
+    async def check_courier_region_stats(self) -> List[dict]:
+        """
+        Compare the courier region stats with ones
+        computed from all completed orders.
+
+        :return: stats which differ, see `compare_region_stats`.
+        """
+        logger.info("Checking courier region stats")
+        async with self._acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read'):
+                stored = await self._get(
+                    QUERIES['get_courier_region_stats'], conn)
+                computed = await self._get(
+                    QUERIES['compute_courier_region_stats'], conn)
+
+        mismatches = compare_region_stats(stored, computed)
+        logger.info("%s courier region stats differ", len(mismatches))
+
+        return mismatches
+
+    async def rebuild_courier_region_stats(self) -> None:
+        """ Compute the courier region stats from all completed orders """
+        logger.info("Rebuilding courier region stats")
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('LOCK TABLE status IN SHARE MODE;')
+                await self._execute(
+                    QUERIES['rebuild_courier_region_stats'], conn)
+        logger.info("Courier region stats rebuilt")
+
+    @timed(DB_METHOD_DURATION, method='claim_response')
+    async def claim_response(self,
+                             key: str,
+                             endpoint: str,
+                             fingerprint: bytes
+                             ) -> Optional[Tuple[bytes, Optional[int], Optional[bytes]]]:
+        """
+        Claim the idempotency key of the endpoint for a request.
+
+        :return: None if the request should be handled, otherwise
+        the fingerprint, status and body of the stored response,
+        status and body are None while it's being handled. A key
+        handled for more than IDEMPOTENCY_LOCK_TIMEOUT is claimed again.
+        """
+        result = await self.get(
+            QUERIES['claim_response'], key, endpoint, fingerprint,
+            self._responses_ttl, self._responses_lock_timeout)
+        if not result:
+            # claimed by a request not committed yet
+            return fingerprint, None, None
+
+        if result[0].get('claimed'):
+            return None
+        return result[0].get('fingerprint'), result[0].get('status'), result[0].get('body')
+
+    async def save_response(self,
+                            key: str,
+                            endpoint: str,
+                            status: int,
+                            body: bytes) -> None:
+        await self.execute(QUERIES['save_response'], key, endpoint, status, body)
+
+    async def release_response(self,
+                               key: str,
+                               endpoint: str) -> None:
+        """ Let the key be claimed again if the request failed """
+        await self.execute(QUERIES['release_response'], key, endpoint)
+
+    async def purge_responses(self) -> None:
+        """ Drop responses older than IDEMPOTENCY_TTL and ones
+        besides the newest IDEMPOTENCY_MAX_KEYS of them """
+        result = await self.execute(
+            QUERIES['purge_responses'], self._responses_ttl, self._responses_max_count)
+        logger.info("Stored responses purged: %s", result)
@@ -1,4 +1,9 @@
-__all__ = 'COMMANDS', 'TABLES'
+import textwrap
+
+__all__ = 'COMMANDS', 'TABLES', 'QUERIES', 'STATUS_FIELDS', 'CHANGES_CHANNEL'
+
+# a courier earns it multiplied by his coefficient for a delivery
+DELIVERY_PAYMENT = 500
 
 CREATE_COURIER_TABLE = """
 CREATE TABLE couriers (
@@ -27,28 +32,987 @@ CREATE TABLE orders (
 );
 """
 
+# orders assigned to a courier at once, the coefficient
+# of the courier is saved at the moment of assignment
+CREATE_DELIVERY_TABLE = """
+CREATE TABLE deliveries (
+    id SERIAL PRIMARY KEY,
+    courier_id INTEGER REFERENCES couriers (courier_id) NOT NULL,
+    coeff INTEGER NOT NULL,
+    assigned_time TIMESTAMPTZ NOT NULL,
+    orders_count INTEGER NOT NULL,
+    completed_count INTEGER NOT NULL DEFAULT 0,
+    completed_time TIMESTAMPTZ
+);
+"""
+
 CREATE_STATUS_TABLE = """
 CREATE TABLE status (
     id SERIAL PRIMARY KEY,
     courier_id INTEGER REFERENCES couriers (courier_id) NOT NULL,
     order_id INTEGER REFERENCES orders (order_id) NOT NULL,
-    assigned_time VARCHAR,
-    completed_time VARCHAR
+    delivery_id INTEGER REFERENCES deliveries (id),
+    assigned_time TIMESTAMPTZ,
+    completed_time TIMESTAMPTZ
 );
 """
 
+# earnings for completed deliveries, updated by COMPLETE_ORDER
+CREATE_COURIER_EARNINGS_TABLE = """
+CREATE TABLE courier_earnings (
+    courier_id INTEGER PRIMARY KEY REFERENCES couriers (courier_id),
+    earnings BIGINT NOT NULL,
+    deliveries_count INTEGER NOT NULL
+);
+"""
+
+# sums and counts of delivery durations by courier and region,
+# updated by COMPLETE_ORDER, so the rating is read without history
+CREATE_COURIER_REGION_STATS_TABLE = """
+CREATE TABLE courier_region_stats (
+    courier_id INTEGER REFERENCES couriers (courier_id) NOT NULL,
+    region INTEGER NOT NULL,
+    duration_sum DOUBLE PRECISION NOT NULL,
+    deliveries_count INTEGER NOT NULL,
+    PRIMARY KEY (courier_id, region)
+);
+"""
+
+CREATE_ORDER_INDEXES = """
+CREATE INDEX orders_region_weight_idx ON orders (region, weight);
+"""
+
+CREATE_STATUS_INDEXES = """
+CREATE UNIQUE INDEX status_order_id_idx ON status (order_id);
+CREATE INDEX status_courier_id_idx ON status (courier_id);
+CREATE INDEX status_delivery_id_idx ON status (delivery_id);
+"""
+
+# Responses to requests with an idempotency key, replayed to retries
+# of them. `status` is NULL while the first request is being handled.
+CREATE_IDEMPOTENT_RESPONSES_TABLE = """
+CREATE TABLE IF NOT EXISTS idempotent_responses (
+    key VARCHAR(255) NOT NULL,
+    endpoint VARCHAR(64) NOT NULL,
+    fingerprint BYTEA NOT NULL,
+    status SMALLINT,
+    body BYTEA,
+    created_time TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (key, endpoint)
+);
+CREATE INDEX IF NOT EXISTS idempotent_responses_created_time_idx
+    ON idempotent_responses (created_time);
+"""
+
+def _if_not_exists(command: str) -> str:
+    """ The command creating tables and indexes skips existing ones """
+    for create in ("CREATE TABLE ", "CREATE INDEX ", "CREATE UNIQUE INDEX "):
+        command = command.replace(create, f"{create}IF NOT EXISTS ")
+    return command
+
+
+# statuses of the first version have no deliveries
+UPGRADE_DELIVERIES = _if_not_exists(CREATE_DELIVERY_TABLE) + """
+ALTER TABLE status ADD COLUMN IF NOT EXISTS delivery_id INTEGER REFERENCES deliveries (id);
+"""
+
+# times used to be VARCHAR in the API format,
+# it's the ISO format PostgreSQL is able to cast
+UPGRADE_TIME_COLUMNS = """
+ALTER TABLE deliveries
+    ALTER COLUMN assigned_time TYPE TIMESTAMPTZ USING assigned_time::TIMESTAMPTZ,
+    ALTER COLUMN completed_time TYPE TIMESTAMPTZ USING completed_time::TIMESTAMPTZ;
+ALTER TABLE status
+    ALTER COLUMN assigned_time TYPE TIMESTAMPTZ USING assigned_time::TIMESTAMPTZ,
+    ALTER COLUMN completed_time TYPE TIMESTAMPTZ USING completed_time::TIMESTAMPTZ;
+"""
+
+# Orders assigned to a courier at once have the same assigned
+# time, every such group without a delivery becomes one. The
+# coefficient at the moment of assignment isn't known, so the
+# current one of the courier is saved.
+UPGRADE_STATUS_DELIVERIES = """
+WITH assigned AS (
+    SELECT
+        s.courier_id, s.assigned_time, t.c,
+        count(*) AS orders_count,
+        count(s.completed_time) AS completed_count,
+        max(s.completed_time) AS completed_time
+    FROM
+        status s
+    INNER JOIN
+        couriers c ON s.courier_id = c.courier_id
+    INNER JOIN
+        courier_types t ON c.courier_type = t.id
+    WHERE
+        s.delivery_id IS NULL AND
+        s.assigned_time IS NOT NULL
+    GROUP BY
+        s.courier_id, s.assigned_time, t.c
+), delivery AS (
+    INSERT INTO
+        deliveries (courier_id, coeff, assigned_time, orders_count, completed_count, completed_time)
+    SELECT
+        a.courier_id, a.c, a.assigned_time, a.orders_count, a.completed_count,
+        CASE WHEN a.completed_count = a.orders_count THEN a.completed_time END
+    FROM
+        assigned a
+    RETURNING
+        id, courier_id, assigned_time
+)
+UPDATE
+    status s
+SET
+    delivery_id = d.id
+FROM
+    delivery d
+WHERE
+    s.delivery_id IS NULL AND
+    s.courier_id = d.courier_id AND
+    s.assigned_time = d.assigned_time
+;
+"""
+
+# an order might be assigned only once
+UPGRADE_STATUS_INDEXES = """
+DROP INDEX IF EXISTS status_order_id_idx;
+CREATE UNIQUE INDEX status_order_id_idx ON status (order_id);
+"""
+
+# Committed changes of couriers and courier types are published
+# to CHANGES_CHANNEL as {"table", "op", "ids"} by statement triggers,
+# "ids" is null if there are more than CHANGES_MAX_IDS of them,
+# so a payload is always less than the 8000 bytes limit.
+# NOTIFY serializes commits of all transactions sending it,
+# so only tables somebody listens to have the triggers.
+CHANGES_CHANNEL = 'candy_shop_changes'
+CHANGES_MAX_IDS = 500
+
+_CHANGE_TRIGGERS = (
+    # table, event, id column
+    ('courier_types', 'INSERT', 'id'),
+    ('couriers', 'INSERT', 'courier_id'),
+    ('couriers', 'UPDATE', 'courier_id'),
+)
+
+# the previous version notified changes of orders and statuses
+_DROPPED_CHANGE_TRIGGERS = (
+    ('orders', 'INSERT'),
+    ('status', 'INSERT'),
+    ('status', 'UPDATE'),
+    ('status', 'DELETE'),
+)
+
+CREATE_CHANGE_TRIGGERS = """
+CREATE OR REPLACE FUNCTION notify_changes() RETURNS TRIGGER AS $$
+DECLARE
+    changed_count BIGINT;
+    ids JSON;
+BEGIN
+    SELECT count(*) INTO changed_count FROM changed_rows;
+    IF changed_count = 0 THEN
+        RETURN NULL;
+    END IF;
+
+    IF changed_count <= {max_ids} THEN
+        EXECUTE format('SELECT json_agg(%I) FROM changed_rows', TG_ARGV[0]) INTO ids;
+    END IF;
+
+    PERFORM pg_notify('{channel}', json_build_object(
+        'table', TG_TABLE_NAME, 'op', TG_OP, 'ids', ids
+    )::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""".format(max_ids=CHANGES_MAX_IDS, channel=CHANGES_CHANNEL) + "".join(
+    """
+DROP TRIGGER IF EXISTS {table}_{name}_changes ON {table};
+CREATE TRIGGER {table}_{name}_changes
+    AFTER {event} ON {table}
+    REFERENCING {rows} TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_changes('{id_column}');
+""".format(table=table, name=event.lower(), event=event, id_column=id_column,
+           rows='OLD' if event == 'DELETE' else 'NEW')
+    for table, event, id_column in _CHANGE_TRIGGERS
+) + "".join(
+    """
+DROP TRIGGER IF EXISTS {table}_{name}_changes ON {table};""".format(table=table, name=event.lower())
+    for table, event in _DROPPED_CHANGE_TRIGGERS
+) + "\n"
+
 TABLES = {
-    "courier",
-    "courier_type",
+    "couriers",
+    "courier_types",
     "orders",
-    "status"
+    "deliveries",
+    "status",
+    "courier_region_stats",
+    "courier_earnings",
+    "idempotent_responses"
 }
 
+# Arrays of values are passed to multi-row statements and unnested.
+# Arrays can't be nested, so `regions`, `working_hours` and
+# `delivery_hours` of every row are passed as array literals.
+FILL_COURIER_TYPES = """
+INSERT INTO
+    courier_types (type, c, payload)
+SELECT
+    *
+FROM
+    unnest($1::VARCHAR[], $2::INTEGER[], $3::INTEGER[])
+;
+"""
+
+ADD_COURIERS = """
+INSERT INTO
+    couriers (courier_id, courier_type, regions, working_hours)
+SELECT
+    u.courier_id, u.courier_type, u.regions::INTEGER[], u.working_hours::VARCHAR[]
+FROM
+    unnest($1::INTEGER[], $2::INTEGER[], $3::VARCHAR[], $4::VARCHAR[])
+        AS u (courier_id, courier_type, regions, working_hours)
+;
+"""
+
+GET_COURIER_TYPES = """
+SELECT
+    *
+FROM
+    courier_types
+;
+"""
+
+GET_COURIER = """
+SELECT
+    c.courier_id, c.courier_type, c.regions, c.working_hours
+FROM
+    couriers c
+WHERE
+    c.courier_id = $1::INTEGER
+;
+"""
+
+GET_ORDERS = """
+SELECT
+    *
+FROM
+    orders
+WHERE
+    order_id = ANY($1::INTEGER[])
+;
+"""
+
+GET_FREE_ORDERS = """
+SELECT
+    o.*
+FROM
+    status s
+RIGHT JOIN
+    orders o
+ON
+    s.order_id = o.order_id
+WHERE
+    s.order_id IS NULL
+ORDER BY
+    o.order_id
+;
+"""
+
+# Free orders in the courier's regions, not heavier than his
+# payload, with a delivery span intercepting a working one,
+# working spans are passed as arrays of starts and stops
+_MATCHING_CONDITION = """
+        o.region = ANY({regions}::INTEGER[]) AND
+        o.weight <= {payload}::REAL AND
+        EXISTS (
+            SELECT
+                1
+            FROM
+                unnest(o.delivery_hours) d (span),
+                unnest({starts}::TIME[], {stops}::TIME[]) w (start, stop)
+            WHERE
+                split_part(d.span, '-', 1)::TIME < w.stop AND
+                w.start < split_part(d.span, '-', 2)::TIME
+        )"""
+
+# Add earnings for the deliveries in {delivery}, which are completed
+_EARN = """
+INSERT INTO
+    courier_earnings (courier_id, earnings, deliveries_count)
+SELECT
+    courier_id, sum({payment} * coeff), count(*)
+FROM
+    {delivery}
+WHERE
+    completed_time IS NOT NULL
+GROUP BY
+    courier_id
+ON CONFLICT (courier_id) DO UPDATE SET
+    earnings = courier_earnings.earnings + EXCLUDED.earnings,
+    deliveries_count = courier_earnings.deliveries_count + EXCLUDED.deliveries_count
+"""
+
+# Orders deleted from status in {cancelled} are removed from their
+# deliveries, a delivery is completed if all orders left in it are
+_RELEASE_ORDERS = """
+delivery AS (
+    UPDATE
+        deliveries d
+    SET
+        orders_count = d.orders_count - c.count,
+        completed_time = CASE
+            WHEN d.completed_count = d.orders_count - c.count AND d.completed_count > 0
+            THEN (
+                SELECT max(s.completed_time) FROM status s WHERE s.delivery_id = d.id
+            )
+        END
+    FROM
+        (SELECT delivery_id, count(*) FROM {cancelled} GROUP BY delivery_id) c
+    WHERE
+        d.id = c.delivery_id
+    RETURNING
+        d.*
+), earned AS ({earn}
+)""".format(cancelled='{cancelled}', earn=textwrap.indent(
+    _EARN.format(delivery='delivery', payment=DELIVERY_PAYMENT).rstrip(), '    '))
+
+# The courier {courier_id} of {couriers} with his type and working
+# spans as arrays of starts and stops for _MATCHING_CONDITION
+_COURIER = """
+    SELECT
+        c.courier_id, c.courier_type, c.regions, c.working_hours, t.c, t.payload,
+        ARRAY(SELECT split_part(h, '-', 1) FROM unnest(c.working_hours) h)::TIME[] AS starts,
+        ARRAY(SELECT split_part(h, '-', 2) FROM unnest(c.working_hours) h)::TIME[] AS stops
+    FROM
+        {couriers} c
+    INNER JOIN
+        courier_types t ON c.courier_type = t.id
+    WHERE
+        c.courier_id = {courier_id}"""
+
+# the order `o` can be delivered by the courier `k` selected by _COURIER
+_VALID_FOR_COURIER = _MATCHING_CONDITION.format(
+    regions="k.regions", payload="k.payload", starts="k.starts", stops="k.stops")
+
+# The courier is patched, fields passed as NULLs keep their values,
+# and his uncompleted orders he isn't able to deliver anymore are
+# released in the same statement. It's run by `update_courier`
+# after the courier is locked, so it sees every claimed order.
+UPDATE_COURIER_PIPELINE = """
+WITH updated AS (
+    UPDATE
+        couriers c
+    SET
+        courier_type = COALESCE($2::INTEGER, c.courier_type),
+        regions = COALESCE($3::INTEGER[], c.regions),
+        working_hours = COALESCE($4::VARCHAR[], c.working_hours)
+    WHERE
+        c.courier_id = $1::INTEGER
+    RETURNING
+        c.*
+), courier AS ({courier}
+), cancelled AS (
+    DELETE FROM
+        status s
+    USING
+        orders o, courier k
+    WHERE
+        s.courier_id = k.courier_id AND
+        s.completed_time IS NULL AND
+        s.order_id = o.order_id AND
+        NOT ({valid})
+    RETURNING
+        s.delivery_id
+), {release}
+SELECT
+    u.courier_id, u.courier_type, u.regions, u.working_hours
+FROM
+    updated u
+""".format(courier=_COURIER.format(couriers='updated', courier_id='$1::INTEGER'),
+           valid=_VALID_FOR_COURIER.strip(),
+           release=_RELEASE_ORDERS.format(cancelled='cancelled').strip())
+
+# A statement sees orders claimed before it started, so the pipeline
+# is run in a function after the courier is locked: claims lock
+# him for share, so ones started earlier are committed by then and
+# later ones wait and check orders against the patched courier.
+CREATE_UPDATE_COURIER_FUNCTION = """
+CREATE OR REPLACE FUNCTION update_courier(INTEGER, INTEGER, INTEGER[], VARCHAR[])
+RETURNS TABLE (
+    courier_id INTEGER, courier_type INTEGER, regions INTEGER[], working_hours VARCHAR[]
+) AS $$
+#variable_conflict use_column
+BEGIN
+    PERFORM FROM couriers c WHERE c.courier_id = $1 FOR UPDATE;
+    RETURN QUERY{pipeline};
+END;
+$$ LANGUAGE plpgsql;
+""".format(pipeline=UPDATE_COURIER_PIPELINE.rstrip())
+
+UPDATE_COURIER = """
+SELECT
+    *
+FROM
+    update_courier($1::INTEGER, $2::INTEGER, $3::INTEGER[], $4::VARCHAR[])
+;
+"""
+
+ADD_ORDERS = """
+INSERT INTO
+    orders (order_id, weight, region, delivery_hours)
+SELECT
+    u.order_id, u.weight, u.region, u.delivery_hours::VARCHAR[]
+FROM
+    unnest($1::INTEGER[], $2::REAL[], $3::INTEGER[], $4::VARCHAR[])
+        AS u (order_id, weight, region, delivery_hours)
+;
+"""
+
+GET_MATCHING_ORDERS = """
+SELECT
+    o.*
+FROM
+    orders o
+WHERE
+    {condition} AND
+    NOT EXISTS (
+        SELECT 1 FROM status s WHERE s.order_id = o.order_id
+    )
+ORDER BY
+    o.order_id
+;
+""".format(condition=_MATCHING_CONDITION.format(
+    regions="$1", payload="$2", starts="$3", stops="$4").strip())
+
+# weight of orders the courier is delivering now, summed
+# as NUMERIC not to get 10.000001 of weights 0.1 and 9.9
+GET_COURIER_LOAD = """
+SELECT
+    COALESCE(sum(o.weight::NUMERIC), 0) AS load
+FROM
+    status s
+INNER JOIN
+    orders o
+ON
+    s.order_id = o.order_id
+WHERE
+    s.courier_id = $1::INTEGER AND
+    s.completed_time IS NULL
+;
+"""
+
+# couriers with the weight of orders they are delivering now
+GET_COURIERS_WITH_LOAD = """
+SELECT
+    c.courier_id, c.courier_type, c.regions, c.working_hours,
+    (
+        SELECT
+            COALESCE(sum(o.weight::NUMERIC), 0)
+        FROM
+            status s
+        INNER JOIN
+            orders o
+        ON
+            s.order_id = o.order_id
+        WHERE
+            s.courier_id = c.courier_id AND
+            s.completed_time IS NULL
+    ) AS load
+FROM
+    couriers c
+WHERE
+    c.courier_id = ANY($1::INTEGER[])
+ORDER BY
+    c.courier_id
+;
+"""
+
+# Couriers are locked in the order of ids not to deadlock until their
+# orders are claimed, so concurrent assignments don't pack orders into
+# the same capacity. The lock is taken by a separate statement, so
+# loads read after it see orders claimed by the previous holder.
+# NO KEY UPDATE doesn't block foreign key checks of new statuses.
+LOCK_COURIERS = """
+SELECT
+    courier_id
+FROM
+    couriers
+WHERE
+    courier_id = ANY($1::INTEGER[])
+ORDER BY
+    courier_id
+FOR NO KEY UPDATE
+;
+"""
+
+# Free orders matching {condition} are claimed by the courier
+# {courier_id} at {assigned_time} as a new delivery. The courier is
+# locked for share and orders are checked against his current row,
+# so a concurrent `update_courier` is never missed. Orders being
+# claimed by concurrent transactions are skipped instead of waited
+# for and ones assigned after the snapshot are skipped by the
+# unique index, so an order is never assigned twice.
+# Status rows reference the delivery inserted later in the
+# statement, foreign keys are checked at the end of it.
+_CLAIM_ORDERS = """
+WITH courier AS ({courier}
+    FOR SHARE OF c
+), claimable AS (
+    SELECT
+        o.order_id
+    FROM
+        orders o, courier k
+    WHERE
+        {condition} AND
+        NOT EXISTS (
+            SELECT 1 FROM status s WHERE s.order_id = o.order_id
+        )
+    ORDER BY
+        o.order_id
+    FOR UPDATE OF o SKIP LOCKED
+), delivery_id AS (
+    SELECT nextval(pg_get_serial_sequence('deliveries', 'id')) AS id
+), claimed AS (
+    INSERT INTO
+        status (courier_id, order_id, delivery_id, assigned_time)
+    SELECT
+        {courier_id}, c.order_id, d.id, {assigned_time}
+    FROM
+        claimable c, delivery_id d
+    ON CONFLICT (order_id) DO NOTHING
+    RETURNING
+        order_id
+), delivery AS (
+    INSERT INTO
+        deliveries (id, courier_id, coeff, assigned_time, orders_count)
+    SELECT
+        d.id, k.courier_id, k.c, {assigned_time}, (SELECT count(*) FROM claimed)
+    FROM
+        courier k, delivery_id d
+    WHERE
+        EXISTS (SELECT 1 FROM claimed)
+)
+SELECT
+    o.*
+FROM
+    orders o
+INNER JOIN
+    claimed c ON o.order_id = c.order_id
+ORDER BY
+    o.order_id
+;
+"""
+
+# the orders are matched in the service
+ASSIGN_ORDERS = _CLAIM_ORDERS.format(
+    courier=_COURIER.format(couriers='couriers', courier_id='$1::INTEGER'),
+    condition="o.order_id = ANY($2::INTEGER[]) AND " + _VALID_FOR_COURIER.strip(),
+    courier_id="$1::INTEGER",
+    assigned_time="$3::TIMESTAMPTZ"
+)
+
+# matched by the courier's row the claim locks
+ASSIGN_MATCHING_ORDERS = _CLAIM_ORDERS.format(
+    courier=_COURIER.format(couriers='couriers', courier_id='$1::INTEGER'),
+    condition=_VALID_FOR_COURIER.strip(),
+    courier_id="$1::INTEGER",
+    assigned_time="$2::TIMESTAMPTZ"
+)
+
+# columns of an order with its status, the order of STATUS_FIELDS
+_STATUS_COLUMNS = (
+    'o.order_id', 'o.weight', 'o.region', 'o.delivery_hours',
+    's.id', 's.courier_id', 's.delivery_id', 's.assigned_time', 's.completed_time'
+)
+STATUS_FIELDS = tuple(
+    column.split('.')[1]
+    for column in _STATUS_COLUMNS
+)
+
+# The courier with his orders and their statuses in one row.
+# Statuses are aggregated to an array of records, not to JSON,
+# to be decoded from the binary format with native types.
+_STATUS = """
+SELECT
+    c.courier_id, c.courier_type, c.regions, c.working_hours,
+    COALESCE(
+        array_agg(ROW({status_columns})) FILTER (WHERE s.id IS NOT NULL),
+        '{{}}'
+    ) AS statuses
+FROM
+    couriers c
+LEFT JOIN
+    status s ON s.courier_id = c.courier_id AND {status_condition}
+LEFT JOIN
+    orders o ON s.order_id = o.order_id
+WHERE
+    {courier_condition}
+GROUP BY
+    c.courier_id
+;
+"""
+
+# Duration of an order delivery is seconds from the previous
+# completed order of the same delivery or from the assignment
+# if it's the first one. Orders are ordered by (completed_time, id).
+_DELIVERY_DURATION = """
+EXTRACT(EPOCH FROM
+    {status}.completed_time - GREATEST(
+        {status}.assigned_time,
+        (
+            SELECT
+                max(p.completed_time)
+            FROM
+                status p
+            WHERE
+                p.delivery_id = {status}.delivery_id AND
+                p.completed_time IS NOT NULL AND
+                (p.completed_time, p.id) <
+                    ({status}.completed_time, {status}.id)
+        )
+    )
+)::DOUBLE PRECISION
+"""
+
+# An order is completed once, the stats of its courier and
+# region are updated with it. The time may be earlier than the
+# ones of orders completed before, the duration of the order
+# following it in the delivery is shortened then. If it's the
+# last order of the delivery, the delivery is completed and the
+# courier earns.
+COMPLETE_ORDER_PIPELINE = """
+WITH completed AS (
+    UPDATE
+        status
+    SET
+        completed_time = $2::TIMESTAMPTZ
+    WHERE
+        order_id = $1::INTEGER AND
+        completed_time IS NULL
+    RETURNING
+        *
+), following AS (
+    SELECT
+        n.courier_id, n.order_id,
+        EXTRACT(EPOCH FROM
+            GREATEST(n.assigned_time, n.previous_time) -
+            GREATEST(n.assigned_time, c.completed_time)
+        )::DOUBLE PRECISION AS correction
+    FROM
+        completed c
+    INNER JOIN LATERAL (
+        SELECT
+            s.courier_id, s.order_id, s.assigned_time,
+            (
+                SELECT
+                    max(p.completed_time)
+                FROM
+                    status p
+                WHERE
+                    p.delivery_id = c.delivery_id AND
+                    p.completed_time IS NOT NULL AND
+                    (p.completed_time, p.id) < (c.completed_time, c.id)
+            ) AS previous_time
+        FROM
+            status s
+        WHERE
+            s.delivery_id = c.delivery_id AND
+            s.completed_time IS NOT NULL AND
+            (s.completed_time, s.id) > (c.completed_time, c.id)
+        ORDER BY
+            s.completed_time, s.id
+        LIMIT
+            1
+    ) n
+    ON
+        TRUE
+), durations AS (
+    SELECT
+        c.courier_id, c.order_id, {duration} AS duration, 1 AS count
+    FROM
+        completed c
+    UNION ALL
+    SELECT
+        f.courier_id, f.order_id, f.correction, 0
+    FROM
+        following f
+), region_stats AS (
+    INSERT INTO
+        courier_region_stats (courier_id, region, duration_sum, deliveries_count)
+    SELECT
+        d.courier_id, o.region, sum(d.duration), sum(d.count)
+    FROM
+        durations d
+    INNER JOIN
+        orders o
+    ON
+        d.order_id = o.order_id
+    GROUP BY
+        d.courier_id, o.region
+    ON CONFLICT (courier_id, region) DO UPDATE SET
+        duration_sum = courier_region_stats.duration_sum + EXCLUDED.duration_sum,
+        deliveries_count = courier_region_stats.deliveries_count + EXCLUDED.deliveries_count
+), delivery AS (
+    UPDATE
+        deliveries d
+    SET
+        completed_count = d.completed_count + 1,
+        completed_time = CASE
+            WHEN d.completed_count + 1 = d.orders_count THEN GREATEST(
+                c.completed_time,
+                (SELECT max(s.completed_time) FROM status s WHERE s.delivery_id = d.id)
+            )
+        END
+    FROM
+        completed c
+    WHERE
+        d.id = c.delivery_id
+    RETURNING
+        d.*
+)
+{earn};
+""".format(duration=_DELIVERY_DURATION.format(status='c').strip(),
+           earn=_EARN.format(delivery='delivery', payment=DELIVERY_PAYMENT))
+
+# Statements of concurrent completions in one delivery would see
+# the same previous order, so the pipeline is run in a function
+# after the delivery is locked and sees the other ones committed.
+CREATE_COMPLETE_ORDER_FUNCTION = """
+CREATE OR REPLACE FUNCTION complete_order(INTEGER, TIMESTAMPTZ)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM FROM deliveries d WHERE d.id = (
+        SELECT s.delivery_id FROM status s WHERE s.order_id = $1
+    ) FOR UPDATE;
+{pipeline}
+END;
+$$ LANGUAGE plpgsql;
+""".format(pipeline=textwrap.indent(COMPLETE_ORDER_PIPELINE.strip(), '    '))
+
+COMPLETE_ORDER = """
+SELECT complete_order($1::INTEGER, $2::TIMESTAMPTZ);
+"""
+
+# The courier with his rating and earnings data in one row
+GET_COURIER_WITH_STATS = """
+SELECT
+    c.courier_id, c.courier_type, c.regions, c.working_hours,
+    (
+        SELECT
+            min(r.duration_sum / r.deliveries_count)
+        FROM
+            courier_region_stats r
+        WHERE
+            r.courier_id = c.courier_id AND
+            r.deliveries_count > 0
+    ) AS min_average,
+    (
+        SELECT
+            e.earnings
+        FROM
+            courier_earnings e
+        WHERE
+            e.courier_id = c.courier_id
+    ) AS earnings
+FROM
+    couriers c
+WHERE
+    c.courier_id = $1::INTEGER
+;
+"""
+
+GET_COURIER_REGION_STATS = """
+SELECT
+    courier_id, region, duration_sum, deliveries_count
+FROM
+    courier_region_stats
+;
+"""
+
+COMPUTE_COURIER_REGION_STATS = """
+SELECT
+    s.courier_id, o.region,
+    sum({duration}) AS duration_sum,
+    count(*) AS deliveries_count
+FROM
+    status s
+INNER JOIN
+    orders o
+ON
+    s.order_id = o.order_id
+WHERE
+    s.completed_time IS NOT NULL
+GROUP BY
+    s.courier_id, o.region
+;
+""".format(duration=_DELIVERY_DURATION.format(status='s').strip())
+
+# The key is claimed for the request if it's new, its response
+# is older than $4 seconds or it has been handled for more than
+# $5 seconds, otherwise the stored row is returned.
+# A row inserted by a request being handled concurrently isn't
+# in the snapshot, nothing is returned then.
+CLAIM_RESPONSE = """
+WITH claimed AS (
+    INSERT INTO
+        idempotent_responses (key, endpoint, fingerprint, created_time)
+    VALUES
+        ($1::VARCHAR, $2::VARCHAR, $3::BYTEA, now())
+    ON CONFLICT (key, endpoint) DO UPDATE SET
+        fingerprint = EXCLUDED.fingerprint,
+        status = NULL,
+        body = NULL,
+        created_time = EXCLUDED.created_time
+    WHERE
+        idempotent_responses.created_time <
+            now() - $4::DOUBLE PRECISION * INTERVAL '1 second' OR
+        idempotent_responses.status IS NULL AND
+        idempotent_responses.created_time <
+            now() - $5::DOUBLE PRECISION * INTERVAL '1 second'
+    RETURNING
+        TRUE AS claimed, fingerprint, status, body
+)
+SELECT
+    *
+FROM
+    claimed
+UNION ALL
+SELECT
+    FALSE, r.fingerprint, r.status, r.body
+FROM
+    idempotent_responses r
+WHERE
+    r.key = $1::VARCHAR AND
+    r.endpoint = $2::VARCHAR AND
+    NOT EXISTS (SELECT 1 FROM claimed)
+;
+"""
+
+SAVE_RESPONSE = """
+UPDATE
+    idempotent_responses
+SET
+    status = $3::SMALLINT,
+    body = $4::BYTEA
+WHERE
+    key = $1::VARCHAR AND
+    endpoint = $2::VARCHAR
+;
+"""
+
+# the request failed, so its retry is handled again
+RELEASE_RESPONSE = """
+DELETE FROM
+    idempotent_responses
+WHERE
+    key = $1::VARCHAR AND
+    endpoint = $2::VARCHAR AND
+    status IS NULL
+;
+"""
+
+# responses older than $1 seconds and ones
+# besides the newest $2 of them are dropped
+PURGE_RESPONSES = """
+DELETE FROM
+    idempotent_responses
+WHERE
+    created_time < now() - $1::DOUBLE PRECISION * INTERVAL '1 second' OR
+    created_time <= (
+        SELECT
+            created_time
+        FROM
+            idempotent_responses
+        ORDER BY
+            created_time DESC
+        OFFSET
+            $2::INTEGER
+        LIMIT
+            1
+    )
+;
+"""
+
+REBUILD_COURIER_REGION_STATS = """
+DELETE FROM courier_region_stats;
+INSERT INTO
+    courier_region_stats (courier_id, region, duration_sum, deliveries_count)
+{compute}""".format(compute=COMPUTE_COURIER_REGION_STATS.lstrip())
+
+REBUILD_COURIER_EARNINGS = """
+DELETE FROM courier_earnings;
+{earn};
+""".format(earn=_EARN.format(delivery='deliveries', payment=DELIVERY_PAYMENT).strip())
+
 COMMANDS = {
     "create": {
         "courier_type": CREATE_COURIER_TYPE_TABLE,
         "courier": CREATE_COURIER_TABLE,
         "order": CREATE_ORDER_TABLE,
-        "status": CREATE_STATUS_TABLE
+        "delivery": CREATE_DELIVERY_TABLE,
+        "status": CREATE_STATUS_TABLE,
+        "courier_region_stats": CREATE_COURIER_REGION_STATS_TABLE,
+        "courier_earnings": CREATE_COURIER_EARNINGS_TABLE,
+        "order_indexes": CREATE_ORDER_INDEXES,
+        "status_indexes": CREATE_STATUS_INDEXES,
+        "change_triggers": CREATE_CHANGE_TRIGGERS,
+        "update_courier_function": CREATE_UPDATE_COURIER_FUNCTION,
+        "complete_order_function": CREATE_COMPLETE_ORDER_FUNCTION,
+        "idempotent_responses": CREATE_IDEMPOTENT_RESPONSES_TABLE
     },
+    "upgrade": {
+        "deliveries": UPGRADE_DELIVERIES,
+        "time_columns": UPGRADE_TIME_COLUMNS,
+        "status_deliveries": UPGRADE_STATUS_DELIVERIES,
+        "status_indexes": UPGRADE_STATUS_INDEXES,
+        "indexes": _if_not_exists(CREATE_ORDER_INDEXES + CREATE_STATUS_INDEXES),
+        # the aggregates are computed from the history again
+        "courier_region_stats":
+            _if_not_exists(CREATE_COURIER_REGION_STATS_TABLE) + REBUILD_COURIER_REGION_STATS,
+        "courier_earnings":
+            _if_not_exists(CREATE_COURIER_EARNINGS_TABLE) + REBUILD_COURIER_EARNINGS,
+        "change_triggers": CREATE_CHANGE_TRIGGERS,
+        "update_courier_function": CREATE_UPDATE_COURIER_FUNCTION,
+        "complete_order_function": CREATE_COMPLETE_ORDER_FUNCTION,
+        "idempotent_responses": CREATE_IDEMPOTENT_RESPONSES_TABLE
+    },
+}
+
+QUERIES = {
+    "fill_courier_types": FILL_COURIER_TYPES,
+    "add_couriers": ADD_COURIERS,
+    "get_courier_types": GET_COURIER_TYPES,
+    "get_courier": GET_COURIER,
+    "update_courier": UPDATE_COURIER,
+    "get_orders": GET_ORDERS,
+    "get_free_orders": GET_FREE_ORDERS,
+    "add_orders": ADD_ORDERS,
+    "get_matching_orders": GET_MATCHING_ORDERS,
+    "get_courier_load": GET_COURIER_LOAD,
+    "get_couriers_with_load": GET_COURIERS_WITH_LOAD,
+    "lock_couriers": LOCK_COURIERS,
+    "assign_orders": ASSIGN_ORDERS,
+    "assign_matching_orders": ASSIGN_MATCHING_ORDERS,
+    "courier_status": _STATUS.format(
+        status_columns=', '.join(_STATUS_COLUMNS),
+        status_condition="TRUE",
+        courier_condition="c.courier_id = $1::INTEGER"),
+    "order_status": _STATUS.format(
+        status_columns=', '.join(_STATUS_COLUMNS),
+        status_condition="s.order_id = $1::INTEGER",
+        courier_condition="c.courier_id = (SELECT courier_id FROM status WHERE order_id = $1::INTEGER)"),
+    "courier_order_status": _STATUS.format(
+        status_columns=', '.join(_STATUS_COLUMNS),
+        status_condition="s.order_id = $2::INTEGER",
+        courier_condition="c.courier_id = $1::INTEGER"),
+    "complete_order": COMPLETE_ORDER,
+    "get_courier_with_stats": GET_COURIER_WITH_STATS,
+    "get_courier_region_stats": GET_COURIER_REGION_STATS,
+    "compute_courier_region_stats": COMPUTE_COURIER_REGION_STATS,
+    "rebuild_courier_region_stats": REBUILD_COURIER_REGION_STATS,
+    "claim_response": CLAIM_RESPONSE,
+    "save_response": SAVE_RESPONSE,
+    "release_response": RELEASE_RESPONSE,
+    "purge_responses": PURGE_RESPONSES,
 }
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from concurrent.futures import Executor as _PoolExecutor, \
+    ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from environs import Env
+from sanic.log import logger
+
+
+__all__ = 'Executor', 'EXECUTOR_KINDS'
+
+EXECUTOR_KINDS = [
+    'thread', 'process', 'none'
+]
+
+env = Env()
+env.read_env()
+
+
+def _timed(func: Callable,
+           *args) -> Tuple[Any, float]:
+    """ Call the function in the pool measuring its run time """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class Executor:
+    """ Pool to run CPU-bound steps of requests out of the event loop.
+
+    A step is sent to the pool only if its payload has at least
+    `threshold` items, smaller ones are cheaper to run in place.
+    The pool is created in every Sanic worker by `start`.
+    """
+    def __init__(self,
+                 kind: str = None,
+                 workers: int = None,
+                 threshold: int = None) -> None:
+        # 'thread' – ThreadPoolExecutor, 'process' – ProcessPoolExecutor,
+        # 'none' – run everything in the event loop
+        self._kind = kind or env('EXECUTOR', 'thread')
+        self._workers = workers or env.int('EXECUTOR_WORKERS', 2)
+        self._threshold = threshold or env.int('EXECUTOR_THRESHOLD', 1000)
+        self._pool: Optional[_PoolExecutor] = None
+
+        if self._kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Executor must be one of {EXECUTOR_KINDS}, "
+                             f"but '{self._kind}' found")
+
+        self._pending = 0
+        self._max_pending = 0
+        self._offloaded = 0
+        self._inline = 0
+        self._run_time = 0.
+        self._max_run_time = 0.
+        self._wait_time = 0.
+
+    @property
+    def is_remote(self) -> bool:
+        """ Whether arguments and results are pickled
+        to be sent to another process """
+        return self._kind == 'process'
+
+    def start(self) -> None:
+        if self._pool is not None or self._kind == 'none':
+            return
+
+        logger.info("Starting %s pool of %s workers",
+                    self._kind, self._workers)
+        if self._kind == 'process':
+            self._pool = ProcessPoolExecutor(max_workers=self._workers)
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self._workers, thread_name_prefix='executor')
+
+    def shutdown(self) -> None:
+        if self._pool is None:
+            return
+
+        logger.info("Shutting %s pool down", self._kind)
+        self._pool.shutdown(wait=True)
+        self._pool = None
+
+    def should_offload(self,
+                       size: int) -> bool:
+        return self._pool is not None and size >= self._threshold
+
+    async def run(self,
+                  size: int,
+                  func: Callable,
+                  *args) -> Any:
+        """
+        Call the function in the pool if the payload is large enough,
+        otherwise call it in place.
+
+        :param size: count of items the function processes.
+        :return: the result of the function.
+        """
+        if not self.should_offload(size):
+            self._inline += 1
+            return func(*args)
+
+        loop = asyncio.get_event_loop()
+
+        self._offloaded += 1
+        self._pending += 1
+        self._max_pending = max(self._max_pending, self._pending)
+        start = time.perf_counter()
+        try:
+            result, run_time = await loop.run_in_executor(
+                self._pool, _timed, func, *args)
+        finally:
+            self._pending -= 1
+
+        self._run_time += run_time
+        self._max_run_time = max(self._max_run_time, run_time)
+        self._wait_time += time.perf_counter() - start - run_time
+        logger.debug("%s of %s items ran in the pool for %.3fs",
+                     getattr(func, '__qualname__', func), size, run_time)
+
+        return result
+
+    def stats(self) -> dict:
+        """
+        Metrics of the pool in this worker.
+
+        `pending` is the count of steps sent to the pool and not
+        completed yet, so it's the queue depth. `run_time` is seconds
+        spent running steps in the pool and `wait_time` is seconds
+        spent waiting for a free worker and passing the data.
+        """
+        return {
+            "kind": self._kind,
+            "workers": self._workers,
+            "threshold": self._threshold,
+            "pending": self._pending,
+            "max_pending": self._max_pending,
+            "offloaded": self._offloaded,
+            "inline": self._inline,
+            "run_time": self._run_time,
+            "max_run_time": self._max_run_time,
+            "wait_time": self._wait_time
+        }
@@ -1,7 +1,10 @@
 import logging
 import os
+import queue
 import sys
-from typing import List
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Callable, List
 
 from environs import Env
 
@@ -15,6 +18,9 @@ DATE_FORMAT = "%d-%m-%Y %H:%M:%S"
 
 LOG_FOLDER = env.path('LOG_FOLDER')
 DEBUG = env.bool('DEBUG')
+# log files are rotated when they reach the size
+LOG_MAX_BYTES = env.int('LOG_MAX_BYTES', 10 * 1024 * 1024)
+LOG_BACKUP_COUNT = env.int('LOG_BACKUP_COUNT', 5)
 
 try:
     os.makedirs(LOG_FOLDER, exist_ok=True)
@@ -46,6 +52,77 @@ class DebugFilter(logging.Filter):
         return self._debug
 
 
+class QueueingHandler(QueueHandler):
+    """ The handler puts formatted records to a queue and a
+    background thread writes them with `handler_class(**kwargs)`,
+    so the event loop doesn't wait for files or streams.
+
+    Threads don't survive fork, so a Sanic worker starts
+    its own one and its own handler with the first record.
+    """
+    def __init__(self,
+                 handler_class: Callable[..., logging.Handler],
+                 **kwargs) -> None:
+        super().__init__(queue.SimpleQueue())
+        self._handler_class = handler_class
+        self._kwargs = kwargs
+        self._target = None
+        self._listener = None
+        self._pid = None
+
+    def _start(self) -> None:
+        self.queue = queue.SimpleQueue()
+        self._target = self._handler_class(**self._kwargs)
+        self._listener = QueueListener(self.queue, self._target)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def emit(self,
+             record: logging.LogRecord) -> None:
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def close(self) -> None:
+        # the rest of the queue is written
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._target.close()
+        super().close()
+
+
+class ProcessFileHandler(RotatingFileHandler):
+    """ The handler writes to the file with the PID of the process
+    in its name. Workers rotating the same file would rename it
+    while others are writing, so every one has its own file. """
+    def __init__(self,
+                 filename: os.PathLike,
+                 **kwargs) -> None:
+        path = Path(filename)
+        super().__init__(
+            path.with_name(f"{path.stem}.{os.getpid()}{path.suffix}"), **kwargs)
+
+
+def _file(filename: str) -> dict:
+    return {
+        "()": QueueingHandler,
+        "handler_class": ProcessFileHandler,
+        "filename": LOG_FOLDER / filename,
+        "maxBytes": LOG_MAX_BYTES,
+        "backupCount": LOG_BACKUP_COUNT,
+        "delay": True
+    }
+
+
+def _stream(stream=sys.stderr) -> dict:
+    return {
+        "()": QueueingHandler,
+        "handler_class": logging.StreamHandler,
+        "stream": stream
+    }
+
+
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -79,44 +156,39 @@ LOGGING_CONFIG = {
     },
     "handlers": {
         "internalStream": {
-            "class": "logging.StreamHandler",
+            **_stream(),
             "formatter": "simple",
             "filters": ["internalFilter", "debugStreamFilter"],
-            "stream": sys.stderr,
             "level": "DEBUG"
         },
         "internalFile": {
-            "class": "logging.FileHandler",
+            **_file("sweets_shop.log"),
             "formatter": "simple",
             "filters": ["internalFilter", "debugFileFilter"],
-            "filename": LOG_FOLDER / "sweets_shop.log",
             "level": "INFO"
         },
         "errorStream": {
-            "class": "logging.StreamHandler",
+            **_stream(),
             "formatter": "simple",
             "filters": ["errorFilter", "debugStreamFilter"],
-            "stream": sys.stderr,
             "level": "WARNING"
         },
         "errorFile": {
-            "class": "logging.FileHandler",
+            **_file("sweets_shop_error.log"),
             "formatter": "simple",
             "filters": ["errorFilter", "debugFileFilter"],
-            "filename": LOG_FOLDER / "sweets_shop_error.log",
             "level": "WARNING"
         },
         "accessStream": {
-            "class": "logging.StreamHandler",
+            **_stream(),
             "formatter": "access",
             "filters": ["internalFilter", "debugStreamFilter"],
             "level": "DEBUG"
         },
         "accessFile": {
-            "class": "logging.FileHandler",
+            **_file("sweets_shop_access.log"),
             "formatter": "access",
             "filters": ["internalFilter", "debugFileFilter"],
-            "filename": LOG_FOLDER / "sweets_shop_access.log",
             "level": "INFO"
         }
     },
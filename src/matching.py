@@ -0,0 +1,64 @@
+from typing import List, Mapping, Sequence
+
+import numpy as np
+
+from src.schedule import parse_span
+
+
+__all__ = 'OrdersBatch',
+
+
+class OrdersBatch:
+    """ Free orders stored column by column to match them
+    with a courier in one batched operation.
+
+    Every delivery span is stored separately
+    with the index of its order in `span_owners`.
+    """
+    def __init__(self,
+                 orders: Sequence[Mapping]) -> None:
+        self.order_ids = np.array([order['order_id'] for order in orders], dtype=np.int64)
+        self.weights = np.array([order['weight'] for order in orders], dtype=np.float64)
+        self.regions = np.array([order['region'] for order in orders], dtype=np.int64)
+
+        spans = [
+            value
+            for index, order in enumerate(orders)
+            for span in order['delivery_hours']
+            for value in (index, *parse_span(span))
+        ]
+        spans = np.array(spans, dtype=np.int64).reshape(-1, 3)
+
+        self.span_owners = spans[:, 0]
+        self.span_starts = spans[:, 1]
+        self.span_stops = spans[:, 2]
+
+    def __len__(self) -> int:
+        return self.order_ids.size
+
+    def match(self, courier) -> List[int]:
+        """
+        Find orders the courier is able to deliver: the weight is
+        not greater than the payload, the region is one of the
+        courier's and a delivery span intercepts a working one.
+
+        It's the same as `_Courier.is_order_valid` for every order.
+
+        :return: indexes of the matched orders in the batch.
+        """
+        if not (len(self) and courier.regions and courier.working_hours):
+            return []
+
+        is_valid = self.weights <= courier.payload
+        is_valid &= np.isin(self.regions, courier.regions)
+
+        is_span_intercept = np.zeros(self.span_owners.size, dtype=bool)
+        for span in courier.working_hours:
+            start, stop = span.minutes
+            is_span_intercept |= (self.span_starts < stop) & (start < self.span_stops)
+
+        is_time_intercept = np.zeros(len(self), dtype=bool)
+        is_time_intercept[self.span_owners[is_span_intercept]] = True
+        is_valid &= is_time_intercept
+
+        return np.flatnonzero(is_valid).tolist()
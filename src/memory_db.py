@@ -0,0 +1,540 @@
+import itertools
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple, AsyncIterator, Callable, Awaitable, \
+    Iterable
+
+from environs import Env
+from sanic.log import logger
+
+from src.assignment import pack, dispatch, PACKING_STRATEGIES
+from src.db_api import _Courier, _Order, CourierStatus, DEFAULT_COURIER_TYPES, \
+    rating, compare_region_stats, now, format_date
+from src.db_commands import DELIVERY_PAYMENT
+from src.metrics import timed, BATCH_SIZE, DB_METHOD_DURATION
+
+
+__all__ = 'MemoryDatabase',
+
+env = Env()
+env.read_env()
+
+
+class MemoryDatabase:
+    """ `Database` keeping everything in dicts of the process.
+
+    Data isn't shared between Sanic workers and is lost on restart,
+    so it's for tests, benchmarks and profiling the service without
+    the database. Methods don't await between reads and writes,
+    so every one of them is atomic in the event loop.
+    """
+    def __init__(self,
+                 packing: str = None,
+                 **kwargs) -> None:
+        # other options of `Database` don't concern the memory
+        self._packing = packing or env('PACKING', 'greedy')
+        self._knapsack_max_items = env.int('KNAPSACK_MAX_ITEMS', 200)
+
+        if self._packing not in PACKING_STRATEGIES:
+            raise ValueError(f"Packing must be one of {PACKING_STRATEGIES}, "
+                             f"but '{self._packing}' found")
+
+        self._types = {
+            courier_type['type']: courier_type
+            for courier_type in DEFAULT_COURIER_TYPES
+        }
+        self._responses_ttl = env.float('IDEMPOTENCY_TTL', 24 * 60 * 60)
+        self._responses_lock_timeout = env.float('IDEMPOTENCY_LOCK_TIMEOUT', 60)
+        self._responses_max_count = env.int('IDEMPOTENCY_MAX_KEYS', 100000)
+        self._reset()
+
+    def _reset(self) -> None:
+        self._couriers: Dict[int, _Courier] = {}
+        self._orders: Dict[int, _Order] = {}
+        self._order_rows: Dict[int, dict] = {}
+        # region -> ids of free orders in the region
+        self._free_orders: Dict[int, Dict[int, None]] = {}
+        # order id -> its status, courier id -> ids of his orders
+        self._statuses: Dict[int, dict] = {}
+        self._courier_orders: Dict[int, Dict[int, None]] = {}
+        self._deliveries: Dict[int, dict] = {}
+        # (courier id, region) -> [duration sum, deliveries count]
+        self._region_stats: Dict[Tuple[int, int], list] = {}
+        # courier id -> [earnings, deliveries count]
+        self._earnings: Dict[int, list] = {}
+
+        self._status_ids = itertools.count(1)
+        self._delivery_ids = itertools.count(1)
+        # (key, endpoint) -> [fingerprint, status, body, created time]
+        # in the order they're claimed, so the oldest are first
+        self._responses: OrderedDict = OrderedDict()
+
+    async def connect(self) -> None:
+        logger.info("Using the memory instead of the database")
+
+    async def close(self) -> None:
+        pass
+
+    async def migrate(self) -> None:
+        self._reset()
+
+    async def upgrade(self) -> None:
+        pass
+
+    def pool_stats(self) -> Tuple[int, int]:
+        return 0, 0
+
+    def cache_stats(self) -> dict:
+        # couriers are read from the memory anyway
+        return {"size": 0, "max_size": 0, "hits": 0, "misses": 0}
+
+    def _courier(self,
+                 courier_id: int,
+                 courier_type: str,
+                 regions: List[int],
+                 working_hours: List[str]) -> _Courier:
+        courier_type = self._types[courier_type]
+        return _Courier({
+            "courier_id": courier_id,
+            "type": courier_type['type'],
+            "regions": regions,
+            "working_hours": working_hours,
+            "c": courier_type['c'],
+            "payload": courier_type['payload']
+        })
+
+    def _insert_couriers(self,
+                         couriers: list) -> None:
+        BATCH_SIZE.observe(len(couriers), operation='add_couriers')
+        ids = [courier.courier_id for courier in couriers]
+        if len(set(ids)) < len(ids) or self._couriers.keys() & ids:
+            raise ValueError("Couriers with the same ids exist")
+
+        for courier in couriers:
+            self._couriers[courier.courier_id] = self._courier(
+                courier.courier_id, courier.courier_type,
+                courier.regions, courier.working_hours)
+
+    def _insert_orders(self,
+                       orders: list) -> None:
+        BATCH_SIZE.observe(len(orders), operation='add_orders')
+        ids = [order.order_id for order in orders]
+        if len(set(ids)) < len(ids) or self._orders.keys() & ids:
+            raise ValueError("Orders with the same ids exist")
+
+        for order in orders:
+            row = {
+                "order_id": order.order_id,
+                "weight": order.weight,
+                "region": order.region,
+                "delivery_hours": list(order.delivery_hours)
+            }
+            self._order_rows[order.order_id] = row
+            self._orders[order.order_id] = _Order(row)
+            self._free_orders.setdefault(order.region, {})[order.order_id] = None
+
+    @timed(DB_METHOD_DURATION, method='add_couriers')
+    async def add_couriers(self,
+                           couriers: list) -> dict:
+        self._insert_couriers(couriers)
+        return {
+            "couriers": [
+                {"id": courier.courier_id}
+                for courier in couriers
+            ]
+        }
+
+    @timed(DB_METHOD_DURATION, method='add_orders')
+    async def add_orders(self,
+                         orders: list) -> dict:
+        self._insert_orders(orders)
+        return {
+            "orders": [
+                {"id": order.order_id}
+                for order in orders
+            ]
+        }
+
+    @asynccontextmanager
+    async def ingestion(self,
+                        table: str) -> AsyncIterator[Callable[[list], Awaitable]]:
+        """ Chunks are added when the block exits, none if it raises """
+        inserts = {
+            "couriers": self._insert_couriers,
+            "orders": self._insert_orders
+        }
+        insert = inserts[table]
+        chunks = []
+
+        async def add(chunk: list) -> None:
+            chunks.append(chunk)
+
+        yield add
+        insert([item for chunk in chunks for item in chunk])
+
+    @timed(DB_METHOD_DURATION, method='get_courier')
+    async def get_courier(self,
+                          courier_id: int) -> Optional[_Courier]:
+        return self._couriers.get(courier_id)
+
+    @timed(DB_METHOD_DURATION, method='get_orders')
+    async def get_orders(self,
+                         orders_ids: List[int]) -> List[_Order]:
+        return [
+            self._orders[order_id]
+            for order_id in sorted(set(orders_ids))
+            if order_id in self._orders
+        ]
+
+    def _uncompleted_orders(self,
+                            courier_id: int) -> List[_Order]:
+        return [
+            self._orders[order_id]
+            for order_id in self._courier_orders.get(courier_id, {})
+            if self._statuses[order_id]['completed_time'] is None
+        ]
+
+    def _earn(self,
+              delivery: dict) -> None:
+        earnings = self._earnings.setdefault(delivery['courier_id'], [0, 0])
+        earnings[0] += DELIVERY_PAYMENT * delivery['coeff']
+        earnings[1] += 1
+
+    def _release(self,
+                 orders_to_release: List[_Order]) -> None:
+        """ Uncompleted orders become free, a delivery is
+        completed if all orders left in it are completed """
+        deliveries = set()
+        for order in orders_to_release:
+            status = self._statuses.get(order.order_id)
+            if status is None or status['completed_time'] is not None:
+                continue
+            del self._statuses[order.order_id]
+            self._courier_orders[status['courier_id']].pop(order.order_id)
+            self._free_orders.setdefault(order.region, {})[order.order_id] = None
+
+            delivery = self._deliveries[status['delivery_id']]
+            delivery['orders_count'] -= 1
+            deliveries.add(status['delivery_id'])
+
+        for delivery_id in deliveries:
+            delivery = self._deliveries[delivery_id]
+            if delivery['completed_time'] is None and \
+                    0 < delivery['completed_count'] == delivery['orders_count']:
+                delivery['completed_time'] = max(
+                    self._statuses[order_id]['completed_time']
+                    for order_id in self._courier_orders[delivery['courier_id']]
+                    if self._statuses[order_id]['delivery_id'] == delivery_id
+                )
+                self._earn(delivery)
+
+    @timed(DB_METHOD_DURATION, method='update_courier')
+    async def update_courier(self,
+                             **data) -> _Courier:
+        courier_id = data.pop('courier_id')
+        current = self._couriers[courier_id]
+
+        courier = self._courier(
+            courier_id,
+            data.get('courier_type') or current.courier_type,
+            data.get('regions') if data.get('regions') is not None else current.regions,
+            data.get('working_hours') if data.get('working_hours') is not None else [
+                str(span) for span in current.working_hours
+            ]
+        )
+        self._couriers[courier_id] = courier
+
+        self._release([
+            order
+            for order in self._uncompleted_orders(courier_id)
+            if not courier.is_order_valid(order)
+        ])
+        return courier
+
+    def _match(self,
+               courier: _Courier) -> List[_Order]:
+        """ Free orders the courier is able to deliver, the oldest first """
+        candidates = sorted(
+            order_id
+            for region in set(courier.regions)
+            for order_id in self._free_orders.get(region, {})
+        )
+        return [
+            self._orders[order_id]
+            for order_id in candidates
+            if courier.is_order_valid(self._orders[order_id])
+        ]
+
+    def _capacity(self,
+                  courier: _Courier) -> float:
+        return courier.payload - sum(
+            order.weight
+            for order in self._uncompleted_orders(courier.courier_id)
+        )
+
+    def _claim(self,
+               courier: _Courier,
+               orders: List[_Order],
+               assigned_time: datetime) -> List[_Order]:
+        """ The orders become a new delivery of the courier """
+        delivery_id = next(self._delivery_ids)
+        self._deliveries[delivery_id] = {
+            "courier_id": courier.courier_id,
+            "coeff": courier.coeff,
+            "assigned_time": assigned_time,
+            "orders_count": len(orders),
+            "completed_count": 0,
+            "completed_time": None
+        }
+
+        courier_orders = self._courier_orders.setdefault(courier.courier_id, {})
+        for order in orders:
+            self._free_orders[order.region].pop(order.order_id)
+            courier_orders[order.order_id] = None
+            self._statuses[order.order_id] = {
+                "id": next(self._status_ids),
+                "courier_id": courier.courier_id,
+                "order_id": order.order_id,
+                "delivery_id": delivery_id,
+                "assigned_time": assigned_time,
+                "completed_time": None
+            }
+        return orders
+
+    @timed(DB_METHOD_DURATION, method='assign_orders')
+    async def assign_orders(self,
+                            courier_id: int) -> Tuple[List[_Order], str]:
+        """ See `Database.assign_orders` """
+        if (courier := self._couriers.get(courier_id)) is None:
+            return [], ''
+
+        orders = self._match(courier)
+        if self._packing != 'all' and orders:
+            indexes = pack([order.weight for order in orders], self._capacity(courier),
+                           self._packing, self._knapsack_max_items)
+            orders = [orders[index] for index in indexes]
+
+        BATCH_SIZE.observe(len(orders), operation='assign_orders')
+        if not orders:
+            return [], ''
+
+        now_ = now()
+        return self._claim(courier, orders, now_), format_date(now_)
+
+    @timed(DB_METHOD_DURATION, method='dispatch')
+    async def dispatch(self,
+                       couriers_ids: List[int]) -> Dict[int, Tuple[List[_Order], str]]:
+        """ See `Database.dispatch` """
+        couriers = [
+            self._couriers[courier_id]
+            for courier_id in sorted(set(couriers_ids))
+            if courier_id in self._couriers
+        ]
+        dispatched = {
+            courier.courier_id: ([], '')
+            for courier in couriers
+        }
+        if len(couriers) < len(set(couriers_ids)):
+            return dispatched
+
+        free_ids = sorted(
+            order_id
+            for orders_ids in self._free_orders.values()
+            for order_id in orders_ids
+        )
+        assigned_indexes = dispatch(
+            couriers, [self._capacity(courier) for courier in couriers],
+            [self._order_rows[order_id] for order_id in free_ids],
+            self._packing, self._knapsack_max_items)
+
+        now_ = now()
+        for courier, indexes in zip(couriers, assigned_indexes):
+            BATCH_SIZE.observe(len(indexes), operation='dispatch')
+            if indexes:
+                orders = [self._orders[free_ids[index]] for index in indexes]
+                dispatched[courier.courier_id] = (
+                    self._claim(courier, orders, now_), format_date(now_))
+
+        return dispatched
+
+    def _status_data(self,
+                     orders_ids: Iterable[int]) -> List[dict]:
+        return [
+            {**self._order_rows[order_id], **self._statuses[order_id]}
+            for order_id in orders_ids
+        ]
+
+    @timed(DB_METHOD_DURATION, method='courier_status')
+    async def courier_status(self,
+                             courier_id: int,
+                             order_id: int = None) -> Optional[CourierStatus]:
+        """ See `Database.courier_status` """
+        if (courier := self._couriers.get(courier_id)) is None:
+            return
+
+        orders_ids = self._courier_orders.get(courier_id, {})
+        if order_id is not None:
+            orders_ids = [order_id] if order_id in orders_ids else []
+        return CourierStatus(self._status_data(orders_ids), courier)
+
+    @timed(DB_METHOD_DURATION, method='order_status')
+    async def order_status(self,
+                           order_id: int) -> Optional[CourierStatus]:
+        """ See `Database.order_status` """
+        if (status := self._statuses.get(order_id)) is None:
+            return
+        return CourierStatus(
+            self._status_data([order_id]), self._couriers[status['courier_id']])
+
+    def _completed_in_delivery(self,
+                               status: dict) -> List[dict]:
+        """ Completed orders of the delivery of the status """
+        return [
+            other
+            for other in map(self._statuses.get,
+                             self._courier_orders[status['courier_id']])
+            if other['delivery_id'] == status['delivery_id'] and
+            other['completed_time'] is not None
+        ]
+
+    def _duration(self,
+                  status: dict) -> float:
+        """ Seconds from the previous completed order
+        of the delivery or from the assignment """
+        key = (status['completed_time'], status['id'])
+        previous = [
+            other['completed_time']
+            for other in self._completed_in_delivery(status)
+            if (other['completed_time'], other['id']) < key
+        ]
+        start = max([status['assigned_time'], *previous])
+        return (status['completed_time'] - start).total_seconds()
+
+    def _add_duration(self,
+                      status: dict,
+                      duration: float,
+                      count: int) -> None:
+        region = self._orders[status['order_id']].region
+        stats = self._region_stats.setdefault((status['courier_id'], region), [0., 0])
+        stats[0] += duration
+        stats[1] += count
+
+    @timed(DB_METHOD_DURATION, method='complete_order')
+    async def complete_order(self,
+                             order_id: int,
+                             completed_time: datetime) -> None:
+        """ See `Database.complete_order` """
+        status = self._statuses.get(order_id)
+        if status is None or status['completed_time'] is not None:
+            return
+
+        # the order completed next in the delivery is measured from this one now
+        key = (completed_time, status['id'])
+        next_ = min(
+            (other for other in self._completed_in_delivery(status)
+             if (other['completed_time'], other['id']) > key),
+            key=lambda other: (other['completed_time'], other['id']), default=None)
+        if next_ is not None:
+            self._add_duration(next_, -self._duration(next_), 0)
+
+        status['completed_time'] = completed_time
+        self._add_duration(status, self._duration(status), 1)
+        if next_ is not None:
+            self._add_duration(next_, self._duration(next_), 0)
+
+        delivery = self._deliveries[status['delivery_id']]
+        delivery['completed_count'] += 1
+        if delivery['completed_count'] == delivery['orders_count']:
+            delivery['completed_time'] = max(
+                other['completed_time'] for other in self._completed_in_delivery(status))
+            self._earn(delivery)
+
+    @timed(DB_METHOD_DURATION, method='courier_with_stats')
+    async def courier_with_stats(self,
+                                 courier_id: int) -> Optional[Tuple[_Courier, Optional[float], int]]:
+        """ See `Database.courier_with_stats` """
+        if (courier := self._couriers.get(courier_id)) is None:
+            return
+
+        averages = [
+            duration_sum / count
+            for (stats_courier_id, _), (duration_sum, count) in self._region_stats.items()
+            if stats_courier_id == courier_id and count > 0
+        ]
+        rating_ = rating(min(averages)) if averages else None
+
+        return courier, rating_, self._earnings.get(courier_id, [0, 0])[0]
+
+    def _computed_region_stats(self) -> List[dict]:
+        stats = {}
+        for status in self._statuses.values():
+            if status['completed_time'] is None:
+                continue
+            key = (status['courier_id'], self._orders[status['order_id']].region)
+            key_stats = stats.setdefault(key, [0., 0])
+            key_stats[0] += self._duration(status)
+            key_stats[1] += 1
+
+        return [
+            {"courier_id": courier_id, "region": region,
+             "duration_sum": duration_sum, "deliveries_count": count}
+            for (courier_id, region), (duration_sum, count) in stats.items()
+        ]
+
+    async def check_courier_region_stats(self) -> List[dict]:
+        """ See `Database.check_courier_region_stats` """
+        stored = [
+            {"courier_id": courier_id, "region": region,
+             "duration_sum": duration_sum, "deliveries_count": count}
+            for (courier_id, region), (duration_sum, count) in self._region_stats.items()
+        ]
+        return compare_region_stats(stored, self._computed_region_stats())
+
+    async def rebuild_courier_region_stats(self) -> None:
+        self._region_stats = {
+            (stats['courier_id'], stats['region']):
+                [stats['duration_sum'], stats['deliveries_count']]
+            for stats in self._computed_region_stats()
+        }
+
+    @timed(DB_METHOD_DURATION, method='claim_response')
+    async def claim_response(self,
+                             key: str,
+                             endpoint: str,
+                             fingerprint: bytes
+                             ) -> Optional[Tuple[bytes, Optional[int], Optional[bytes]]]:
+        self._purge_expired_responses()
+        if (response := self._responses.get((key, endpoint))) is not None:
+            if response[1] is not None or \
+                    response[3] >= time.monotonic() - self._responses_lock_timeout:
+                return tuple(response[:3])
+            # claimed again at the end, responses are kept in the order of time
+            del self._responses[key, endpoint]
+
+        self._responses[key, endpoint] = [fingerprint, None, None, time.monotonic()]
+        if len(self._responses) > self._responses_max_count:
+            self._responses.popitem(last=False)
+
+    async def save_response(self,
+                            key: str,
+                            endpoint: str,
+                            status: int,
+                            body: bytes) -> None:
+        if (response := self._responses.get((key, endpoint))) is not None:
+            response[1:3] = status, body
+
+    async def release_response(self,
+                               key: str,
+                               endpoint: str) -> None:
+        if (response := self._responses.get((key, endpoint))) and response[1] is None:
+            del self._responses[key, endpoint]
+
+    async def purge_responses(self) -> None:
+        self._purge_expired_responses()
+
+    def _purge_expired_responses(self) -> None:
+        expired = time.monotonic() - self._responses_ttl
+        while self._responses and next(iter(self._responses.values()))[3] < expired:
+            self._responses.popitem(last=False)
@@ -0,0 +1,317 @@
+import json
+import os
+import tempfile
+import time
+from bisect import bisect_left
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from environs import Env
+
+
+__all__ = (
+    'Registry', 'Histogram', 'Gauge', 'Counter', 'timed', 'merge', 'render',
+    'REGISTRY', 'REQUEST_DURATION', 'DB_METHOD_DURATION', 'POOL_ACQUIRE_DURATION',
+    'POOL_SIZE', 'POOL_IDLE', 'BATCH_SIZE', 'EXECUTOR_PENDING', 'EXECUTOR_TASKS',
+    'EXECUTOR_RUN_TIME', 'EXECUTOR_WAIT_TIME', 'COURIER_CACHE_SIZE', 'COURIER_CACHE_REQUESTS',
+    'IDEMPOTENT_REQUESTS'
+)
+
+env = Env()
+env.read_env()
+
+# every Sanic worker dumps its metrics to the folder,
+# GET /metrics merges ones of all alive workers
+METRICS_FOLDER = env.path(
+    'METRICS_FOLDER', os.path.join(tempfile.gettempdir(), 'candy_shop_metrics'))
+METRICS_INTERVAL = env.float('METRICS_INTERVAL', 5)
+
+DURATION_BUCKETS = (
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10
+)
+SIZE_BUCKETS = (
+    1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000
+)
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labels: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._samples: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self,
+             labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def snapshot(self) -> dict:
+        return {
+            "type": self.type,
+            "help": self.documentation,
+            "labels": list(self.labels),
+            "samples": [
+                [list(key), value]
+                for key, value in self._samples.items()
+            ]
+        }
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self,
+            value: float,
+            **labels) -> None:
+        self._samples[self._key(labels)] = value
+
+
+class Counter(Gauge):
+    """ Counter, `set` is for values counted elsewhere """
+    type = 'counter'
+
+    def inc(self,
+            value: float = 1,
+            **labels) -> None:
+        key = self._key(labels)
+        self._samples[key] = self._samples.get(key, 0) + value
+
+
+class Histogram(_Metric):
+    """ A sample is counts of values by buckets,
+    the last one is +Inf, and the sum of values """
+    type = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labels: Iterable[str] = (),
+                 buckets: Iterable[float] = DURATION_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self,
+                value: float,
+                **labels) -> None:
+        key = self._key(labels)
+        if (sample := self._samples.get(key)) is None:
+            sample = self._samples[key] = [0] * (len(self.buckets) + 1) + [0.]
+
+        sample[bisect_left(self.buckets, value)] += 1
+        sample[-1] += value
+
+    def snapshot(self) -> dict:
+        return {
+            **super().snapshot(),
+            "buckets": list(self.buckets)
+        }
+
+
+def timed(histogram: Histogram,
+          **labels) -> Callable:
+    """ Observe durations of the coroutine function """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def merge(snapshots: Iterable[Dict[str, dict]]) -> Dict[str, dict]:
+    """ Sum samples with the same labels of snapshots of workers """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if name not in merged:
+                merged[name] = {**metric, "samples": {}}
+            samples = merged[name]["samples"]
+
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                if key not in samples:
+                    samples[key] = value
+                elif metric["type"] == 'histogram':
+                    samples[key] = [a + b for a, b in zip(samples[key], value)]
+                else:
+                    samples[key] += value
+
+    for metric in merged.values():
+        metric["samples"] = [
+            [list(key), value]
+            for key, value in sorted(metric["samples"].items())
+        ]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names: Iterable[str],
+            values: Iterable[str]) -> str:
+    labels = ",".join(
+        f'{name}="{_escape(str(value))}"'
+        for name, value in zip(names, values)
+    )
+    return f"{{{labels}}}" if labels else ""
+
+
+def render(snapshot: Dict[str, dict]) -> str:
+    """ Metrics in the Prometheus text format """
+    lines = []
+    for name, metric in snapshot.items():
+        lines += [
+            f"# HELP {name} {metric['help']}",
+            f"# TYPE {name} {metric['type']}"
+        ]
+        names = metric["labels"]
+
+        for values, value in metric["samples"]:
+            if metric["type"] != 'histogram':
+                lines += [f"{name}{_labels(names, values)} {value}"]
+                continue
+
+            *counts, sum_ = value
+            count = 0
+            for bound, bucket_count in zip([*metric["buckets"], '+Inf'], counts):
+                count += bucket_count
+                bucket_labels = _labels([*names, 'le'], [*values, bound])
+                lines += [f"{name}_bucket{bucket_labels} {count}"]
+            lines += [
+                f"{name}_sum{_labels(names, values)} {sum_}",
+                f"{name}_count{_labels(names, values)} {count}"
+            ]
+    return "\n".join(lines) + "\n"
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    """ Metrics of the process. Collectors are called
+    before a snapshot to set values read from elsewhere. """
+    def __init__(self,
+                 folder: Path = METRICS_FOLDER) -> None:
+        self._folder = Path(folder)
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _register(self,
+                  metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self._register(Histogram(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self._register(Gauge(*args, **kwargs))
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self._register(Counter(*args, **kwargs))
+
+    def add_collector(self,
+                      collector: Callable[[], None]) -> None:
+        self._collectors += [collector]
+
+    def snapshot(self) -> Dict[str, dict]:
+        for collector in self._collectors:
+            collector()
+        return {
+            name: metric.snapshot()
+            for name, metric in self._metrics.items()
+        }
+
+    @property
+    def _path(self) -> Path:
+        return self._folder / f"{os.getpid()}.json"
+
+    def dump(self) -> None:
+        """ Replace the snapshot file of the process """
+        self._folder.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.snapshot()))
+        os.replace(tmp_path, self._path)
+
+    def remove(self) -> None:
+        try:
+            self._path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def load(self) -> List[Dict[str, dict]]:
+        """ Snapshots of alive processes, ones of dead processes are removed """
+        snapshots = []
+        for path in self._folder.glob('*.json'):
+            if not _is_alive(int(path.stem)):
+                path.unlink(missing_ok=True)
+                continue
+            try:
+                snapshots += [json.loads(path.read_text())]
+            except (FileNotFoundError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """ Metrics of all processes, this one is dumped first """
+        self.dump()
+        return render(merge(self.load()))
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', "Duration of HTTP requests",
+    labels=('route', 'method', 'status'))
+DB_METHOD_DURATION = REGISTRY.histogram(
+    'db_method_duration_seconds', "Duration of Database methods",
+    labels=('method',))
+POOL_ACQUIRE_DURATION = REGISTRY.histogram(
+    'db_pool_acquire_seconds', "Time waiting for a connection of the pool")
+POOL_SIZE = REGISTRY.gauge(
+    'db_pool_size', "Count of open connections of the pool")
+POOL_IDLE = REGISTRY.gauge(
+    'db_pool_idle', "Count of open connections not in use")
+BATCH_SIZE = REGISTRY.histogram(
+    'batch_size', "Count of items added or assigned at once",
+    labels=('operation',), buckets=SIZE_BUCKETS)
+EXECUTOR_PENDING = REGISTRY.gauge(
+    'executor_pending', "Count of steps sent to the executor and not completed",
+    labels=('executor',))
+EXECUTOR_TASKS = REGISTRY.counter(
+    'executor_tasks_total', "Count of steps run in the pool or in place",
+    labels=('executor', 'where'))
+EXECUTOR_RUN_TIME = REGISTRY.counter(
+    'executor_run_seconds_total', "Time steps were running in the pool",
+    labels=('executor',))
+EXECUTOR_WAIT_TIME = REGISTRY.counter(
+    'executor_wait_seconds_total', "Time steps were waiting for the pool",
+    labels=('executor',))
+COURIER_CACHE_SIZE = REGISTRY.gauge(
+    'courier_cache_size', "Count of couriers in the cache")
+COURIER_CACHE_REQUESTS = REGISTRY.counter(
+    'courier_cache_requests_total', "Count of couriers found in the cache or not",
+    labels=('result',))
+IDEMPOTENT_REQUESTS = REGISTRY.counter(
+    'idempotent_requests_total', "Requests with an idempotency key by how they were answered",
+    labels=('endpoint', 'result'))
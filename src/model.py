@@ -1,9 +1,15 @@
 from datetime import datetime
-from typing import Any, Dict, List
+from functools import partial
+from typing import Any, Callable, Dict, List, Tuple
 
 from pydantic import BaseModel, conlist, validator, conint, \
     confloat
+from sanic.log import error_logger
 
+from src.schedule import parse_span
+
+
+_setattr = object.__setattr__
 
 DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 POSSIBLE_COURIER_TYPES = [
@@ -12,14 +18,7 @@ POSSIBLE_COURIER_TYPES = [
 
 
 def validate_time(time: str) -> str:
-    start, stop = time.split('-')
-
-    start = datetime.strptime(start, "%H:%M").time()
-    stop = datetime.strptime(stop, "%H:%M").time()
-
-    if start >= stop:
-        raise ValueError
-
+    parse_span(time)
     return time
 
 
@@ -112,3 +111,174 @@ class CompleteModel(BaseModel):
             "order_id": int,
             "complete_time": str
         }
+
+
+class DispatchModel(BaseModel):
+    """ The model is expected to represent `dispatch` requests """
+    class Config:
+        extra = 'forbid'
+
+    couriers: conlist(conint(strict=True, gt=0), min_items=1)
+
+    @classmethod
+    def schema(cls) -> Dict[str, Any]:
+        return {
+            "couriers": List[int]
+        }
+
+
+# Checks below are written out inline for speed, they must accept
+# the same values as the models: `conint(strict=True, gt=0)` is
+# `type(value) is int and value > 0` (`type` excludes bool),
+# numbers in place of str are converted by pydantic, but they
+# can't be courier types or time spans anyway.
+
+def _are_time_spans(value: Any) -> bool:
+    if type(value) is not list:
+        return False
+
+    try:
+        for span in value:
+            if type(span) is not str:
+                return False
+            parse_span(span)
+    except ValueError:
+        return False
+    return True
+
+
+def _check_courier(item: dict) -> dict:
+    courier_id, courier_type = item['courier_id'], item['courier_type']
+    regions, working_hours = item['regions'], item['working_hours']
+
+    if not (type(courier_id) is int and courier_id > 0):
+        raise ValueError("'courier_id' is invalid")
+    if not (type(courier_type) is str and
+            (courier_type := courier_type.lower()) in POSSIBLE_COURIER_TYPES):
+        raise ValueError("'courier_type' is invalid")
+    if type(regions) is not list:
+        raise ValueError("'regions' is invalid")
+    for region in regions:
+        if not (type(region) is int and region > 0):
+            raise ValueError("'regions' is invalid")
+    if not _are_time_spans(working_hours):
+        raise ValueError("'working_hours' is invalid")
+
+    return {
+        "courier_id": courier_id,
+        "courier_type": courier_type,
+        "regions": regions[:],
+        "working_hours": working_hours[:]
+    }
+
+
+def _check_order(item: dict) -> dict:
+    order_id, weight = item['order_id'], item['weight']
+    region, delivery_hours = item['region'], item['delivery_hours']
+
+    if not (type(order_id) is int and order_id > 0):
+        raise ValueError("'order_id' is invalid")
+    # as `confloat(ge=0.01, le=50)`
+    if type(weight) is not float:
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError("'weight' is invalid") from None
+    if not 0.01 <= weight <= 50:
+        raise ValueError("'weight' is invalid")
+    if not (type(region) is int and region > 0):
+        raise ValueError("'region' is invalid")
+    if not _are_time_spans(delivery_hours):
+        raise ValueError("'delivery_hours' is invalid")
+
+    return {
+        "order_id": order_id,
+        "weight": weight,
+        "region": region,
+        "delivery_hours": delivery_hours[:]
+    }
+
+
+class BatchValidator:
+    """ Validate items of a payload the same way as the model
+    does, but with plain checks written for the model.
+
+    Valid items are created without pydantic validation.
+    """
+    def __init__(self,
+                 model,
+                 id_field: str,
+                 check: Callable[[dict], dict]) -> None:
+        self._model = model
+        self._id_field = id_field
+        self._check = check
+        # not `keys()` view to be picklable for a process pool
+        self._fields = frozenset(model.__fields__)
+        self._new = partial(object.__new__, model)
+
+    def validate(self,
+                 item: Any) -> Any:
+        """
+        Validate the item.
+
+        :return: the model.
+        :exception ValueError: if the item is invalid.
+        """
+        if type(item) is not dict:
+            raise ValueError(f"Item must be an object, but {type(item)} found")
+        if item.keys() != self._fields:
+            raise ValueError(f"Fields must be {list(self._model.__fields__)}, "
+                             f"but {list(item.keys())} found")
+
+        # the same as `construct()` does for models
+        # with no default values and private attributes
+        model = self._new()
+        _setattr(model, '__dict__', self._check(item))
+        _setattr(model, '__fields_set__', set(self._fields))
+
+        return model
+
+    def validate_batch(self,
+                       items: List[Any]) -> Tuple[List[Any], List[int]]:
+        """
+        Validate all the items in one pass.
+
+        :return: valid models and ids of invalid items.
+        """
+        valid, invalid_ids = [], []
+        # `validate` inlined with locals to save calls on every item
+        new, check, fields = self._new, self._check, self._fields
+        add_valid = valid.append
+
+        for item in items:
+            try:
+                if type(item) is not dict or item.keys() != fields:
+                    # to get the same error message
+                    add_valid(self.validate(item))
+                    continue
+                model = new()
+                _setattr(model, '__dict__', check(item))
+                _setattr(model, '__fields_set__', set(fields))
+                add_valid(model)
+            except ValueError as e:
+                invalid_ids += [self.invalid_id(item)]
+                error_logger.warning("Item id=%s is invalid: %s",
+                                     invalid_ids[-1], e)
+
+        return valid, invalid_ids
+
+    def item_id(self,
+                model: Any) -> int:
+        """ Get id of the validated item """
+        return getattr(model, self._id_field)
+
+    def invalid_id(self,
+                   item: Any) -> Any:
+        """ Get id of the invalid item to send it back """
+        if isinstance(item, dict):
+            return item.get(self._id_field, -1)
+        return -1
+
+
+COURIERS_VALIDATOR = BatchValidator(CourierModel, 'courier_id', _check_courier)
+ORDERS_VALIDATOR = BatchValidator(OrderModel, 'order_id', _check_order)
@@ -0,0 +1,132 @@
+from datetime import time
+from functools import lru_cache
+from typing import Iterable, Tuple, Union
+
+
+__all__ = 'TimeSpan', 'DaySchedule', 'parse_span'
+
+TIME_FORMAT = "%H:%M"
+# minutes since midnight for every string `datetime.strptime`
+# accepts as TIME_FORMAT, '09:05', '9:05', '09:5' and '9:5'
+MINUTES = {
+    time_: hour * 60 + minute
+    for hour in range(24)
+    for minute in range(60)
+    for time_ in (f"{hour:02}:{minute:02}", f"{hour}:{minute:02}",
+                  f"{hour:02}:{minute}", f"{hour}:{minute}")
+}
+
+
+def _parse_minutes(time_string: str) -> int:
+    if (minutes := MINUTES.get(time_string)) is None:
+        raise ValueError(f"Time '{time_string}' does not match '{TIME_FORMAT}'")
+    return minutes
+
+
+@lru_cache(maxsize=4096)
+def parse_span(value: str) -> Tuple[int, int]:
+    """
+    Parse 'HH:MM-HH:MM' string to minutes since midnight.
+
+    :return: start and stop of the span.
+    :exception ValueError: if the string is invalid
+    or the start is not less than the stop.
+    """
+    start, _, stop = value.partition('-')
+    start, stop = _parse_minutes(start), _parse_minutes(stop)
+
+    if start >= stop:
+        raise ValueError("Start must me be less than stop")
+
+    return start, stop
+
+
+def span_mask(start: int,
+              stop: int) -> int:
+    """ Get bitmask with bits set for every minute in [start; stop) """
+    return ((1 << (stop - start)) - 1) << start
+
+
+@lru_cache(maxsize=4096)
+def _parse_time_span(value: str) -> Tuple[time, time, Tuple[int, int], int]:
+    start, stop = parse_span(value)
+    return (time(*divmod(start, 60)),
+            time(*divmod(stop, 60)),
+            (start, stop),
+            span_mask(start, stop))
+
+
+class TimeSpan:
+    def __init__(self,
+                 value: str) -> None:
+        self.__start, self.__stop, self.__minutes, self.__mask = \
+            _parse_time_span(value)
+
+    @property
+    def start(self) -> time:
+        return self.__start
+
+    @property
+    def stop(self) -> time:
+        return self.__stop
+
+    @property
+    def minutes(self) -> Tuple[int, int]:
+        """ Start and stop as minutes since midnight """
+        return self.__minutes
+
+    @property
+    def mask(self) -> int:
+        return self.__mask
+
+    def is_intercept(self, other) -> bool:
+        return self | other
+
+    def __or__(self, other) -> bool:
+        return bool(self.mask & other.mask)
+
+    def __repr__(self) -> str:
+        return f"{self.start.strftime(TIME_FORMAT)}-" \
+               f"{self.stop.strftime(TIME_FORMAT)}"
+
+    def __eq__(self, other) -> bool:
+        return self.start == other.start and \
+               self.stop == other.stop
+
+
+class DaySchedule:
+    """ Set of minutes of a day covered by some time spans.
+
+    Every minute is a bit of the mask, so checking whether
+    two schedules intercept is a single bitwise AND.
+    """
+    __slots__ = '__mask',
+
+    def __init__(self,
+                 spans: Iterable[Union[TimeSpan, str]] = ()) -> None:
+        mask = 0
+        for span in spans:
+            if isinstance(span, str):
+                span = TimeSpan(span)
+            mask |= span.mask
+
+        self.__mask = mask
+
+    @property
+    def mask(self) -> int:
+        return self.__mask
+
+    def is_intercept(self, other) -> bool:
+        return self & other
+
+    def __and__(self, other) -> bool:
+        return bool(self.mask & other.mask)
+
+    def __bool__(self) -> bool:
+        return bool(self.mask)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.mask:#x})"
+
+    def __eq__(self, other) -> bool:
+        return self.mask == other.mask
@@ -0,0 +1,78 @@
+import importlib
+import json
+from typing import Any, Callable, Dict, Optional, Union
+
+from environs import Env
+from sanic.response import HTTPResponse
+
+
+__all__ = 'json_response', 'make_dumps', 'JSON_ENCODERS', 'dumps'
+
+# the first one installed is used by default
+JSON_ENCODERS = [
+    'orjson', 'ujson', 'json'
+]
+
+env = Env()
+env.read_env()
+
+
+def default(obj: Any) -> Any:
+    """ Objects of the database are serialized with `external` """
+    try:
+        external = obj.external
+    except AttributeError:
+        raise TypeError(f"Object of type {obj.__class__.__name__} "
+                        f"is not JSON serializable") from None
+    return external()
+
+
+def _available(name: str) -> bool:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        return False
+    return True
+
+
+def make_dumps(encoder: str = None,
+               indent: bool = None) -> Callable[[Any], Union[str, bytes]]:
+    """
+    Get the function encoding responses with the encoder,
+    indented only if it's asked, with DEBUG=True by default.
+    """
+    encoder = encoder or env('JSON_ENCODER', None) or next(
+        name for name in JSON_ENCODERS if _available(name))
+    indent = env.bool('DEBUG', False) if indent is None else indent
+
+    if encoder not in JSON_ENCODERS:
+        raise ValueError(f"Encoder must be one of {JSON_ENCODERS}, "
+                         f"but '{encoder}' found")
+
+    if encoder == 'orjson':
+        import orjson
+        # orjson encodes dataclasses itself, all their fields
+        option = orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        # bytes are sent as they are, without encoding a str
+        return lambda obj: orjson.dumps(obj, default=default, option=option)
+
+    if encoder == 'ujson':
+        import ujson
+        return lambda obj: ujson.dumps(
+            obj, default=default, ensure_ascii=False, indent=4 if indent else 0)
+
+    separators = None if indent else (',', ':')
+    return lambda obj: json.dumps(
+        obj, default=default, indent=4 if indent else None, separators=separators)
+
+
+dumps = make_dumps()
+
+
+def json_response(body: Any,
+                  status: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> HTTPResponse:
+    return HTTPResponse(
+        dumps(body), status=status, headers=headers, content_type="application/json")
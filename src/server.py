@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
+import asyncio
+import hashlib
 import logging
 import os
 import sys
-from typing import List
+import time
+from functools import wraps
+from typing import Any, Awaitable, Callable, List, Optional
 
 from environs import Env
 from pydantic import ValidationError
@@ -19,9 +23,18 @@ sys.path += [
 ]
 
 
-from src.db_api import Database, is_json_patching_courier_valid, PATCHABLE_FIELDS
+from src.db_api import Database, is_json_patching_courier_valid, PATCHABLE_FIELDS, \
+    parse_date
+from src.executor import Executor
 from src.logging_config import LOGGING_CONFIG
-from src.model import CourierModel, OrderModel, CompleteModel
+from src.memory_db import MemoryDatabase
+from src.metrics import REGISTRY, METRICS_INTERVAL, REQUEST_DURATION, POOL_SIZE, POOL_IDLE, \
+    EXECUTOR_PENDING, EXECUTOR_TASKS, EXECUTOR_RUN_TIME, EXECUTOR_WAIT_TIME, \
+    COURIER_CACHE_SIZE, COURIER_CACHE_REQUESTS, IDEMPOTENT_REQUESTS
+from src.model import CourierModel, OrderModel, CompleteModel, DispatchModel, \
+    BatchValidator, COURIERS_VALIDATOR, ORDERS_VALIDATOR
+from src.serialization import json_response
+from src.streaming import iter_json_array, JsonStreamError
 
 
 os.environ['PYTHONWARNINGS'] = 'ignore'
@@ -41,13 +54,41 @@ def validation_error(field_name: str,
     return error_message
 
 
-app = Sanic(__name__, log_config=LOGGING_CONFIG)
-app.blueprint(swagger_blueprint)
-app.db = Database()
+class IngestionRejected(Exception):
+    pass
+
 
 env = Env()
 env.read_env()
 
+app = Sanic(__name__, log_config=LOGGING_CONFIG)
+app.blueprint(swagger_blueprint)
+app.executor = Executor()
+# dispatch matches the whole free pool, so it's sent to processes
+app.dispatch_executor = Executor(kind=env('DISPATCH_EXECUTOR', 'process'))
+# 'postgres' – Database, 'memory' – MemoryDatabase
+# keeping data in the worker, so it's the only one
+DB_BACKENDS = {
+    'postgres': Database,
+    'memory': MemoryDatabase
+}
+DB_BACKEND = env('DB_BACKEND', 'postgres')
+app.db = DB_BACKENDS[DB_BACKEND](
+    executor=app.executor, dispatch_executor=app.dispatch_executor)
+
+# whether to parse POST /couriers and POST /orders
+# payloads one item at a time, adding them in chunks
+STREAM_INGESTION = env.bool('STREAM_INGESTION', False)
+STREAM_CHUNK_SIZE = env.int('STREAM_CHUNK_SIZE', 1000)
+# seconds a streamed payload might be uploaded and added in,
+# a connection is held since the first chunk is added
+STREAM_TIMEOUT = env.float('STREAM_TIMEOUT', 60)
+
+# retries of requests with the same key get the stored response
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_PURGE_INTERVAL = env.float('IDEMPOTENCY_PURGE_INTERVAL', 60)
+
 app.config.update({
     "API_HOST": f"{env('HOST')}:{env('PORT')}",
     "API_TITLE": "Candy Delivery App",
@@ -57,20 +98,217 @@ app.config.update({
 })
 
 
+def collect_metrics() -> None:
+    size, idle = app.db.pool_stats()
+    POOL_SIZE.set(size)
+    POOL_IDLE.set(idle)
+
+    cache = app.db.cache_stats()
+    COURIER_CACHE_SIZE.set(cache['size'])
+    COURIER_CACHE_REQUESTS.set(cache['hits'], result='hit')
+    COURIER_CACHE_REQUESTS.set(cache['misses'], result='miss')
+
+    for name, executor in (('requests', app.executor), ('dispatch', app.dispatch_executor)):
+        stats = executor.stats()
+        EXECUTOR_PENDING.set(stats['pending'], executor=name)
+        EXECUTOR_TASKS.set(stats['offloaded'], executor=name, where='pool')
+        EXECUTOR_TASKS.set(stats['inline'], executor=name, where='inline')
+        EXECUTOR_RUN_TIME.set(stats['run_time'], executor=name)
+        EXECUTOR_WAIT_TIME.set(stats['wait_time'], executor=name)
+
+
+REGISTRY.add_collector(collect_metrics)
+
+
+async def dump_metrics() -> None:
+    """ Let other workers read metrics of this one """
+    while True:
+        REGISTRY.dump()
+        await asyncio.sleep(METRICS_INTERVAL)
+
+
+async def purge_responses() -> None:
+    """ Drop expired responses to requests with idempotency keys """
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL)
+        try:
+            await app.db.purge_responses()
+        except Exception:
+            error_logger.exception("Purging stored responses failed")
+
+
+def idempotent(endpoint: str) -> Callable:
+    """
+    Handle a request with an idempotency key once: the response
+    is stored and its retries get it without calling the handler.
+
+    A retry sent while the request is being handled gets 409 and
+    one with another body gets 422. The key is released if the
+    handler fails, so the retry is handled again.
+    """
+    def decorator(handler: Callable[..., Awaitable[response.HTTPResponse]]) -> Callable:
+        @wraps(handler)
+        async def wrapper(request: Request, *args, **kwargs) -> response.HTTPResponse:
+            if (key := request.headers.get(IDEMPOTENCY_HEADER)) is None:
+                return await handler(request, *args, **kwargs)
+
+            if not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+                error_logger.warning("%s must be 1-%s chars long",
+                                     IDEMPOTENCY_HEADER, IDEMPOTENCY_KEY_MAX_LENGTH)
+                return response.HTTPResponse(status=400)
+
+            fingerprint = hashlib.sha256(request.body).digest()
+            if (stored := await app.db.claim_response(key, endpoint, fingerprint)) is not None:
+                stored_fingerprint, status, body = stored
+                if stored_fingerprint != fingerprint:
+                    IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, result='mismatch')
+                    error_logger.warning("%s is used with another request", IDEMPOTENCY_HEADER)
+                    return response.HTTPResponse(status=422)
+                if status is None:
+                    IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, result='in_progress')
+                    return response.HTTPResponse(status=409)
+
+                IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, result='replayed')
+                return response.HTTPResponse(
+                    body, status=status, headers={"Idempotent-Replayed": 'true'},
+                    content_type="application/json" if body else None)
+
+            try:
+                resp = await handler(request, *args, **kwargs)
+            except BaseException:
+                await app.db.release_response(key, endpoint)
+                raise
+
+            if resp.status >= 500:
+                await app.db.release_response(key, endpoint)
+            else:
+                await app.db.save_response(key, endpoint, resp.status, resp.body or b'')
+            IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, result='handled')
+            return resp
+        return wrapper
+    return decorator
+
+
 @app.listener('after_server_start')
 async def create_db_connection(app: Sanic, loop) -> None:
+    # every worker has its own pool
+    app.executor.start()
+    app.dispatch_executor.start()
     await app.db.connect()
+    app.add_task(dump_metrics())
+    app.add_task(purge_responses())
 
     if env.bool('migrate', False):
         await app.db.migrate()
+    elif env.bool('upgrade', False):
+        await app.db.upgrade()
 
 
 @app.listener('after_server_stop')
 async def close_db_connection(app: Sanic, loop) -> None:
     await app.db.close()
+    app.executor.shutdown()
+    app.dispatch_executor.shutdown()
+    REGISTRY.remove()
+
+
+@app.middleware('request')
+async def start_timer(request: Request) -> None:
+    request.ctx.start_time = time.perf_counter()
+
+
+@app.middleware('response')
+async def observe_duration(request: Request,
+                           response_: response.HTTPResponse) -> None:
+    if (start_time := getattr(request.ctx, 'start_time', None)) is None:
+        return
+    REQUEST_DURATION.observe(
+        time.perf_counter() - start_time,
+        route=request.uri_template or 'unknown',
+        method=request.method,
+        status=response_.status
+    )
+
+
+def data_items(body: Any) -> Optional[list]:
+    """ Items of the 'data' array of the body, None if there are none """
+    if not isinstance(body, dict) or not isinstance(body.get('data'), list):
+        error_logger.warning("Request rejected, there is no data array in the body")
+        return
+    return body['data']
+
+
+async def ingest_stream(request: Request,
+                        table: str,
+                        validator: BatchValidator) -> response.HTTPResponse:
+    """
+    Validate the streamed items one by one and add them in chunks.
+
+    Like the whole body handlers, nothing is added if
+    any item is invalid and all invalid ids are sent back.
+    The transaction is rolled back and 408 is sent if
+    it takes more than STREAM_TIMEOUT seconds.
+    """
+    added_ids, invalid_ids = [], []
+
+    async def ingest() -> None:
+        chunk = []
+        async with app.db.ingestion(table) as insert:
+            async for item in iter_json_array(request.stream, 'data'):
+                try:
+                    item = validator.validate(item)
+                except ValueError as e:
+                    invalid_ids.append(validator.invalid_id(item))
+                    error_logger.warning("Item id=%s is invalid: %s",
+                                         invalid_ids[-1], e)
+                    continue
+
+                # the transaction will be rolled back, stop adding
+                if invalid_ids:
+                    continue
+
+                chunk += [item]
+                if len(chunk) >= STREAM_CHUNK_SIZE:
+                    await insert(chunk)
+                    added_ids.extend(validator.item_id(item) for item in chunk)
+                    chunk = []
+
+            if invalid_ids:
+                raise IngestionRejected
+            if chunk:
+                await insert(chunk)
+                added_ids.extend(validator.item_id(item) for item in chunk)
+
+    try:
+        await asyncio.wait_for(ingest(), STREAM_TIMEOUT)
+    except asyncio.TimeoutError:
+        error_logger.warning("Request rejected, %s aren't added in %s seconds",
+                             table, STREAM_TIMEOUT)
+        return response.HTTPResponse(status=408)
+    except IngestionRejected:
+        error_logger.warning(
+            "Request rejected, it contains invalid %s (%s)",
+            table, len(invalid_ids)
+        )
+        context = validation_error(table, invalid_ids)
+        return json_response(context, status=400)
+    except JsonStreamError as e:
+        error_logger.warning("Failed when parsing body as json: %s", e)
+        return response.HTTPResponse(status=400)
+    except KeyError as e:
+        error_logger.warning("Request rejected, there is no %s in the body", e)
+        return response.HTTPResponse(status=400)
+
+    context = {
+        table: [
+            {"id": id_}
+            for id_ in added_ids
+        ]
+    }
+    return json_response(context, status=201)
 
 
-@app.post('/couriers')
+@app.post('/couriers', stream=STREAM_INGESTION)
 @doc.tag("Add couriers")
 @doc.summary("Add some couriers to the service")
 @doc.consumes(doc.JsonBody({"data": [CourierModel.schema()]}), location="body",
@@ -80,15 +318,13 @@ async def close_db_connection(app: Sanic, loop) -> None:
 @doc.response(400, {"validation_error": {"couriers": [{"id": int}]}},
               description="Some of couriers are invalid")
 async def add_couriers(request: Request) -> response.HTTPResponse:
-    couriers, invalid_couriers_id = [], []
-    for courier in request.json['data']:
-        try:
-            courier = CourierModel(**courier)
-        except ValidationError as e:
-            invalid_couriers_id += [courier.get('courier_id', -1)]
-            error_logger.warning(e.json(indent=4))
-        else:
-            couriers += [courier]
+    if request.stream is not None:
+        return await ingest_stream(request, 'couriers', COURIERS_VALIDATOR)
+
+    if (items := data_items(request.json)) is None:
+        return response.HTTPResponse(status=400)
+    couriers, invalid_couriers_id = await app.executor.run(
+        len(items), COURIERS_VALIDATOR.validate_batch, items)
 
     if invalid_couriers_id:
         error_logger.warning(
@@ -96,11 +332,11 @@ async def add_couriers(request: Request) -> response.HTTPResponse:
             len(invalid_couriers_id)
         )
         context = validation_error('couriers', invalid_couriers_id)
-        return response.json(context, status=400)
+        return json_response(context, status=400)
 
     added_couriers = await app.db.add_couriers(couriers)
 
-    return response.json(added_couriers, status=201)
+    return json_response(added_couriers, status=201)
 
 
 @app.patch('/couriers/<courier_id:int>')
@@ -123,60 +359,47 @@ async def update_courier(request: Request,
         error_logger.warning("Courier id=%s not found", courier_id)
         return response.HTTPResponse(status=404)
 
-    courier = CourierModel(**courier.external())
-
     try:
-        courier_data = {**courier.dict(), **request.json}
-        updated_courier = CourierModel(**courier_data)
+        patched = CourierModel(**{**courier.external(), **request.json})
     except ValidationError as e:
         error_logger.warning(e.json(indent=4))
         return response.HTTPResponse(status=400)
 
-    await app.db.update_courier(
-        courier_id=courier.courier_id,
-        **request.json
+    # orders the courier isn't able to deliver anymore are released
+    # by the same statement, the updated courier is sent as it's stored
+    updated_courier = await app.db.update_courier(
+        courier_id=courier_id,
+        **{field: getattr(patched, field) for field in request.json}
     )
 
-    return response.json(updated_courier.dict(), indent=4)
+    return json_response(updated_courier)
 
 
 @app.get('/couriers/<courier_id:int>')
 @doc.tag("Get courier")
 @doc.summary("Get info about a courier")
 @doc.description("Also calculate additional info: rating, salary")
-@doc.response(200, CourierModel.schema().update({"rating": float, "earning": float}),
+@doc.response(200, CourierModel.schema().update({"rating": float, "earnings": int}),
               description="Courier info calculated and sent")
 @doc.response(404, None, description="Courier not found")
 async def get_courier(request: Request,
                       courier_id: int) -> response.HTTPResponse:
-    courier_status = await app.db.courier_status(courier_id)
-    if not courier_status:
+    # rating and earnings are read from the stats updated on completing orders
+    if (courier_with_stats := await app.db.courier_with_stats(courier_id)) is None:
         error_logger.warning("Courier id=%s not found", courier_id)
         return response.HTTPResponse(status=404)
 
-    # TODO: move it to thread_pool_executor
-    completed_orders_ids = {
-        status.order_id
-        for status in courier_status.statuses
-        if status.completed_time is not None
-    }
-
-    json = courier_status.courier.external()
+    courier, rating, earnings = courier_with_stats
 
-    if not completed_orders_ids:
-        return response.json(json, indent=4)
+    json = courier.external()
+    if rating is not None:
+        json['rating'] = rating
+    json['earnings'] = earnings
 
-    completed_orders = [
-        order
-        for order in courier_status.orders
-        if order.order_id in completed_orders_ids
-    ]
-    completed_orders.sort(key=lambda order: order.completed_time)
+    return json_response(json)
 
-    return response.json(json, indent=4)
 
-
-@app.post('/orders')
+@app.post('/orders', stream=STREAM_INGESTION)
 @doc.tag("Add orders")
 @doc.summary("Add some orders")
 @doc.consumes(doc.JsonBody({"data": [OrderModel.schema()]}),
@@ -186,15 +409,13 @@ async def get_courier(request: Request,
 @doc.response(400, {"validation_error": {"orders": [{"id": int}]}},
               description="Some of orders are invalid")
 async def add_orders(request: Request) -> response.HTTPResponse:
-    orders, invalid_orders_id = [], []
-    for order in request.json['data']:
-        try:
-            order = OrderModel(**order)
-        except ValidationError as e:
-            invalid_orders_id += [order.get('order_id', -1)]
-            error_logger.warning(e.json(indent=4))
-        else:
-            orders += [order]
+    if request.stream is not None:
+        return await ingest_stream(request, 'orders', ORDERS_VALIDATOR)
+
+    if (items := data_items(request.json)) is None:
+        return response.HTTPResponse(status=400)
+    orders, invalid_orders_id = await app.executor.run(
+        len(items), ORDERS_VALIDATOR.validate_batch, items)
 
     if invalid_orders_id:
         error_logger.warning(
@@ -202,11 +423,11 @@ async def add_orders(request: Request) -> response.HTTPResponse:
             len(invalid_orders_id)
         )
         context = validation_error('orders', invalid_orders_id)
-        return response.json(context, status=400)
+        return json_response(context, status=400)
 
     added_orders = await app.db.add_orders(orders)
 
-    return response.json(added_orders, status=201)
+    return json_response(added_orders, status=201)
 
 
 @app.post('/orders/assign')
@@ -217,6 +438,11 @@ async def add_orders(request: Request) -> response.HTTPResponse:
 @doc.response(400, None, description="The courier not found")
 @doc.response(200, {"orders": [{"id": int}], "assign_time": str},
               description="Orders assigned to the courier")
+@doc.consumes(doc.String(name=IDEMPOTENCY_HEADER, description="Retries get the first response"),
+              location="header")
+@doc.response(409, None, description="A request with the key is being handled")
+@doc.response(422, None, description="The key is used with another request")
+@idempotent('assign')
 async def assign(request: Request) -> response.HTTPResponse:
     courier_id = request.json.get('courier_id', -1)
 
@@ -233,7 +459,48 @@ async def assign(request: Request) -> response.HTTPResponse:
     }
     if time:
         context["assign_time"] = time
-    return response.json(context, indent=4)
+    return json_response(context)
+
+
+@app.post('/orders/dispatch')
+@doc.tag("Dispatch orders")
+@doc.summary("Assign orders to many couriers at once")
+@doc.consumes(doc.JsonBody(DispatchModel.schema()), location="body",
+              required=True, content_type="application/json")
+@doc.response(400, {"validation_error": {"couriers": [{"id": int}]}},
+              description="The request is invalid or some couriers not found")
+@doc.response(200, {"couriers": [{"id": int, "orders": [{"id": int}], "assign_time": str}]},
+              description="Orders assigned to every courier")
+async def dispatch(request: Request) -> response.HTTPResponse:
+    try:
+        dispatch = DispatchModel(**request.json)
+    except (ValidationError, TypeError) as e:
+        error_logger.warning(e)
+        return response.HTTPResponse(status=400)
+
+    couriers_ids = list(dict.fromkeys(dispatch.couriers))
+    dispatched = await app.db.dispatch(couriers_ids)
+
+    if unknown_ids := [id_ for id_ in couriers_ids if id_ not in dispatched]:
+        error_logger.warning("Couriers not found (%s)", len(unknown_ids))
+        context = validation_error('couriers', unknown_ids)
+        return json_response(context, status=400)
+
+    context = {"couriers": []}
+    for courier_id in couriers_ids:
+        orders, time = dispatched[courier_id]
+        courier_context = {
+            "id": courier_id,
+            "orders": [
+                {"id": order.order_id}
+                for order in orders
+            ]
+        }
+        if time:
+            courier_context["assign_time"] = time
+        context["couriers"] += [courier_context]
+
+    return json_response(context)
 
 
 @app.post('/orders/complete')
@@ -243,6 +510,11 @@ async def assign(request: Request) -> response.HTTPResponse:
               required=True, content_type="application/json")
 @doc.response(400, None, description="The request is invalid")
 @doc.response(200, {"order_id": int}, description="Order completed")
+@doc.consumes(doc.String(name=IDEMPOTENCY_HEADER, description="Retries get the first response"),
+              location="header")
+@doc.response(409, None, description="A request with the key is being handled")
+@doc.response(422, None, description="The key is used with another request")
+@idempotent('complete')
 async def complete(request: Request) -> response.HTTPResponse:
     try:
         complete = CompleteModel(**request.json)
@@ -250,7 +522,8 @@ async def complete(request: Request) -> response.HTTPResponse:
         error_logger.warning(e.json(indent=4))
         return response.HTTPResponse(status=400)
 
-    courier_status = await app.db.courier_status(complete.courier_id)
+    courier_status = await app.db.courier_status(
+        complete.courier_id, complete.order_id)
 
     if courier_status is None:
         error_logger.warning("Courier id=%s not found", complete.courier_id)
@@ -266,9 +539,28 @@ async def complete(request: Request) -> response.HTTPResponse:
         return response.HTTPResponse(status=400)
 
     await app.db.complete_order(
-        complete.order_id, complete.complete_time)
+        complete.order_id, parse_date(complete.complete_time))
+
+    return json_response({"order_id": complete.order_id})
+
+
+@app.get('/executor/stats')
+@doc.tag("Executor stats")
+@doc.summary("Get metrics of the worker's executor pool")
+@doc.response(200, {"pending": int, "max_pending": int, "offloaded": int, "inline": int,
+                    "run_time": float, "max_run_time": float, "wait_time": float},
+              description="Metrics of the worker which handled the request")
+async def executor_stats(request: Request) -> response.HTTPResponse:
+    return json_response(app.executor.stats())
+
 
-    return response.json({"order_id": complete.order_id})
+@app.get('/metrics')
+@doc.tag("Metrics")
+@doc.summary("Get metrics of all workers in the Prometheus text format")
+@doc.produces(str, content_type="text/plain")
+async def metrics(request: Request) -> response.HTTPResponse:
+    return response.text(REGISTRY.render(),
+                         content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.exception(ServerError, Exception)
@@ -289,13 +581,13 @@ async def error_handler(request: Request,
             "json": error_json
         }
     }
-    return response.json(context, indent=4, status=500)
+    return json_response(context, status=500)
 
 
 if __name__ == "__main__":
     debug = env.bool('DEBUG', False)
 
-    workers = 1 if debug else os.cpu_count()
+    workers = 1 if debug or DB_BACKEND == 'memory' else os.cpu_count()
     logger_level = 'DEBUG' if debug else 'INFO'
 
     logging.getLogger('sanic.root').setLevel(logger_level)
@@ -0,0 +1,143 @@
+import codecs
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Tuple
+
+
+__all__ = 'iter_json_array', 'JsonStreamError'
+
+WHITESPACE = ' \t\n\r'
+# an item might be truncated by the end of the buffer, but
+# if the buffer is so large the item is just invalid
+MAX_ITEM_SIZE = 1024 * 1024
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class _JsonStream:
+    """ Buffer of a JSON document read from chunks of bytes """
+    def __init__(self,
+                 chunks: AsyncIterable[bytes]) -> None:
+        self._chunks = chunks.__aiter__()
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._is_exhausted = False
+
+    async def _read(self) -> bool:
+        """ Read the next chunk to the buffer, drop the parsed part.
+
+        :return: whether something has been read.
+        """
+        if self._is_exhausted:
+            return False
+
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            chunk, self._is_exhausted = b'', True
+
+        self._buffer = self._buffer[self._position:] + \
+            self._decoder.decode(chunk or b'', final=self._is_exhausted)
+        self._position = 0
+
+        return True
+
+    async def peek(self) -> str:
+        """ Skip whitespaces and get the next char without consuming it """
+        while True:
+            while self._position < len(self._buffer) and \
+                    self._buffer[self._position] in WHITESPACE:
+                self._position += 1
+
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not await self._read():
+                raise JsonStreamError("Unexpected end of JSON")
+
+    async def expect(self,
+                     chars: str) -> str:
+        """ Consume the next char, it must be one of the chars """
+        if (char := await self.peek()) not in chars:
+            raise JsonStreamError(f"Expected one of '{chars}', but '{char}' found")
+
+        self._position += 1
+        return char
+
+    async def value(self) -> Any:
+        """ Decode the next JSON value """
+        await self.peek()
+
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(
+                    self._buffer, self._position)
+            except json.JSONDecodeError:
+                pass
+            else:
+                # a number at the end of the buffer might continue
+                if end < len(self._buffer) or self._is_exhausted:
+                    self._position = end
+                    return value
+
+            if len(self._buffer) - self._position > MAX_ITEM_SIZE:
+                raise JsonStreamError("JSON value is too large or invalid")
+            if not await self._read():
+                raise JsonStreamError("Invalid JSON value")
+
+    async def key(self) -> Tuple[str, bool]:
+        """ Decode the next key of an object.
+
+        :return: the key and whether the object is over.
+        """
+        if await self.peek() == '}':
+            self._position += 1
+            return '', True
+
+        key = await self.value()
+        await self.expect(':')
+
+        return key, False
+
+
+async def iter_json_array(chunks: AsyncIterable[bytes],
+                          key: str) -> AsyncIterator[Any]:
+    """
+    Parse a JSON object from chunks of bytes one item
+    of the array under the key at a time.
+
+    Other values of the object are parsed and skipped.
+
+    :exception JsonStreamError: if the JSON is invalid.
+    :exception KeyError: if there is no such key in the object.
+    """
+    stream = _JsonStream(chunks)
+    is_found = False
+
+    await stream.expect('{')
+    while True:
+        name, is_over = await stream.key()
+        if is_over:
+            break
+
+        if name != key or is_found:
+            await stream.value()
+        else:
+            is_found = True
+            await stream.expect('[')
+
+            if await stream.peek() == ']':
+                await stream.expect(']')
+            else:
+                while True:
+                    yield await stream.value()
+                    if await stream.expect(',]') == ']':
+                        break
+
+        if await stream.expect(',}') == '}':
+            break
+
+    if not is_found:
+        raise KeyError(key)
@@ -132,6 +132,18 @@ def test_add_courier_with_no_courier(add_couriers_mock: mock.AsyncMock):
     assert response.json == {'couriers': []}
 
 
+@pytest.mark.parametrize(
+    'path', ('/couriers', '/orders')
+)
+@pytest.mark.parametrize(
+    'json', ({}, {'data': 1}, [])
+)
+def test_add_without_data(path, json):
+    request, response = app.test_client.post(path, json=json)
+
+    assert response.status == 400
+
+
 @mock.patch("src.server.app.db.get_courier")
 def test_update_courier_with_no_courier(get_courier_mock: mock.AsyncMock):
     pass
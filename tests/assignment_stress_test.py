@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Concurrent assignment and completion against a real database.
+
+The database is migrated, so all its data is lost. It's
+used only if TEST_DB_DSN is set, the tests are skipped otherwise.
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import timedelta
+
+import pytest
+
+from src.assignment import PACKING_STRATEGIES
+from src.db_api import Database, MATCHING_MODES, parse_date
+from src.model import COURIERS_VALIDATOR, ORDERS_VALIDATOR
+from tests.random_data import random_courier, random_order
+
+logging.disable(logging.CRITICAL)
+
+TEST_DB_DSN = os.environ.get('TEST_DB_DSN')
+
+COURIERS_COUNT = 50
+ORDERS_COUNT = 5000
+
+pytestmark = pytest.mark.skipif(
+    not TEST_DB_DSN, reason="TEST_DB_DSN is not set")
+
+# couriers carrying more than their payload
+OVERLOADED = (
+    "SELECT s.courier_id FROM status s "
+    "INNER JOIN orders o ON s.order_id = o.order_id "
+    "INNER JOIN couriers c ON s.courier_id = c.courier_id "
+    "INNER JOIN courier_types t ON c.courier_type = t.id "
+    "WHERE s.completed_time IS NULL "
+    "GROUP BY s.courier_id, t.payload HAVING sum(o.weight::NUMERIC) > t.payload;")
+
+
+async def fill(db: Database,
+               rnd: random.Random) -> None:
+    couriers = []
+    for courier_id in range(1, COURIERS_COUNT + 1):
+        courier = random_courier(courier_id, rnd)
+        couriers += [{
+            "courier_id": courier_id,
+            "courier_type": rnd.choice(['foot', 'bike', 'car']),
+            "regions": courier['regions'] or [1],
+            "working_hours": courier['working_hours'] or ['00:00-23:59']
+        }]
+
+    orders = [
+        random_order(order_id, rnd)
+        for order_id in range(1, ORDERS_COUNT + 1)
+    ]
+
+    await db.migrate()
+    await db.add_couriers(COURIERS_VALIDATOR.validate_batch(couriers)[0])
+    await db.add_orders(ORDERS_VALIDATOR.validate_batch(orders)[0])
+
+
+async def assign_concurrently(matching: str,
+                              packing: str,
+                              rounds: int) -> None:
+    db = Database(matching=matching, packing=packing, dsn=TEST_DB_DSN)
+    await db.connect()
+
+    try:
+        await fill(db, random.Random(matching))
+
+        assigned_ids = []
+        for _ in range(rounds):
+            results = await asyncio.gather(*(
+                db.assign_orders(courier_id)
+                for courier_id in range(1, COURIERS_COUNT + 1)
+            ))
+            assigned_ids += [
+                order.order_id
+                for orders, _ in results
+                for order in orders
+            ]
+
+        statuses = await db.get(
+            "SELECT count(*), count(DISTINCT order_id) FROM status;")
+        deliveries = await db.get(
+            "SELECT COALESCE(sum(orders_count), 0) AS orders_count FROM deliveries;")
+        unassigned = await db.get(
+            "SELECT count(*) FROM orders o WHERE NOT EXISTS "
+            "(SELECT 1 FROM status s WHERE s.order_id = o.order_id);")
+        overloaded = await db.get(OVERLOADED)
+    finally:
+        await db.close()
+
+    # no order is assigned twice, every claimed order is sent
+    # to its courier and counted in exactly one delivery
+    assert len(assigned_ids) == len(set(assigned_ids))
+    assert statuses[0][0] == statuses[0][1] == len(assigned_ids)
+    assert deliveries[0]['orders_count'] == len(assigned_ids)
+    assert unassigned[0][0] + len(assigned_ids) == ORDERS_COUNT
+    # orders aren't completed, so all of them are carried
+    assert not overloaded or packing == 'all'
+
+
+@pytest.mark.parametrize(
+    'matching', MATCHING_MODES
+)
+@pytest.mark.parametrize(
+    'packing', PACKING_STRATEGIES
+)
+def test_concurrent_assignment(matching, packing):
+    asyncio.run(assign_concurrently(matching, packing, rounds=3))
+
+
+async def assign_one_courier_concurrently(matching: str,
+                                          packing: str,
+                                          requests: int) -> None:
+    db = Database(matching=matching, packing=packing, dsn=TEST_DB_DSN)
+    await db.connect()
+    rnd = random.Random(packing)
+
+    def sample(match):
+        # other couriers claim orders meanwhile,
+        # so the requests pack different ones
+        async def wrapper(courier):
+            orders = await match(courier)
+            return rnd.sample(orders, len(orders) // 2)
+        return wrapper
+
+    db._match_free_orders = sample(db._match_free_orders)
+    db._get_matching_orders = sample(db._get_matching_orders)
+
+    try:
+        await fill(db, rnd)
+
+        # every request reads the load of the courier
+        # before the others claim unless it's locked
+        results = await asyncio.gather(*(
+            db.assign_orders(1)
+            for _ in range(requests)
+        ))
+        assigned_ids = [
+            order.order_id
+            for orders, _ in results
+            for order in orders
+        ]
+        overloaded = await db.get(OVERLOADED)
+    finally:
+        await db.close()
+
+    assert assigned_ids
+    assert len(assigned_ids) == len(set(assigned_ids))
+    assert not overloaded or packing == 'all'
+
+
+@pytest.mark.parametrize(
+    'matching', MATCHING_MODES
+)
+@pytest.mark.parametrize(
+    'packing', PACKING_STRATEGIES
+)
+def test_concurrent_assignment_to_one_courier(matching, packing):
+    asyncio.run(assign_one_courier_concurrently(matching, packing, requests=20))
+
+
+async def dispatch_concurrently(packing: str,
+                                batches: int) -> None:
+    db = Database(packing=packing, dsn=TEST_DB_DSN)
+    await db.connect()
+
+    try:
+        await fill(db, random.Random(packing))
+
+        couriers_ids = list(range(1, COURIERS_COUNT + 1))
+        results = await asyncio.gather(*(
+            db.dispatch(couriers_ids[i::batches])
+            for i in range(batches)
+        ), db.dispatch([1, COURIERS_COUNT + 1]))
+        unknown = results.pop()
+
+        assigned_ids = [
+            order.order_id
+            for dispatched in results
+            for orders, _ in dispatched.values()
+            for order in orders
+        ]
+        statuses = await db.get(
+            "SELECT count(*), count(DISTINCT order_id) FROM status;")
+        overloaded = await db.get(OVERLOADED)
+    finally:
+        await db.close()
+
+    # nothing is assigned if a courier is not found
+    assert unknown == {1: ([], '')}
+    assert assigned_ids
+    assert len(assigned_ids) == len(set(assigned_ids))
+    assert statuses[0][0] == statuses[0][1] == len(assigned_ids)
+    assert not overloaded or packing == 'all'
+
+
+@pytest.mark.parametrize(
+    'packing', PACKING_STRATEGIES
+)
+def test_concurrent_dispatch(packing):
+    asyncio.run(dispatch_concurrently(packing, batches=3))
+
+
+async def dispatch_to_same_couriers_concurrently(packing: str,
+                                                 requests: int) -> None:
+    db = Database(packing=packing, dsn=TEST_DB_DSN)
+    await db.connect()
+    rnd = random.Random(packing)
+
+    get_free_orders = db._get_free_orders_records
+
+    async def sample_free_orders():
+        # other couriers claim orders meanwhile,
+        # so the requests pack different ones
+        orders = await get_free_orders()
+        return rnd.sample(orders, len(orders) // 2)
+
+    db._get_free_orders_records = sample_free_orders
+
+    async def assign(courier_id: int) -> dict:
+        return {courier_id: await db.assign_orders(courier_id)}
+
+    try:
+        await fill(db, rnd)
+
+        # the couriers are locked in the same order whatever
+        # order of ids is given, and assignments wait for them too
+        results = await asyncio.gather(*(
+            call
+            for _ in range(requests)
+            for call in (db.dispatch([1, 2, 3]), db.dispatch([3, 2, 1]),
+                         assign(2))
+        ))
+        assigned_ids = [
+            order.order_id
+            for dispatched in results
+            for orders, _ in dispatched.values()
+            for order in orders
+        ]
+        overloaded = await db.get(OVERLOADED)
+    finally:
+        await db.close()
+
+    assert assigned_ids
+    assert len(assigned_ids) == len(set(assigned_ids))
+    assert not overloaded or packing == 'all'
+
+
+@pytest.mark.parametrize(
+    'packing', PACKING_STRATEGIES
+)
+def test_concurrent_dispatch_to_same_couriers(packing):
+    asyncio.run(dispatch_to_same_couriers_concurrently(packing, requests=10))
+
+
+async def patch_while_assigning(matching: str,
+                                rounds: int) -> None:
+    # couriers are patched by another worker, so the cached ones
+    # the assigning worker matches orders for might be outdated
+    db = Database(matching=matching, dsn=TEST_DB_DSN)
+    other = Database(dsn=TEST_DB_DSN)
+    await db.connect()
+    await other.connect()
+    rnd = random.Random(rounds)
+
+    async def patch(courier_id: int) -> None:
+        courier = random_courier(courier_id, rnd)
+        await other.update_courier(
+            courier_id=courier_id,
+            courier_type=rnd.choice(['foot', 'bike', 'car']),
+            regions=courier['regions'] or [1],
+            working_hours=courier['working_hours'] or ['00:00-23:59'])
+
+    try:
+        await fill(db, random.Random(matching))
+
+        for _ in range(rounds):
+            await asyncio.gather(*(
+                call
+                for courier_id in range(1, COURIERS_COUNT + 1)
+                for call in (db.assign_orders(courier_id), patch(courier_id))
+            ))
+
+        invalid = await db.get(
+            "SELECT s.order_id FROM status s "
+            "INNER JOIN orders o ON s.order_id = o.order_id "
+            "INNER JOIN couriers c ON s.courier_id = c.courier_id "
+            "INNER JOIN courier_types t ON c.courier_type = t.id "
+            "WHERE s.completed_time IS NULL AND NOT ("
+            "o.region = ANY(c.regions) AND o.weight <= t.payload AND EXISTS ("
+            "SELECT 1 FROM unnest(o.delivery_hours) d (span), unnest(c.working_hours) w (span) "
+            "WHERE split_part(d.span, '-', 1)::TIME < split_part(w.span, '-', 2)::TIME AND "
+            "split_part(w.span, '-', 1)::TIME < split_part(d.span, '-', 2)::TIME));")
+        deliveries = await db.get(
+            "SELECT d.id FROM deliveries d "
+            "WHERE d.orders_count <> (SELECT count(*) FROM status s WHERE s.delivery_id = d.id);")
+    finally:
+        await db.close()
+        await other.close()
+
+    # every order left to a courier is still valid for him and
+    # deliveries count only orders which weren't released
+    assert invalid == []
+    assert deliveries == []
+
+
+@pytest.mark.parametrize(
+    'matching', MATCHING_MODES
+)
+def test_patch_while_assigning(matching):
+    asyncio.run(patch_while_assigning(matching, rounds=3))
+
+
+async def complete_concurrently(rounds: int) -> None:
+    db = Database(dsn=TEST_DB_DSN)
+    await db.connect()
+    rnd = random.Random(rounds)
+
+    try:
+        await fill(db, rnd)
+
+        for _ in range(rounds):
+            completions = []
+            for courier_id in range(1, COURIERS_COUNT + 1):
+                orders, assign_time = await db.assign_orders(courier_id)
+                completions += [
+                    (order.order_id, parse_date(assign_time) +
+                     timedelta(minutes=rnd.randrange(1, 60)))
+                    for order in orders
+                ]
+            # orders of a delivery are completed at once, in any order
+            rnd.shuffle(completions)
+            await asyncio.gather(*(
+                db.complete_order(order_id, completed_time)
+                for order_id, completed_time in completions
+            ))
+
+        mismatches = await db.check_courier_region_stats()
+        deliveries = await db.get(
+            "SELECT d.id FROM deliveries d WHERE d.completed_count <> d.orders_count OR "
+            "d.completed_time IS DISTINCT FROM "
+            "(SELECT max(s.completed_time) FROM status s WHERE s.delivery_id = d.id);")
+        earnings = await db.get(
+            "SELECT (SELECT COALESCE(sum(deliveries_count), 0) FROM courier_earnings) AS paid, "
+            "(SELECT count(*) FROM deliveries) AS deliveries;")
+    finally:
+        await db.close()
+
+    # the stored stats are the same as ones of the whole history,
+    # every delivery is completed with its last order and paid once
+    assert mismatches == []
+    assert deliveries == []
+    assert earnings[0]['paid'] == earnings[0]['deliveries']
+
+
+def test_concurrent_completion():
+    asyncio.run(complete_concurrently(rounds=2))
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
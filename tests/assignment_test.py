@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import itertools
+import random
+
+import pytest
+
+from src.assignment import pack, dispatch
+from src.db_api import _Courier, _Order
+from tests.random_data import random_courier, random_order, random_weights
+
+
+def load(weights: list,
+         indexes: list) -> float:
+    return round(sum(weights[index] for index in indexes), 2)
+
+
+def greedy(weights: list,
+           capacity: float) -> list:
+    packed = []
+    for index, weight in enumerate(weights):
+        if round(weight, 2) <= round(capacity, 2):
+            packed += [index]
+            capacity -= weight
+    return packed
+
+
+def heaviest_load(weights: list,
+                  capacity: float) -> float:
+    return max(
+        load(weights, indexes)
+        for size in range(len(weights) + 1)
+        for indexes in itertools.combinations(range(len(weights)), size)
+        if load(weights, indexes) <= capacity
+    )
+
+
+@pytest.mark.parametrize(
+    'seed', range(20)
+)
+def test_greedy_takes_oldest_fitting(seed):
+    rnd = random.Random(seed)
+    weights = random_weights(rnd.randrange(0, 30), rnd)
+    capacity = rnd.choice([10, 15, 50]) - rnd.uniform(0, 10)
+
+    packed = pack(weights, capacity, 'greedy')
+
+    assert packed == greedy(weights, capacity)
+    assert load(weights, packed) <= capacity
+
+
+@pytest.mark.parametrize(
+    'seed', range(20)
+)
+def test_knapsack_is_optimal(seed):
+    rnd = random.Random(seed)
+    weights = random_weights(rnd.randrange(0, 12), rnd)
+    capacity = rnd.choice([10, 15, 50])
+
+    packed = pack(weights, capacity, 'knapsack')
+
+    assert packed == sorted(set(packed))
+    assert load(weights, packed) == heaviest_load(weights, capacity)
+
+
+def test_knapsack_fills_greedily_after_max_items():
+    weights = [6, 6, 10, 4]
+
+    assert pack(weights, 10, 'knapsack', max_items=2) == [0, 3]
+    assert pack(weights, 10, 'knapsack', max_items=3) == [2]
+
+
+@pytest.mark.parametrize(
+    'strategy', ('greedy', 'knapsack')
+)
+def test_no_capacity_left(strategy):
+    assert pack([0.01, 1], 0, strategy) == []
+    assert pack([0.01, 1], -5, strategy) == []
+    assert pack([], 10, strategy) == []
+
+
+def test_all_ignores_capacity():
+    assert pack([10, 10, 10], 15, 'all') == [0, 1, 2]
+
+
+def test_wrong_strategy():
+    with pytest.raises(ValueError):
+        pack([1], 10, 'best')
+
+
+@pytest.mark.parametrize(
+    'seed', range(10)
+)
+@pytest.mark.parametrize(
+    'strategy', ('all', 'greedy', 'knapsack')
+)
+def test_dispatch(seed, strategy):
+    rnd = random.Random(seed)
+    orders = [
+        random_order(order_id, rnd)
+        for order_id in range(1, 501)
+    ]
+    couriers = [
+        _Courier(random_courier(courier_id, rnd))
+        for courier_id in range(1, 21)
+    ]
+    capacities = [
+        courier.payload - rnd.choice([0, 5, 60])
+        for courier in couriers
+    ]
+
+    assigned = dispatch(couriers, capacities, orders, strategy)
+
+    assert len(assigned) == len(couriers)
+    indexes = [index for courier_indexes in assigned for index in courier_indexes]
+    assert len(indexes) == len(set(indexes))
+
+    for courier, capacity, courier_indexes in zip(couriers, capacities, assigned):
+        assert courier_indexes == sorted(courier_indexes)
+        assert all(
+            courier.is_order_valid(_Order(orders[index]))
+            for index in courier_indexes
+        )
+        weights = [orders[index]['weight'] for index in courier_indexes]
+        assert strategy == 'all' or load(weights, range(len(weights))) <= max(capacity, 0)
+
+
+def test_dispatch_constrained_courier_first():
+    orders = [
+        {"order_id": 1, "weight": 5, "region": 1, "delivery_hours": ["10:00-11:00"]},
+        {"order_id": 2, "weight": 5, "region": 2, "delivery_hours": ["10:00-11:00"]},
+    ]
+    couriers = [
+        _Courier({"courier_id": 1, "type": "car", "regions": [1, 2],
+                  "working_hours": ["09:00-18:00"], "c": 9, "payload": 50}),
+        _Courier({"courier_id": 2, "type": "foot", "regions": [1],
+                  "working_hours": ["09:00-18:00"], "c": 2, "payload": 10}),
+    ]
+
+    assert dispatch(couriers, [50, 10], orders) == [[1], [0]]
+    assert dispatch(couriers, [50, 10], []) == [[], []]
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import os
+
+import pytest
+
+from src.cache import LRUCache
+from src.db_api import Database
+from src.db_commands import TABLES
+from tests.memory_db_test import courier, order
+
+logging.disable(logging.CRITICAL)
+
+TEST_DB_DSN = os.environ.get('TEST_DB_DSN')
+
+
+def test_least_recently_used_is_dropped():
+    cache = LRUCache(2)
+    cache.put(1, 'a')
+    cache.put(2, 'b')
+    cache.get(1)
+    cache.put(3, 'c')
+
+    assert [cache.get(key) for key in (1, 2, 3)] == ['a', None, 'c']
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 3, "misses": 1}
+
+
+def test_invalidate():
+    cache = LRUCache(10)
+    cache.put(1, 'a')
+    cache.put(2, 'b')
+    cache.invalidate([1, 3])
+
+    assert cache.get(1) is None and cache.get(2) == 'b'
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_loaded_value_is_not_put_after_write():
+    cache = LRUCache(10)
+    generation = cache.generation
+    # written while the old value was being loaded
+    cache.put(1, 'new')
+    cache.put_loaded(1, 'old', generation)
+
+    assert cache.get(1) == 'new'
+
+    generation = cache.generation
+    cache.put_loaded(2, 'loaded', generation)
+    assert cache.get(2) == 'loaded'
+
+
+def test_disabled():
+    cache = LRUCache(0)
+    cache.put(1, 'a')
+
+    assert cache.get(1) is None and len(cache) == 0
+
+
+@pytest.mark.skipif(not TEST_DB_DSN, reason="TEST_DB_DSN is not set")
+def test_database_caches_couriers():
+    async def scenario():
+        db = Database(dsn=TEST_DB_DSN)
+        await db.connect()
+        try:
+            await db.migrate()
+            await db.add_couriers([courier(1)])
+
+            first = await db.get_courier(1)
+            second = await db.get_courier(1)
+            updated = await db.update_courier(courier_id=1, courier_type='car')
+            third = await db.get_courier(1)
+            missing = await db.get_courier(2)
+
+            return first, second, updated, third, missing, db.cache_stats()
+        finally:
+            await db.close()
+
+    first, second, updated, third, missing, stats = asyncio.run(scenario())
+
+    assert second is first
+    # the updated courier is loaded again
+    assert third is not updated and third.courier_type == updated.courier_type == 'car'
+    assert missing is None
+    assert stats['hits'] == 1 and stats['misses'] == 3 and stats['size'] == 1
+
+
+async def wait_for(condition,
+                   timeout: float = 5) -> None:
+    for _ in range(int(timeout / 0.05)):
+        if condition():
+            return
+        await asyncio.sleep(0.05)
+
+
+@pytest.mark.skipif(not TEST_DB_DSN, reason="TEST_DB_DSN is not set")
+def test_changes_of_other_workers_invalidate_couriers():
+    async def scenario():
+        worker, other = Database(dsn=TEST_DB_DSN), Database(dsn=TEST_DB_DSN)
+        await worker.connect()
+        await other.connect()
+        changes = []
+        worker.on_change('couriers', lambda op, ids: changes.append((op, ids)))
+        try:
+            await worker.migrate()
+            await other.add_couriers([courier(1)])
+            await other.add_orders([order(1, 1), order(2, 1)])
+
+            cached = await worker.get_courier(1)
+            await other.update_courier(courier_id=1, courier_type='car')
+            await wait_for(lambda: 1 not in worker._couriers._items)
+            updated = await worker.get_courier(1)
+
+            await other.assign_orders(1)
+            # only tables somebody listens to notify, NOTIFY serializes commits
+            notifying = await worker.get(
+                "SELECT DISTINCT tgrelid::regclass::TEXT AS name FROM pg_trigger "
+                "WHERE tgname LIKE '%\\_changes'")
+            return cached, updated, changes, sorted(row['name'] for row in notifying)
+        finally:
+            await worker.close()
+            await other.close()
+
+    cached, updated, changes, notifying = asyncio.run(scenario())
+
+    assert cached.courier_type == 'foot'
+    assert updated.courier_type == 'car'
+    assert ('UPDATE', [1]) in changes
+    assert notifying == ['courier_types', 'couriers']
+
+
+@pytest.mark.skipif(not TEST_DB_DSN, reason="TEST_DB_DSN is not set")
+def test_couriers_are_not_cached_without_listener():
+    async def scenario():
+        db = Database(dsn=TEST_DB_DSN)
+        db._relisten_delay = 0.1
+        await db.connect()
+        try:
+            await db.migrate()
+            await db.add_couriers([courier(1)])
+            await db.get_courier(1)
+
+            async with db._acquire() as conn:
+                await conn.execute("SELECT pg_terminate_backend($1)",
+                                   db._listener.get_server_pid())
+            await wait_for(lambda: not db.is_listening)
+            lost = len(db._couriers), db.is_listening
+            await db.get_courier(1)
+            not_cached = len(db._couriers)
+
+            await wait_for(lambda: db.is_listening)
+            await db.get_courier(1)
+            return lost, not_cached, len(db._couriers)
+        finally:
+            await db.close()
+
+    assert asyncio.run(scenario()) == ((0, False), 0, 1)
+
+
+@pytest.mark.skipif(not TEST_DB_DSN, reason="TEST_DB_DSN is not set")
+def test_courier_types_are_loaded_after_migration_of_other_worker():
+    async def scenario():
+        worker, other = Database(dsn=TEST_DB_DSN), Database(dsn=TEST_DB_DSN)
+        await other.connect()
+        try:
+            async with other._acquire() as conn:
+                await Database._drop_tables(TABLES, conn)
+            await worker.connect()
+            before = len(worker._courier_types)
+
+            await other.migrate()
+            await other.add_couriers([courier(1, 'bike')])
+            await wait_for(lambda: len(worker._courier_types) == 3)
+            return before, await worker.get_courier(1)
+        finally:
+            await worker.close()
+            await other.close()
+
+    before, courier_ = asyncio.run(scenario())
+
+    assert before == 0
+    assert (courier_.courier_type, courier_.coeff, courier_.payload) == ('bike', 5, 15)
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
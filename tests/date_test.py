@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.db_api import DATE_FORMAT, format_date, parse_date
+
+
+@pytest.mark.parametrize(
+    'date', (
+        datetime(2021, 1, 10, 9, 32, 14, 420000),
+        datetime(2021, 1, 10, 9, 32, 14),
+        datetime(1999, 12, 31, 23, 59, 59, 999999),
+        datetime(2021, 1, 10, 9, 32, 14, 1, tzinfo=timezone.utc),
+    )
+)
+def test_format_date_as_strftime(date):
+    assert format_date(date) == date.strftime(DATE_FORMAT)
+
+
+def test_format_date_in_utc():
+    date = datetime(2021, 1, 10, 12, 32, 14, 420000,
+                    tzinfo=timezone(timedelta(hours=3)))
+
+    assert format_date(date) == "2021-01-10T09:32:14.420000Z"
+
+
+@pytest.mark.parametrize(
+    'date_str', (
+        "2021-01-10T09:32:14.42Z",
+        "2021-01-10T09:32:14.420000Z",
+        "2021-01-10T00:00:00.0Z",
+    )
+)
+def test_parse_and_format_date(date_str):
+    date = parse_date(date_str)
+
+    assert date.tzinfo is timezone.utc
+    assert parse_date(format_date(date)) == date
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import random
+
+import pytest
+
+from src.db_api import _Courier, _match_one_by_one, _match_vectorized
+from src.executor import Executor
+from src.model import ORDERS_VALIDATOR
+from tests.random_data import random_courier, random_order
+
+
+def run(executor: Executor,
+        size: int,
+        func,
+        *args):
+    async def run_():
+        executor.start()
+        try:
+            return await executor.run(size, func, *args)
+        finally:
+            executor.shutdown()
+    return asyncio.run(run_())
+
+
+def get_pid() -> int:
+    return os.getpid()
+
+
+@pytest.mark.parametrize(
+    ('kind', 'size', 'is_offloaded'), (
+        ('thread', 10, True),
+        ('thread', 9, False),
+        ('process', 10, True),
+        ('none', 10, False),
+    )
+)
+def test_offload_by_threshold(kind, size, is_offloaded):
+    executor = Executor(kind, workers=1, threshold=10)
+
+    pid = run(executor, size, get_pid)
+    stats = executor.stats()
+
+    assert (pid != os.getpid()) is (kind == 'process' and is_offloaded)
+    assert stats['offloaded'] == int(is_offloaded)
+    assert stats['inline'] == int(not is_offloaded)
+    assert stats['pending'] == 0
+    assert (stats['run_time'] > 0) is is_offloaded
+
+
+def test_wrong_kind():
+    with pytest.raises(ValueError):
+        Executor('fiber')
+
+
+@pytest.mark.parametrize(
+    'kind', ('thread', 'process')
+)
+def test_validate_in_pool(kind):
+    rnd = random.Random(kind)
+    items = [random_order(order_id, rnd) for order_id in range(1, 101)]
+    items[5]['weight'] = 100
+
+    valid, invalid_ids = run(Executor(kind, workers=1, threshold=1), len(items),
+                             ORDERS_VALIDATOR.validate_batch, items)
+
+    assert invalid_ids == [6]
+    assert [order.order_id for order in valid] == \
+        [order_id for order_id in range(1, 101) if order_id != 6]
+
+
+@pytest.mark.parametrize(
+    ('kind', 'match'), (
+        ('thread', _match_one_by_one),
+        ('process', _match_one_by_one),
+        ('process', _match_vectorized),
+    )
+)
+def test_match_in_pool(kind, match):
+    rnd = random.Random(1)
+    orders = [random_order(order_id, rnd) for order_id in range(1, 1001)]
+    courier = _Courier(random_courier(1, rnd))
+
+    expected = match(courier, orders)
+
+    assert run(Executor(kind, workers=1, threshold=1), len(orders),
+               match, courier, orders) == expected
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
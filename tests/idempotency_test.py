@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import logging
+
+import mock
+import pytest
+
+from src.memory_db import MemoryDatabase
+from src.server import app, IDEMPOTENCY_HEADER
+from tests.memory_db_test import BACKENDS, run
+
+logging.disable(logging.CRITICAL)
+
+
+@pytest.mark.parametrize(
+    'backend', BACKENDS
+)
+def test_store_responses(backend):
+    async def scenario(db):
+        first = await db.claim_response('key', 'assign', b'request')
+        in_progress = await db.claim_response('key', 'assign', b'request')
+        other_endpoint = await db.claim_response('key', 'complete', b'request')
+
+        await db.save_response('key', 'assign', 200, b'{"orders":[]}')
+        replayed = await db.claim_response('key', 'assign', b'request')
+
+        await db.release_response('key', 'complete')
+        released = await db.claim_response('key', 'complete', b'other')
+        return first, in_progress, other_endpoint, replayed, released
+
+    assert run(backend, scenario) == (
+        None, (b'request', None, None), None, (b'request', 200, b'{"orders":[]}'), None)
+
+
+@pytest.mark.parametrize(
+    'backend', BACKENDS
+)
+def test_expired_responses(backend):
+    async def scenario(db):
+        db._responses_ttl = 0
+        await db.claim_response('key', 'assign', b'request')
+        await db.save_response('key', 'assign', 200, b'{}')
+        expired = await db.claim_response('key', 'assign', b'request')
+
+        db._responses_ttl, db._responses_max_count = 60, 2
+        for key in ('first', 'second', 'third'):
+            await db.claim_response(key, 'assign', b'request')
+        await db.purge_responses()
+        first = await db.claim_response('first', 'assign', b'other')
+        third = await db.claim_response('third', 'assign', b'other')
+        return expired, first, third
+
+    # only the newest keys are kept
+    assert run(backend, scenario) == (None, None, (b'request', None, None))
+
+
+@pytest.mark.parametrize(
+    'backend', BACKENDS
+)
+def test_lost_requests_are_reclaimed(backend):
+    async def scenario(db):
+        db._responses_lock_timeout = 0
+        await db.claim_response('lost', 'assign', b'request')
+        reclaimed = await db.claim_response('lost', 'assign', b'retry')
+
+        await db.claim_response('key', 'assign', b'request')
+        await db.save_response('key', 'assign', 200, b'{}')
+        replayed = await db.claim_response('key', 'assign', b'request')
+        return reclaimed, replayed
+
+    # only responses being handled are reclaimed
+    assert run(backend, scenario) == (None, (b'request', 200, b'{}'))
+
+
+def test_retries_are_replayed():
+    db = MemoryDatabase()
+    with mock.patch.object(app, 'db', db), \
+            mock.patch.object(db, 'assign_orders', wraps=db.assign_orders) as assign_orders:
+        app.test_client.post('/couriers', json={"data": [{
+            "courier_id": 1, "courier_type": 'foot',
+            "regions": [1], "working_hours": ['09:00-18:00']
+        }]})
+        app.test_client.post('/orders', json={"data": [{
+            "order_id": 1, "weight": 1, "region": 1, "delivery_hours": ['10:00-11:00']
+        }]})
+
+        headers = {IDEMPOTENCY_HEADER: 'retried'}
+        _, first = app.test_client.post(
+            '/orders/assign', json={"courier_id": 1}, headers=headers)
+        _, retry = app.test_client.post(
+            '/orders/assign', json={"courier_id": 1}, headers=headers)
+        _, other = app.test_client.post(
+            '/orders/assign', json={"courier_id": 2}, headers=headers)
+        _, not_keyed = app.test_client.post('/orders/assign', json={"courier_id": 1})
+
+    assert first.status == retry.status == 200
+    assert first.json['orders'] == [{"id": 1}]
+    assert retry.json == first.json
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert other.status == 422
+    assert not_keyed.json == {"orders": []}
+    assert assign_orders.await_count == 2
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
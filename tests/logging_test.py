@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import logging
+import os
+from logging.handlers import RotatingFileHandler
+
+import pytest
+
+from src.db_api import shorten_query
+from src.logging_config import ProcessFileHandler, QueueingHandler
+
+
+def file_handler(path,
+                 max_bytes: int = 0) -> QueueingHandler:
+    handler = QueueingHandler(
+        RotatingFileHandler, filename=path, maxBytes=max_bytes, backupCount=2)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    return handler
+
+
+def record(message: str) -> logging.LogRecord:
+    return logging.LogRecord(
+        'test', logging.INFO, __file__, 0, message, None, None)
+
+
+def test_queueing_handler_writes_in_order(tmp_path):
+    path = tmp_path / "test.log"
+    handler = file_handler(path)
+
+    for i in range(100):
+        handler.handle(record(f"message {i}"))
+    handler.close()
+
+    assert path.read_text().splitlines() == [
+        f"INFO message {i}"
+        for i in range(100)
+    ]
+
+
+def test_queueing_handler_rotates(tmp_path):
+    path = tmp_path / "test.log"
+    handler = file_handler(path, max_bytes=100)
+
+    for i in range(20):
+        handler.handle(record(f"message {i}"))
+    handler.close()
+
+    assert path.stat().st_size <= 100
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "test.log", "test.log.1", "test.log.2"
+    ]
+
+
+def test_queueing_handler_restarts_after_fork(tmp_path):
+    path = tmp_path / "test.log"
+    handler = file_handler(path)
+
+    handler.handle(record("parent"))
+    listener = handler._listener
+    # as if the process was forked
+    handler._pid = -1
+    handler.handle(record("child"))
+    handler.close()
+    listener.stop()
+
+    assert handler._listener is None
+    assert path.read_text().splitlines() == ["INFO parent", "INFO child"]
+
+
+def test_every_process_writes_its_own_file(tmp_path):
+    handler = QueueingHandler(ProcessFileHandler, filename=tmp_path / "test.log", delay=True)
+
+    handler.handle(record("message"))
+    handler.close()
+
+    assert [p.name for p in tmp_path.iterdir()] == [f"test.{os.getpid()}.log"]
+
+
+@pytest.mark.parametrize(
+    ('query', 'max_length', 'expected'), (
+        ("SELECT\n    *\nFROM\n    orders\n;", 200, "SELECT * FROM orders ;"),
+        ("SELECT\n    *\nFROM\n    orders\n;", 10, "SELECT... (30 chars)"),
+        ("", 10, ""),
+    )
+)
+def test_shorten_query(query, max_length, expected):
+    assert shorten_query(query, max_length) == expected
+
+
+def test_shorten_query_is_bounded():
+    query = "INSERT INTO orders VALUES " + "(1, 1.0, 1), " * 100_000
+
+    assert len(shorten_query(query, 200)) < 250
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import random
+
+import pytest
+
+from src.db_api import _Courier, _Order
+from src.matching import OrdersBatch
+from tests.random_data import random_courier, random_order
+
+
+@pytest.mark.parametrize(
+    'seed', range(10)
+)
+def test_match_as_is_order_valid(seed):
+    rnd = random.Random(seed)
+    orders = [
+        random_order(order_id, rnd)
+        for order_id in range(1, 1001)
+    ]
+    courier = _Courier(random_courier(1, rnd))
+
+    expected = [
+        order['order_id']
+        for order in orders
+        if courier.is_order_valid(_Order(order))
+    ]
+    matched = [
+        orders[index]['order_id']
+        for index in OrdersBatch(orders).match(courier)
+    ]
+
+    assert matched == expected
+
+
+def test_match_with_no_orders():
+    courier = _Courier(random_courier(1, random.Random(0)))
+
+    assert OrdersBatch([]).match(courier) == []
+
+
+def test_match_on_bounds():
+    orders = [
+        {"order_id": 1, "weight": 10, "region": 1, "delivery_hours": ["10:00-11:00"]},
+        {"order_id": 2, "weight": 10.01, "region": 1, "delivery_hours": ["10:00-11:00"]},
+        {"order_id": 3, "weight": 10, "region": 2, "delivery_hours": ["10:00-11:00"]},
+        {"order_id": 4, "weight": 10, "region": 1, "delivery_hours": ["11:00-12:00"]},
+        {"order_id": 5, "weight": 10, "region": 1, "delivery_hours": ["08:00-09:00", "10:59-12:00"]},
+    ]
+    courier = _Courier({
+        "courier_id": 1, "type": "foot", "regions": [1],
+        "working_hours": ["09:00-11:00"], "c": 2, "payload": 10
+    })
+
+    assert OrdersBatch(orders).match(courier) == [0, 4]
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
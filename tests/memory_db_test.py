@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+The same scenarios against MemoryDatabase and, if TEST_DB_DSN is set,
+against Database, whose data is lost, to check they behave the same.
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import timedelta
+
+import pytest
+
+from src.db_api import Database, parse_date
+from src.memory_db import MemoryDatabase
+from src.model import CourierModel, OrderModel
+from tests.random_data import random_order
+
+logging.disable(logging.CRITICAL)
+
+TEST_DB_DSN = os.environ.get('TEST_DB_DSN')
+
+BACKENDS = [
+    'memory',
+    pytest.param('postgres', marks=pytest.mark.skipif(
+        not TEST_DB_DSN, reason="TEST_DB_DSN is not set"))
+]
+
+
+def courier(courier_id: int,
+            courier_type: str = 'foot',
+            regions: list = None,
+            working_hours: list = None) -> CourierModel:
+    return CourierModel(
+        courier_id=courier_id,
+        courier_type=courier_type,
+        regions=regions or [1],
+        working_hours=working_hours or ['09:00-18:00']
+    )
+
+
+def order(order_id: int,
+          weight: float,
+          region: int = 1,
+          delivery_hours: list = None) -> OrderModel:
+    return OrderModel(
+        order_id=order_id,
+        weight=weight,
+        region=region,
+        delivery_hours=delivery_hours or ['10:00-11:00']
+    )
+
+
+def run(backend: str,
+        scenario,
+        packing: str = 'greedy'):
+    async def main():
+        if backend == 'memory':
+            db = MemoryDatabase(packing=packing)
+        else:
+            db = Database(packing=packing, dsn=TEST_DB_DSN)
+        await db.connect()
+        try:
+            await db.migrate()
+            return await scenario(db)
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+def ids(orders: list) -> list:
+    return [order.order_id for order in orders]
+
+
+@pytest.mark.parametrize(
+    'backend', BACKENDS
+)
+def test_assign_valid_orders_into_capacity(backend):
+    async def scenario(db):
+        await db.add_couriers([courier(1), courier(2, regions=[2])])
+        await db.add_orders([
+            order(1, 4), order(2, 11), order(3, 5, region=2),
+            order(4, 5, delivery_hours=['19:00-20:00']), order(5, 3), order(6, 4)
+        ])
+
+        first, assign_time = await db.assign_orders(1)
+        second, _ = await db.assign_orders(1)
+        other, _ = await db.assign_orders(2)
+        unknown = await db.assign_orders(3)
+
+        return ids(first), bool(assign_time), ids(second), ids(other), unknown
+
+    assert run(backend, scenario) == ([1, 5], True, [], [3], ([], ''))
+
+
+@pytest.mark.parametrize(
+    'backend', BACKENDS
+)
+def test_complete_delivery(backend):
+    async def scenario(db):
+        await db.add_couriers([courier(1, 'bike')])
+        await db.add_orders([order(1, 1), order(2, 1, region=1)])
+        _, assign_time = await db.assign_orders(1)
+        assigned = parse_date(assign_time)
+
+        await db.complete_order(1, assigned + timedelta(minutes=10))
+        half = await db.courier_with_stats(1)
+        await db.complete_order(2, assigned + timedelta(minutes=40))
+        # completed once
+        await db.complete_order(2, assigned + timedelta(minutes=50))
+        done = await db.courier_with_stats(1)
+
+        status = await db.courier_status(1)
+        return half[1:], done[1:], sorted(
+            (s.order_id, s.completed_time - assigned) for s in status.statuses)
+
+    half, done, statuses = run(backend, scenario)
+
+    assert half == (4.17, 0)
+    # the average of 10 and 30 minutes
+    assert done == (3.33, 2500)
+    assert statuses == [(1, timedelta(minutes=10)), (2, timedelta(minutes=40))]
+
+
+@pytest.mark.parametrize(
+    'backend', BACKENDS
+)
+def test_complete_out_of_order(backend):
+    async def scenario(db):
+        await db.add_couriers([courier(1, 'bike', regions=[1, 2])])
+        await db.add_orders([order(1, 1), order(2, 1, region=2), order(3, 1)])
+        _, assign_time = await db.assign_orders(1)
+        assigned = parse_date(assign_time)
+
+        # a retry of the first completion comes last
+        for order_id, minutes in ((3, 50), (2, 30), (1, 10)):
+            await db.complete_order(order_id, assigned + timedelta(minutes=minutes))
+
+        return (await db.courier_with_stats(1))[1:], await db.check_courier_region_stats()
+
+    # 10 and 20 minutes in the region 1, 20 minutes in the region 2
+    assert run(backend, scenario) == ((3.75, 2500), [])
+
+
+@pytest.mark.parametrize(
+    'backend', BACKENDS
+)
+def test_update_courier_cancels_orders(backend):
+    async def scenario(db):
+        await db.add_couriers([courier(1, 'car', regions=[1, 2]), courier(2, regions=[2])])
+        await db.add_orders([order(1, 2), order(2, 2, region=2), order(3, 20)])
+        assigned, assign_time = await db.assign_orders(1)
+        await db.complete_order(1, parse_date(assign_time) + timedelta(minutes=5))
+
+        updated = await db.update_courier(courier_id=1, courier_type='foot', regions=[1])
+        left = await db.courier_status(1)
+        reassigned, _ = await db.assign_orders(2)
+        order_status = await db.order_status(2)
+
+        return (ids(assigned), updated.payload, updated.regions, ids(left.orders),
+                ids(reassigned), order_status.courier.courier_id,
+                (await db.courier_with_stats(1))[2])
+
+    # the rest of the delivery is completed, so it's paid with c=9
+    assert run(backend, scenario) == ([1, 2, 3], 10, [1], [1], [2], 2, 4500)
+
+
+@pytest.mark.parametrize(
+    'backend', BACKENDS
+)
+def test_dispatch(backend):
+    async def scenario(db):
+        await db.add_couriers([courier(1, 'car', regions=[1, 2]), courier(2, regions=[1])])
+        await db.add_orders([order(1, 5), order(2, 5, region=2), order(3, 8)])
+
+        not_found = await db.dispatch([1, 3])
+        dispatched = await db.dispatch([1, 2])
+
+        return not_found, {
+            courier_id: ids(orders)
+            for courier_id, (orders, _) in dispatched.items()
+        }
+
+    # the foot courier is able to deliver fewer orders, he chooses first
+    assert run(backend, scenario) == ({1: ([], '')}, {1: [2, 3], 2: [1]})
+
+
+@pytest.mark.parametrize(
+    'backend', BACKENDS
+)
+def test_duplicates_are_rejected(backend):
+    async def scenario(db):
+        await db.add_orders([order(1, 1)])
+        with pytest.raises(Exception):
+            await db.add_orders([order(2, 1), order(1, 1)])
+        with pytest.raises(RuntimeError):
+            async with db.ingestion('orders') as add:
+                await add([order(3, 1)])
+                raise RuntimeError
+        return ids(await db.get_orders([1, 2, 3]))
+
+    assert run(backend, scenario) == [1]
+
+
+@pytest.mark.skipif(not TEST_DB_DSN, reason="TEST_DB_DSN is not set")
+def test_ingestion_acquires_connection_with_first_chunk():
+    async def scenario(db):
+        def in_use() -> int:
+            size, idle = db.pool_stats()
+            return size - idle
+
+        # the connection of the migration is released in the background
+        for _ in range(100):
+            if not in_use():
+                break
+            await asyncio.sleep(0.01)
+
+        async with db.ingestion('orders') as add:
+            before = in_use()
+            await add([order(1, 1)])
+            after = in_use()
+        return before, after, in_use()
+
+    assert run('postgres', scenario) == (0, 1, 0)
+
+
+async def random_scenario(db) -> tuple:
+    rnd = random.Random(7)
+    await db.add_couriers([
+        courier(courier_id, rnd.choice(['foot', 'bike', 'car']),
+                rnd.sample(range(1, 20), 5), ['00:00-23:59'])
+        for courier_id in range(1, 21)
+    ])
+    await db.add_orders([
+        OrderModel(**random_order(order_id, rnd))
+        for order_id in range(1, 1001)
+    ])
+
+    assigned = {}
+    for _ in range(2):
+        for courier_id in range(1, 21):
+            orders, assign_time = await db.assign_orders(courier_id)
+            assigned.setdefault(courier_id, []).extend(ids(orders))
+
+            completed = list(enumerate(orders[:len(orders) // 2], start=rnd.randrange(1, 30)))
+            # not in the order of the completed times
+            rnd.shuffle(completed)
+            for minutes, order_ in completed:
+                await db.complete_order(order_.order_id, parse_date(assign_time) +
+                                        timedelta(minutes=minutes))
+
+    stats = [
+        (await db.courier_with_stats(courier_id))[1:]
+        for courier_id in range(1, 21)
+    ]
+    return assigned, stats, await db.check_courier_region_stats()
+
+
+@pytest.mark.skipif(not TEST_DB_DSN, reason="TEST_DB_DSN is not set")
+@pytest.mark.parametrize(
+    'packing', ('greedy', 'knapsack')
+)
+def test_same_as_database(packing):
+    memory = run('memory', random_scenario, packing)
+
+    assert memory == run('postgres', random_scenario, packing)
+    assert memory[2] == []
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import os
+
+import pytest
+
+from src.metrics import Registry, Histogram, Counter, timed, merge, render
+
+
+def test_histogram_buckets():
+    histogram = Histogram('duration', "Duration", labels=('route',), buckets=(1, 5))
+    for value in (0.5, 1, 3, 5, 10):
+        histogram.observe(value, route='/a')
+
+    assert histogram.snapshot()["samples"] == [[['/a'], [2, 2, 1, 19.5]]]
+
+
+def test_render_histogram():
+    histogram = Histogram('duration', "Duration", labels=('route',), buckets=(1, 5))
+    for value in (0.5, 3, 10):
+        histogram.observe(value, route='/a"b')
+
+    assert render({"duration": histogram.snapshot()}) == (
+        '# HELP duration Duration\n'
+        '# TYPE duration histogram\n'
+        'duration_bucket{route="/a\\"b",le="1"} 1\n'
+        'duration_bucket{route="/a\\"b",le="5"} 2\n'
+        'duration_bucket{route="/a\\"b",le="+Inf"} 3\n'
+        'duration_sum{route="/a\\"b"} 13.5\n'
+        'duration_count{route="/a\\"b"} 3\n'
+    )
+
+
+def test_merge_workers():
+    first = Histogram('duration', "Duration", buckets=(1,))
+    second = Histogram('duration', "Duration", buckets=(1,))
+    first.observe(0.5)
+    second.observe(2)
+    first_counter, second_counter = Counter('total', "Total", ('kind',)), Counter('total', "Total", ('kind',))
+    first_counter.inc(kind='a')
+    second_counter.inc(2, kind='a')
+    second_counter.inc(kind='b')
+
+    merged = merge([
+        {"duration": first.snapshot(), "total": first_counter.snapshot()},
+        {"duration": second.snapshot(), "total": second_counter.snapshot()}
+    ])
+
+    assert merged["duration"]["samples"] == [[[], [1, 1, 2.5]]]
+    assert merged["total"]["samples"] == [[['a'], 3], [['b'], 1]]
+
+
+def test_registry_reads_alive_workers(tmp_path):
+    registry = Registry(tmp_path)
+    total = registry.counter('total', "Total")
+    total.inc(5)
+
+    # a worker alive and a dead one
+    alive_pid, dead_pid = os.getppid(), 2 ** 22 + 1
+    for pid in (alive_pid, dead_pid):
+        (tmp_path / f"{pid}.json").write_text(json.dumps(registry.snapshot()))
+
+    # this worker and the alive one
+    assert 'total 10' in registry.render()
+    assert not (tmp_path / f"{dead_pid}.json").exists()
+
+    registry.remove()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [f"{alive_pid}.json"]
+
+
+def test_registry_collectors(tmp_path):
+    registry = Registry(tmp_path)
+    size = registry.gauge('size', "Size")
+    registry.add_collector(lambda: size.set(7))
+
+    assert registry.snapshot()["size"]["samples"] == [[[], 7]]
+    with pytest.raises(ValueError):
+        registry.gauge('size', "Size")
+
+
+def test_timed():
+    histogram = Histogram('duration', "Duration", labels=('method',))
+
+    @timed(histogram, method='fail')
+    async def fail():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        asyncio.run(fail())
+
+    (labels, (*counts, _)), = histogram.snapshot()["samples"]
+    assert labels == ['fail'] and sum(counts) == 1
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
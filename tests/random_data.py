@@ -0,0 +1,55 @@
+"""
+Random couriers, orders and weights shared by tests and benchmarks.
+"""
+import random
+
+
+def random_span(rnd: random.Random) -> str:
+    start = rnd.randrange(0, 23 * 60)
+    stop = rnd.randrange(start + 1, 24 * 60)
+
+    return f"{start // 60:02}:{start % 60:02}-{stop // 60:02}:{stop % 60:02}"
+
+
+def random_order(order_id: int,
+                 rnd: random.Random) -> dict:
+    return {
+        "order_id": order_id,
+        "weight": round(rnd.uniform(0.01, 50), 2),
+        "region": rnd.randrange(1, 20),
+        "delivery_hours": [
+            random_span(rnd)
+            for _ in range(rnd.randrange(1, 4))
+        ]
+    }
+
+
+def random_courier(courier_id: int,
+                   rnd: random.Random) -> dict:
+    """ A courier row with the fields of his type """
+    return {
+        "courier_id": courier_id,
+        "type": "bike",
+        "regions": rnd.sample(range(1, 20), rnd.randrange(0, 6)),
+        "working_hours": [
+            random_span(rnd)
+            for _ in range(rnd.randrange(0, 4))
+        ],
+        "c": 5,
+        "payload": rnd.choice([10, 15, 50])
+    }
+
+
+def random_courier_item(courier_id: int,
+                        rnd: random.Random) -> dict:
+    """ A courier item of POST /couriers payloads """
+    courier = random_courier(courier_id, rnd)
+    courier['courier_type'] = rnd.choice(['foot', 'bike', 'car'])
+    for field in ('type', 'c', 'payload'):
+        courier.pop(field)
+    return courier
+
+
+def random_weights(size: int,
+                   rnd: random.Random) -> list:
+    return [round(rnd.uniform(0.01, 50), 2) for _ in range(size)]
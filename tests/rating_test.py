@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import pytest
+
+from src.db_api import rating, compare_region_stats
+
+
+@pytest.mark.parametrize(
+    ('min_average_duration', 'expected'), (
+        (0, 5),
+        (450, 4.38),
+        (1800, 2.5),
+        (3600, 0),
+        (7200, 0),
+    )
+)
+def test_rating(min_average_duration, expected):
+    assert rating(min_average_duration) == expected
+
+
+def stats(courier_id: int,
+          region: int,
+          duration_sum: float,
+          deliveries_count: int) -> dict:
+    return {
+        "courier_id": courier_id,
+        "region": region,
+        "duration_sum": duration_sum,
+        "deliveries_count": deliveries_count
+    }
+
+
+def test_consistent_region_stats():
+    stored = [stats(1, 1, 600., 2), stats(1, 2, 120., 1)]
+    computed = [stats(1, 2, 120.0001, 1), stats(1, 1, 600., 2)]
+
+    assert compare_region_stats(stored, computed) == []
+
+
+def test_inconsistent_region_stats():
+    stored = [stats(1, 1, 600., 2), stats(1, 2, 120., 1), stats(2, 1, 60., 1)]
+    computed = [stats(1, 1, 600., 3), stats(1, 2, 100., 1), stats(3, 1, 60., 1)]
+
+    assert compare_region_stats(stored, computed) == [
+        {"courier_id": 1, "region": 1, "stored": (600., 2), "computed": (600., 3)},
+        {"courier_id": 1, "region": 2, "stored": (120., 1), "computed": (100., 1)},
+        {"courier_id": 2, "region": 1, "stored": (60., 1), "computed": None},
+        {"courier_id": 3, "region": 1, "stored": None, "computed": (60., 1)},
+    ]
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
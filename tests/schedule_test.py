@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+from datetime import datetime
+
+import pytest
+
+from src.schedule import DaySchedule, TimeSpan, parse_span
+
+
+def strptime_span(value: str):
+    start, stop = value.split('-')
+
+    start = datetime.strptime(start, "%H:%M").time()
+    stop = datetime.strptime(stop, "%H:%M").time()
+
+    if start >= stop:
+        raise ValueError
+
+    return start.hour * 60 + start.minute, stop.hour * 60 + stop.minute
+
+
+@pytest.mark.parametrize(
+    'value', (
+        '00:00-23:59', '9:05-10:00', '09:5-9:6', '1:00-2:00',
+        '12:35_12:36', '12.00-13.00', '27:00-12:00', '12:56-13:66',
+        '12:00-06:59', '', '12:00-12:00', '9:00-10:00-11:00',
+        ' 9:00-10:00', '09:00 -10:00', '24:00-24:30', '-',
+        '009:00-10:00', '19:60-20:00', 'aa:bb-cc:dd'
+    )
+)
+def test_parse_span_as_strptime(value):
+    try:
+        expected = strptime_span(value)
+    except ValueError:
+        with pytest.raises(ValueError):
+            parse_span(value)
+    else:
+        assert parse_span(value) == expected
+
+
+def test_time_span_mask():
+    span = TimeSpan('00:01-00:03')
+
+    assert span.mask == 0b110
+
+
+@pytest.mark.parametrize(
+    ('working_hours', 'delivery_hours', 'result'), (
+        (['09:00-11:00', '20:00-22:00'], ['11:00-12:00', '19:00-20:00'], False),
+        (['09:00-11:00', '20:00-22:00'], ['11:00-12:00', '19:00-20:01'], True),
+        (['09:00-11:00'], ['10:59-23:00'], True),
+        (['00:00-23:59'], ['23:58-23:59'], True),
+        ([], ['10:00-11:00'], False),
+        (['10:00-11:00'], [], False),
+    )
+)
+def test_schedule_intercepting(working_hours, delivery_hours, result):
+    working, delivery = DaySchedule(working_hours), DaySchedule(delivery_hours)
+
+    expected = any(
+        TimeSpan(w) | TimeSpan(d)
+        for w in working_hours
+        for d in delivery_hours
+    )
+
+    assert expected is result
+    assert working & delivery is delivery & working is result
+    assert working.is_intercept(delivery) is result
+
+
+def test_schedule_from_spans():
+    spans = ['09:00-11:00', '20:00-22:00']
+
+    assert DaySchedule(spans) == DaySchedule(map(TimeSpan, spans))
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
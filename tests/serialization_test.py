@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from src.db_api import _Courier, _Order, _Status
+from src.serialization import make_dumps, json_response, JSON_ENCODERS
+
+
+def text(dumped) -> str:
+    # orjson returns bytes
+    return dumped.decode() if isinstance(dumped, bytes) else dumped
+
+
+COURIER = _Courier({
+    "courier_id": 1, "type": 'bike', "regions": [1, 2],
+    "working_hours": ['09:00-18:00'], "c": 5, "payload": 15
+})
+ORDER = _Order({
+    "order_id": 2, "weight": 1.5, "region": 1, "delivery_hours": ['10:00-11:00']
+})
+STATUS = _Status({
+    "id": 3, "courier_id": 1, "order_id": 2, "delivery_id": 4,
+    "assigned_time": datetime(2021, 3, 28, 10, 0, tzinfo=timezone.utc)
+})
+
+
+@pytest.mark.parametrize(
+    'encoder', JSON_ENCODERS
+)
+def test_database_objects(encoder):
+    pytest.importorskip(encoder)
+    dumps = make_dumps(encoder, indent=False)
+
+    assert json.loads(dumps({"courier": COURIER, "orders": [ORDER], "status": STATUS})) == {
+        "courier": {"courier_id": 1, "courier_type": 'bike',
+                    "regions": [1, 2], "working_hours": ['09:00-18:00']},
+        "orders": [{"order_id": 2, "weight": 1.5, "region": 1,
+                    "delivery_hours": ['10:00-11:00']}],
+        "status": {"id": 3, "courier_id": 1, "order_id": 2, "delivery_id": 4,
+                   "assigned_time": '2021-03-28T10:00:00.000000Z', "completed_time": None}
+    }
+
+
+@pytest.mark.parametrize(
+    'encoder', JSON_ENCODERS
+)
+def test_indented_only_if_asked(encoder):
+    pytest.importorskip(encoder)
+    data = {"orders": [{"id": 1}, {"id": 2}], "assign_time": 'now'}
+
+    compact = make_dumps(encoder, indent=False)(data)
+    indented = make_dumps(encoder, indent=True)(data)
+
+    assert '\n' not in text(compact) and '\n' in text(indented)
+    assert json.loads(compact) == json.loads(indented) == data
+
+
+@pytest.mark.parametrize(
+    'encoder', JSON_ENCODERS
+)
+def test_not_serializable(encoder):
+    pytest.importorskip(encoder)
+
+    with pytest.raises(TypeError):
+        make_dumps(encoder)({"value": object()})
+
+
+def test_unknown_encoder():
+    with pytest.raises(ValueError):
+        make_dumps('simplejson')
+
+
+def test_response():
+    resp = json_response({"order_id": 1}, status=201)
+
+    assert resp.status == 201
+    assert resp.content_type == 'application/json'
+    assert json.loads(resp.body) == {"order_id": 1}
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
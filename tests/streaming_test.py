@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+
+import pytest
+
+from src.streaming import iter_json_array, JsonStreamError
+
+
+async def chunks(data: bytes,
+                 size: int):
+    for index in range(0, len(data), size):
+        yield data[index:index + size]
+
+
+def parse(data: bytes,
+          size: int,
+          key: str = 'data') -> list:
+    async def collect():
+        return [
+            item
+            async for item in iter_json_array(chunks(data, size), key)
+        ]
+    return asyncio.run(collect())
+
+
+TEST_DOCUMENT = {
+    "before": [1, {"data": "}],["}],
+    "data": [
+        {"order_id": 1, "weight": 0.23, "region": 12,
+         "delivery_hours": ["09:00-18:00"]},
+        {"order_id": 2, "weight": 15, "region": 1,
+         "delivery_hours": ["09:00-18:00"], "comment": "ёлка"},
+        {"order_id": 3, "weight": 0.01, "region": 22,
+         "delivery_hours": ["09:00-12:00", "16:00-21:30"]},
+        12345,
+    ],
+    "after": 67890
+}
+
+
+@pytest.mark.parametrize(
+    'size', (1, 2, 3, 7, 64, 1024 ** 2)
+)
+@pytest.mark.parametrize(
+    'indent', (None, 4)
+)
+def test_items(size, indent):
+    data = json.dumps(TEST_DOCUMENT, ensure_ascii=False, indent=indent)
+
+    assert parse(data.encode(), size) == TEST_DOCUMENT['data']
+
+
+@pytest.mark.parametrize(
+    ('data', 'expected'), (
+        (b'{"data": []}', []),
+        (b'{"data": [1, 22, 333]}', [1, 22, 333]),
+        (b' { "data" : [ "a" , "b" ] } ', ['a', 'b']),
+    )
+)
+def test_simple_arrays(data, expected):
+    assert parse(data, 1) == expected
+
+
+@pytest.mark.parametrize(
+    'data', (
+        b'', b'[1]', b'{"data": [1, 2', b'{"data": [1 2]}',
+        b'{"data": [{"order_id": }]}', b'{"data": 1}'
+    )
+)
+def test_invalid_json(data):
+    with pytest.raises(JsonStreamError):
+        parse(data, 3)
+
+
+def test_no_key():
+    with pytest.raises(KeyError):
+        parse(b'{"orders": [1, 2]}', 3)
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
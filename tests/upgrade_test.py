@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Upgrade of a database created by the first version.
+
+The database is migrated, so all its data is lost. It's
+used only if TEST_DB_DSN is set, the tests are skipped otherwise.
+"""
+import asyncio
+import logging
+import os
+from datetime import timedelta
+
+import pytest
+
+from src.db_api import Database, parse_date
+from src.db_commands import TABLES
+
+logging.disable(logging.CRITICAL)
+
+TEST_DB_DSN = os.environ.get('TEST_DB_DSN')
+
+# the schema and data of the first version,
+# times are VARCHAR in the API format
+FIRST_VERSION = """
+CREATE TABLE courier_types (
+    id SERIAL PRIMARY KEY,
+    type VARCHAR(5) NOT NULL,
+    c INTEGER NOT NULL,
+    payload INTEGER NOT NULL
+);
+CREATE TABLE couriers (
+    courier_id SERIAL PRIMARY KEY,
+    courier_type INTEGER REFERENCES courier_types (id) NOT NULL,
+    regions INTEGER[],
+    working_hours VARCHAR[]
+);
+CREATE TABLE orders (
+    order_id SERIAL PRIMARY KEY,
+    weight REAL NOT NULL,
+    region INTEGER NOT NULL,
+    delivery_hours VARCHAR[] NOT NULL
+);
+CREATE TABLE status (
+    id SERIAL PRIMARY KEY,
+    courier_id INTEGER REFERENCES couriers (courier_id) NOT NULL,
+    order_id INTEGER REFERENCES orders (order_id) NOT NULL,
+    assigned_time VARCHAR,
+    completed_time VARCHAR
+);
+INSERT INTO courier_types (type, c, payload) VALUES ('foot', 2, 10), ('bike', 5, 15), ('car', 9, 50);
+INSERT INTO couriers VALUES (1, 2, '{1, 2}', '{"09:00-18:00"}');
+INSERT INTO orders VALUES
+    (1, 1, 1, '{"10:00-11:00"}'), (2, 1, 2, '{"10:00-11:00"}'), (3, 1, 1, '{"10:00-11:00"}');
+INSERT INTO status (courier_id, order_id, assigned_time, completed_time) VALUES
+    (1, 1, '2021-03-28T10:00:00.000000Z', '2021-03-28T10:10:00.000000Z'),
+    (1, 2, '2021-03-28T10:00:00.000000Z', '2021-03-28T10:30:00.000000Z'),
+    (1, 3, '2021-03-28T12:00:00.000000Z', NULL);
+"""
+
+
+@pytest.mark.skipif(not TEST_DB_DSN, reason="TEST_DB_DSN is not set")
+def test_upgrade_first_version():
+    async def scenario():
+        db = Database(dsn=TEST_DB_DSN)
+        await db.connect()
+        try:
+            async with db._acquire() as conn:
+                for table in TABLES:
+                    await conn.execute(f"DROP TABLE IF EXISTS {table} CASCADE;")
+                await conn.execute(FIRST_VERSION)
+
+            await db.upgrade()
+            # upgrading the current version changes nothing
+            await db.upgrade()
+            upgraded = await db.courier_with_stats(1)
+            deliveries = await db.get(
+                "SELECT delivery_id, count(*) FROM status GROUP BY delivery_id ORDER BY 1;")
+
+            await db.complete_order(
+                3, parse_date('2021-03-28T12:00:00.000000Z') + timedelta(minutes=5))
+            completed = await db.courier_with_stats(1)
+
+            return upgraded[1:], [tuple(row) for row in deliveries], \
+                completed[1:], await db.check_courier_region_stats()
+        finally:
+            await db.close()
+
+    upgraded, deliveries, completed, mismatches = asyncio.run(scenario())
+
+    # 10 minutes in the region 1, 20 minutes in the region 2,
+    # the first delivery is paid with the bike coefficient
+    assert upgraded == (4.17, 2500)
+    assert deliveries == [(1, 2), (2, 1)]
+    # 5 minutes more in the region 1
+    assert completed == (4.38, 5000)
+    assert mismatches == []
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import itertools
+import random
+
+import pytest
+from pydantic import ValidationError
+
+from src.model import CourierModel, OrderModel, \
+    COURIERS_VALIDATOR, ORDERS_VALIDATOR
+
+
+IDS = [1, 12, 0, -1, 1.0, 12.5, '12', True, None, [1]]
+TYPES = ['foot', 'Bike', 'CAR', 'fot', '', 1, None, ['car']]
+REGIONS = [[], [1, 2], [1, 0], [1, -2], [1.0], ['1'], [True], 1, '1', None, {"1": 1}]
+HOURS = [
+    [], ['09:00-18:00'], ['9:00-18:00', '20:10-23:42'], ['12:00-06:59'],
+    ['12_55-13_10'], ['24:00-24:30'], [900], [None], '09:00-18:00', None
+]
+WEIGHTS = [0.01, 50, 13.56, '13.56', ' 2 ', 0, 0.009, 51, -1, True, 'nan', 'inf', None, [1], '']
+
+
+def pydantic_ids(model, id_field, items):
+    valid, invalid = [], []
+    for item in items:
+        try:
+            valid += [model(**item)]
+        except ValidationError:
+            invalid += [item.get(id_field, -1)]
+    return valid, invalid
+
+
+def random_items(fields: dict,
+                 size: int,
+                 seed: int) -> list:
+    rnd = random.Random(seed)
+    items = []
+    for _ in range(size):
+        item = {
+            field: rnd.choice(values)
+            for field, values in fields.items()
+        }
+        if rnd.random() < 0.05:
+            item.pop(rnd.choice(list(item)))
+        if rnd.random() < 0.05:
+            item['extra'] = 1
+        items += [item]
+    return items
+
+
+@pytest.mark.parametrize(
+    'seed', range(5)
+)
+def test_couriers_as_pydantic(seed):
+    fields = {
+        "courier_id": IDS, "courier_type": TYPES,
+        "regions": REGIONS, "working_hours": HOURS
+    }
+    items = random_items(fields, 2000, seed)
+
+    expected_valid, expected_invalid = pydantic_ids(CourierModel, 'courier_id', items)
+    valid, invalid = COURIERS_VALIDATOR.validate_batch(items)
+
+    assert invalid == expected_invalid
+    assert valid == expected_valid
+    assert [c.dict() for c in valid] == [c.dict() for c in expected_valid]
+
+
+@pytest.mark.parametrize(
+    'seed', range(5)
+)
+def test_orders_as_pydantic(seed):
+    fields = {
+        "order_id": IDS, "weight": WEIGHTS,
+        "region": IDS, "delivery_hours": HOURS
+    }
+    items = random_items(fields, 2000, seed)
+
+    expected_valid, expected_invalid = pydantic_ids(OrderModel, 'order_id', items)
+    valid, invalid = ORDERS_VALIDATOR.validate_batch(items)
+
+    assert invalid == expected_invalid
+    assert [o.dict() for o in valid] == [o.dict() for o in expected_valid]
+
+
+@pytest.mark.parametrize(
+    'item', (
+        1, None, 'order', [1, 2]
+    )
+)
+def test_not_objects(item):
+    valid, invalid = ORDERS_VALIDATOR.validate_batch([item])
+
+    assert valid == []
+    assert invalid == [-1]
+
+
+def test_every_combination_of_courier_fields():
+    items = [
+        {"courier_id": 1, "courier_type": type_,
+         "regions": regions, "working_hours": hours}
+        for type_, regions, hours in itertools.product(TYPES, REGIONS, HOURS)
+    ]
+
+    expected_valid, _ = pydantic_ids(CourierModel, 'courier_id', items)
+    valid, _ = COURIERS_VALIDATOR.validate_batch(items)
+
+    assert [c.dict() for c in valid] == [c.dict() for c in expected_valid]
+
+
+if __name__ == "__main__":
+    pytest.main(['-svv'])